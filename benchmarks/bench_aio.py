@@ -0,0 +1,95 @@
+"""
+Benchmark for serving many devices from one asyncio event loop: with a task per device that polls packet_available()
+on a timer (as applications did before amfiprot.aio), and with a task per device iterating AsyncDevice.stream(), which
+waits for the receive queues' notifiers.
+
+DEVICES nodes get receive queues with notifiers, as USBConnection creates them. A thread per node stands in for the
+connection's reader: it sends nothing for IDLE_SECONDS, then a sample every SAMPLE_INTERVAL seconds for STREAM_SECONDS.
+The CPU used by the process while idle and the latency from delivery to the consuming task are reported.
+
+Usage: python benchmarks/bench_aio.py
+"""
+import asyncio
+import statistics
+import threading
+import time
+
+from amfiprot import Packet, Node, AsyncDevice, StructPayload, Field, payload_registry
+
+from simulation import SimulatedConnection
+
+DEVICES = 32
+IDLE_SECONDS = 1.0
+STREAM_SECONDS = 1.0
+SAMPLE_INTERVAL = 0.01  # Seconds between samples of each device (100 Hz)
+POLL_INTERVAL = 0.001  # Seconds between packet_available() checks of the polling tasks
+
+
+@payload_registry.register
+class TimestampPayload(StructPayload):
+    PAYLOAD_TYPE = 0x10
+    PAYLOAD_ID = 0x02
+    FIELDS = (Field('sent', 'd'),)
+
+    def __init__(self, sent):
+        self.sent = sent
+
+
+def produce(node: Node, start: threading.Event, stop: threading.Event):
+    start.wait()
+
+    while not stop.wait(SAMPLE_INTERVAL):
+        frame = Packet.from_payload(TimestampPayload(time.perf_counter()), source_id=node.tx_id).to_bytes()
+        node.receive_queue.put_nowait(frame)
+
+
+async def consume_polling(node: Node, latencies: list):
+    while True:
+        if node.packet_available():
+            packet = node.get_packet()
+            latencies.append(time.perf_counter() - packet.payload.sent)
+        else:
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+async def consume_async(node: Node, latencies: list):
+    async for packet in AsyncDevice(node).stream():
+        latencies.append(time.perf_counter() - packet.payload.sent)
+
+
+async def run(consume):
+    connection = SimulatedConnection(notifiers=True)
+    nodes = [Node(tx_id, 0, connection) for tx_id in range(1, DEVICES + 1)]
+    start, stop, latencies = threading.Event(), threading.Event(), []
+
+    producers = [threading.Thread(target=produce, args=(node, start, stop)) for node in nodes]
+    for producer in producers:
+        producer.start()
+
+    consumers = [asyncio.create_task(consume(node, latencies)) for node in nodes]
+
+    cpu_start = time.process_time()
+    await asyncio.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu_start) / IDLE_SECONDS
+
+    start.set()
+    await asyncio.sleep(STREAM_SECONDS)
+    stop.set()
+
+    for consumer in consumers:
+        consumer.cancel()
+    for producer in producers:
+        producer.join()
+
+    print(f"{consume.__name__:<16} {DEVICES} devices  idle CPU {idle_cpu * 100:5.1f} %   "
+          f"{len(latencies):5d} packets, latency mean {statistics.mean(latencies) * 1e3:6.3f} ms, "
+          f"max {max(latencies) * 1e3:6.3f} ms")
+
+
+def main():
+    for consume in (consume_polling, consume_async):
+        asyncio.run(run(consume))
+
+
+if __name__ == '__main__':
+    main()
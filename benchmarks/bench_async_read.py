@@ -0,0 +1,155 @@
+"""
+Benchmark for missed reports with synchronous reads versus AsyncReader with several transfers queued.
+
+A simulated interrupt IN endpoint produces one report every REPORT_INTERVAL seconds (1 kHz, as a full-speed HID device
+polled every frame). A report is only received if a transfer was queued when it was produced, otherwise it is missed.
+Handling each report takes PROCESSING seconds, and the reading loop stalls for STALL seconds every STALL_EVERY reports,
+standing in for a garbage collection or a blocked queue put.
+
+Time is simulated (SimulatedEndpoint.now advances only by the waits and stalls above), so the result does not depend
+on the load of the machine.
+
+AsyncReader is driven by StubLibusb, which implements the handful of libusb functions it uses on top of the simulated
+endpoint, so no device is needed.
+
+Usage: python benchmarks/bench_async_read.py
+"""
+import array
+import ctypes
+
+from usb.backend.libusb1 import LIBUSB_TRANSFER_COMPLETED, LIBUSB_TRANSFER_CANCELLED, _libusb_transfer
+
+from amfiprot.usb_async import AsyncReader
+
+REPORT_INTERVAL = 0.001
+REPORTS = 3000
+PROCESSING = 0.0002
+STALL = 0.005
+STALL_EVERY = 100
+REPORT = bytes(range(64))
+
+
+class SimulatedEndpoint:
+    """ Produces report number n at ``n * REPORT_INTERVAL`` (simulated seconds). """
+    def __init__(self):
+        self.now = 0.0
+        self.next_report = 0
+        self.missed = 0
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def produced_until(self, now: float) -> int:
+        """ Number of reports produced up to ``now``. """
+        return int(now / REPORT_INTERVAL + 1e-9) + 1
+
+    def report_time(self, number: int) -> float:
+        return number * REPORT_INTERVAL
+
+
+class SyncDevice:
+    """ usb.core.Device.read() as pyusb does it: a single transfer, queued only for the duration of the call. """
+    def __init__(self, endpoint: SimulatedEndpoint):
+        self.endpoint = endpoint
+
+    def read(self, endpoint, length, timeout=None):
+        submitted = self.endpoint.now
+        first_catchable = self.endpoint.produced_until(submitted)  # Reports produced before the call are gone
+        self.endpoint.missed += max(0, first_catchable - self.endpoint.next_report)
+
+        self.endpoint.now = self.endpoint.report_time(first_catchable)
+        self.endpoint.next_report = first_catchable + 1
+        return array.array('B', REPORT)
+
+
+class StubLibusb:
+    """ The libusb functions used by AsyncReader, completing transfers from the simulated endpoint. A queued transfer
+    receives the first report produced after it was submitted. """
+    def __init__(self, endpoint: SimulatedEndpoint):
+        self.endpoint = endpoint
+        self.queued = []  # (transfer pointer, submit time)
+        self.cancelled = []
+        self.allocated = []
+
+    def libusb_alloc_transfer(self, iso_packets):
+        transfer = _libusb_transfer()
+        self.allocated.append(transfer)
+        return ctypes.pointer(transfer)
+
+    def libusb_free_transfer(self, transfer_p):
+        pass
+
+    def libusb_submit_transfer(self, transfer_p):
+        self.queued.append((transfer_p, self.endpoint.now))
+        return 0
+
+    def libusb_cancel_transfer(self, transfer_p):
+        for index, (queued_p, _) in enumerate(self.queued):
+            if ctypes.addressof(queued_p.contents) == ctypes.addressof(transfer_p.contents):
+                del self.queued[index]
+                self.cancelled.append(transfer_p)
+                return 0
+
+        return -5  # LIBUSB_ERROR_NOT_FOUND
+
+    def libusb_handle_events_timeout(self, context, timeval_p):
+        timeval = timeval_p._obj
+        timeout = timeval.tv_sec + timeval.tv_usec / 1e6
+
+        while self.cancelled:
+            self._complete(self.cancelled.pop(0), LIBUSB_TRANSFER_CANCELLED)
+
+        wait = self.endpoint.report_time(self.endpoint.next_report) - self.endpoint.now
+        self.endpoint.sleep(max(0.0, min(wait, timeout)))
+
+        for number in range(self.endpoint.next_report, self.endpoint.produced_until(self.endpoint.now)):
+            produced = self.endpoint.report_time(number)
+            ready = [entry for entry in self.queued if entry[1] <= produced]
+
+            if len(ready) == 0:
+                self.endpoint.missed += 1
+            else:
+                self.queued.remove(ready[0])
+                self._complete(ready[0][0], LIBUSB_TRANSFER_COMPLETED)  # May resubmit it, for later reports only
+
+            self.endpoint.next_report = number + 1
+
+        return 0
+
+    @staticmethod
+    def _complete(transfer_p, status):
+        transfer = transfer_p.contents
+        transfer.status = status
+        if status == LIBUSB_TRANSFER_COMPLETED:
+            ctypes.memmove(transfer.buffer, REPORT, len(REPORT))
+            transfer.actual_length = len(REPORT)
+        transfer.callback(transfer_p)
+
+
+def run(reader, endpoint: SimulatedEndpoint) -> int:
+    for count in range(REPORTS):
+        report = reader.read(0x81, 64, timeout=100)
+        assert report[5] == 5
+
+        endpoint.sleep(PROCESSING)
+        if count % STALL_EVERY == 0:
+            endpoint.sleep(STALL)
+
+    return endpoint.missed
+
+
+def main():
+    endpoint = SimulatedEndpoint()
+    missed = run(SyncDevice(endpoint), endpoint)
+    print(f"{'synchronous read':<28} missed {missed:5d} of {REPORTS + missed} reports")
+
+    for transfers in (1, 2, 4, 8):
+        endpoint = SimulatedEndpoint()
+        reader = AsyncReader(StubLibusb(endpoint), None, None, transfers=transfers)
+        missed = run(reader, endpoint)
+        reader.close()
+        print(f"{f'AsyncReader, {transfers} transfer(s)':<28} missed {missed:5d} of {REPORTS + missed} reports")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark for the receive queue policies under overload: a producer process (standing in for a connection's reader)
+offers FRAMES frames to a ReceiveQueue much faster than the consumer reads them.
+
+For each policy, the peak occupancy of the queue (memory held by unread packets), the number of frames dropped, and the
+average age of the frames the consumer gets (how many frames the producer had offered since) are reported. The first
+row is an unbounded queue, as the connections used before receive queues had a capacity.
+
+Usage: python benchmarks/bench_backpressure.py
+"""
+import multiprocessing as mp
+import queue
+import statistics
+import time
+
+from amfiprot.receive_queue import ReceiveQueue, QueuePolicy
+
+FRAMES = 20_000
+FRAME_LENGTH = 40
+PRODUCE_INTERVAL = 0.00005  # Seconds between frames (20 kHz)
+CONSUME_INTERVAL = 0.0005  # Seconds the consumer spends per frame (2 kHz)
+CAPACITY = 256
+
+
+def produce(receive_queue: ReceiveQueue, offered):
+    for index in range(FRAMES):
+        receive_queue.offer(index.to_bytes(4, 'little') + bytes(FRAME_LENGTH - 4))
+        offered.value = index + 1
+        time.sleep(PRODUCE_INTERVAL)
+
+
+def run(capacity: int, policy: QueuePolicy):
+    receive_queue = ReceiveQueue(mp.Queue(), capacity=capacity, policy=policy)
+    offered = mp.RawValue('q', 0)
+    producer = mp.Process(target=produce, args=(receive_queue, offered))
+    producer.start()
+
+    peak_frames, peak_bytes, ages, received = 0, 0, [], 0
+
+    while producer.is_alive() or not receive_queue.empty():
+        peak_frames = max(peak_frames, receive_queue.qsize())
+        peak_bytes = max(peak_bytes, receive_queue.qsize_bytes())
+
+        try:
+            frame = receive_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+        received += 1
+        ages.append(offered.value - 1 - int.from_bytes(frame[:4], 'little'))
+        time.sleep(CONSUME_INTERVAL)
+
+    producer.join()
+
+    name = 'unbounded' if capacity == 0 else f"{policy.name}, capacity {capacity}"
+    print(f"{name:<26} peak {peak_frames:6d} frames ({peak_bytes / 1024:7.1f} KiB), received {received:6d}, "
+          f"dropped {receive_queue.dropped:6d}, mean age {statistics.mean(ages):8.1f} frames")
+
+
+def main():
+    run(0, QueuePolicy.DROP_NEWEST)
+
+    for policy in (QueuePolicy.DROP_NEWEST, QueuePolicy.DROP_OLDEST, QueuePolicy.CONFLATE, QueuePolicy.BLOCK):
+        run(CAPACITY, policy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Benchmark comparing per-packet decoding with the vectorized NumPy decoder in amfiprot.batch.
+
+Usage: python benchmarks/bench_batch.py
+"""
+import array
+import time
+
+from amfiprot import Packet, ReplyFirmwareVersionPayload
+from amfiprot.batch import decode_reports
+
+COUNT = 100_000
+
+
+def make_reports(count):
+    reports = bytearray()
+    for index in range(count):
+        packet = Packet.from_payload(ReplyFirmwareVersionPayload(1, 2, 3, index), source_id=index % 4, packet_number=index % 255)
+        report = array.array('B', [0x01, len(packet)])
+        report.extend(packet.to_bytes())
+        report.extend([0] * (64 - len(report)))
+        reports.extend(report)
+    return bytes(reports)
+
+
+def main():
+    reports = make_reports(COUNT)
+
+    start = time.perf_counter()
+    builds = [Packet(reports[i:i + 64], 2).payload.fw_version['build'] for i in range(0, len(reports), 64)]
+    per_packet = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = decode_reports(reports, ReplyFirmwareVersionPayload)
+    vectorized = time.perf_counter() - start
+
+    assert list(decoded['payload']['build']) == builds
+    assert decoded['crc_ok'].all()
+
+    print(f"{'Packet per report':<30} {COUNT / per_packet:12,.0f} packets/s")
+    print(f"{'decode_reports':<30} {COUNT / vectorized:12,.0f} packets/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Micro-benchmark for decoding config values, one at a time and as a batch.
+
+Usage: python benchmarks/bench_config_values.py
+"""
+import struct
+import timeit
+
+from amfiprot.common_payload import ConfigValueType, decode_config_value, decode_config_values, RequestProcedureCall
+
+SNAPSHOT = [(ConfigValueType.UINT32, struct.pack('<I', index)) for index in range(200)] + \
+           [(ConfigValueType.FLOAT, struct.pack('<f', index / 2)) for index in range(200)] + \
+           [(ConfigValueType.INT16, struct.pack('<h', -index)) for index in range(200)]
+NUMBER = 200
+
+
+def main():
+    seconds = timeit.timeit(lambda: [decode_config_value(data_type, data) for data_type, data in SNAPSHOT], number=NUMBER)
+    print(f"{'decode_config_value, per value':<40} {seconds / NUMBER / len(SNAPSHOT) * 1e6:8.3f} us")
+
+    seconds = timeit.timeit(lambda: decode_config_values(SNAPSHOT), number=NUMBER)
+    print(f"{'decode_config_values, per value':<40} {seconds / NUMBER / len(SNAPSHOT) * 1e6:8.3f} us")
+
+    rpc = RequestProcedureCall(1, ConfigValueType.UINT8, 230, ConfigValueType.FLOAT, 1.5).to_bytes()
+    seconds = timeit.timeit(lambda: RequestProcedureCall.from_bytes(rpc), number=NUMBER * 100)
+    print(f"{'RequestProcedureCall.from_bytes':<40} {seconds / NUMBER / 100 * 1e6:8.3f} us")
+
+
+if __name__ == '__main__':
+    main()
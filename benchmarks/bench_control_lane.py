@@ -0,0 +1,113 @@
+"""
+Benchmark for request/reply calls made while a node streams data that the application has not read yet, e.g. a
+configuration read in the middle of a measurement.
+
+The USB read loop runs in a thread, driven by a simulated device that sends a sample every STREAM_INTERVAL seconds and
+replies to each request with its next report. After FILL_SECONDS of unread streaming, Device.firmware_version() is
+called REQUESTS times. With control lanes, the reply is routed to the node's control lane and the call waits on that
+only. With a single lane (as before control lanes), the call reads through the queued samples to find the reply, and
+discards them.
+
+For each, the latency of the calls and the number of samples they discarded are reported.
+
+Usage: python benchmarks/bench_control_lane.py
+"""
+import array
+import queue
+import statistics
+import threading
+import time
+
+from amfiprot import Device, Node, StructPayload, Field
+from amfiprot.common_payload import ReplyFirmwareVersionPerIdPayload, RequestFirmwareVersionPerIdPayload
+from amfiprot.usb_connection import UsbDeviceHandle, usb_read_loop
+
+from simulation import TX_ID, make_report, SimulatedConnection
+
+FILL_SECONDS = 1.0
+STREAM_INTERVAL = 0.0001  # Seconds between samples (10 kHz)
+REQUESTS = 20
+
+
+class SamplePayload(StructPayload):
+    PAYLOAD_TYPE = 0x10
+    PAYLOAD_ID = 0x01
+    FIELDS = (Field('x', 'f'), Field('y', 'f'), Field('z', 'f'))
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+class StreamingDevice:
+    """ Stands in for a usb.core.Device, streaming samples and replying to the requests put in ``requests``. """
+    def __init__(self):
+        self.sample = make_report(SamplePayload(1.0, 2.0, 3.0))
+        self.reply = make_report(ReplyFirmwareVersionPerIdPayload(1, 2, 3, 4, 0))
+        self.requests = queue.Queue()
+        self.samples_sent = 0
+
+    def read(self, endpoint, length, timeout=None):
+        try:
+            self.requests.get_nowait()
+            return array.array('B', self.reply)
+        except queue.Empty:
+            pass
+
+        time.sleep(STREAM_INTERVAL)
+        self.samples_sent += 1
+        return array.array('B', self.sample)
+
+
+def run(control_lanes: bool):
+    streaming_device = StreamingDevice()
+    node = Node(TX_ID, 0, SimulatedConnection(streaming_device.requests.put))
+    device = Device(node)
+
+    update_queue, stop_event = queue.Queue(), threading.Event()
+    if control_lanes:
+        update_queue.put({'routes': {TX_ID: 0}, 'control_routes': {TX_ID: 1}})
+
+    reader = threading.Thread(target=usb_read_loop,
+                              args=(UsbDeviceHandle(None, streaming_device), [TX_ID],
+                                    [node.receive_queue, node.control_queue], None, update_queue),
+                              kwargs={'stop_event': stop_event})
+    reader.start()
+    time.sleep(FILL_SECONDS)
+
+    latencies = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+
+        if control_lanes:
+            device.firmware_version()
+        else:  # As Device._await_packet did before control lanes
+            node.send_prepared(RequestFirmwareVersionPerIdPayload, 0)
+            device._await_any(lambda packet: type(packet.payload) == ReplyFirmwareVersionPerIdPayload, 1000,
+                              "Packet not returned.")
+
+        latencies.append(time.perf_counter() - start)
+
+    stop_event.set()
+    reader.join()
+
+    read_afterwards = 0
+    while not node.receive_queue.empty():
+        node.receive_queue.get_nowait()
+        read_afterwards += 1
+
+    discarded = streaming_device.samples_sent - node.receive_queue.dropped - read_afterwards
+
+    name = 'control lanes' if control_lanes else 'single lane'
+    print(f"{name:<14} request/reply mean {statistics.mean(latencies) * 1e3:7.2f} ms, "
+          f"max {max(latencies) * 1e3:7.2f} ms, samples discarded by the requests {discarded:6d}")
+
+
+def main():
+    for control_lanes in (False, True):
+        run(control_lanes)
+
+
+if __name__ == '__main__':
+    main()
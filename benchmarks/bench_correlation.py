@@ -0,0 +1,101 @@
+"""
+Benchmark for reading a device's whole configuration with Configurator.read_all(), with one request outstanding at a
+time (as before requests were correlated with their replies) and with a window of outstanding requests.
+
+The USB read loop runs in a thread, driven by a simulated device with CATEGORIES categories of PARAMETERS parameters.
+Each request is answered LINK_LATENCY seconds after it was sent, and the device takes PROCESS_TIME seconds per request,
+so round trips dominate when requests are sent one at a time.
+
+Usage: python benchmarks/bench_correlation.py
+"""
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+import usb.core
+
+from amfiprot import Packet, Device, Node
+from amfiprot import configurator
+from amfiprot.common_payload import *
+from amfiprot.usb_connection import UsbDeviceHandle, usb_read_loop
+
+from simulation import TX_ID, make_report, SimulatedConnection
+
+CATEGORIES = 4
+PARAMETERS = 25
+LINK_LATENCY = 0.002  # Seconds from request to reply
+PROCESS_TIME = 0.0002  # Seconds the device takes per request
+
+
+def reply_to(request):
+    if type(request) == RequestCategoryCountPayload:
+        return ReplyCategoryCountPayload(CATEGORIES)
+    if type(request) == RequestConfigurationCategoryPayload:
+        return ReplyConfigurationCategory(request.category_id, f"Category {request.category_id}")
+    if type(request) == RequestConfigurationValueCountPayload:
+        return ReplyConfigurationValueCountPayload(request.category_index, PARAMETERS)
+    if type(request) == RequestConfigurationNameUidPayload:
+        uid = request.category_index * 1000 + request.config_index
+        return ReplyConfigurationNameUidPayload(f"Parameter {uid}", uid, request.config_index, request.category_index)
+    if type(request) == RequestConfigurationValueUidPayload:
+        return ReplyConfigurationValueUidPayload(request.config_uid, request.config_uid * 2, ConfigValueType.UINT32)
+    raise ValueError(f"Unexpected request {request}")
+
+
+class ConfigurableDevice:
+    """ Stands in for a usb.core.Device, answering configuration requests after a delay. """
+    def __init__(self):
+        self.replies = []  # Heap of (time, sequence, report)
+        self.sequence = itertools.count()
+        self.busy_until = 0.0
+        self.lock = threading.Lock()
+
+    def request(self, packet: Packet):
+        with self.lock:
+            self.busy_until = max(time.monotonic() + LINK_LATENCY, self.busy_until + PROCESS_TIME)
+            heapq.heappush(self.replies, (self.busy_until, next(self.sequence), make_report(reply_to(packet.payload))))
+
+    def read(self, endpoint, length, timeout=None):
+        with self.lock:
+            if len(self.replies) > 0 and self.replies[0][0] <= time.monotonic():
+                return heapq.heappop(self.replies)[2]
+
+        time.sleep(0.0001)
+        raise usb.core.USBTimeoutError("No reply ready", None, None)
+
+
+def run(window: int):
+    simulated_device = ConfigurableDevice()
+    node = Node(TX_ID, 0, SimulatedConnection(simulated_device.request))
+    device = Device(node)
+
+    update_queue, stop_event = queue.Queue(), threading.Event()
+    update_queue.put({'routes': {TX_ID: 0}, 'control_routes': {TX_ID: 1}})
+    reader = threading.Thread(target=usb_read_loop,
+                              args=(UsbDeviceHandle(None, simulated_device), [TX_ID],
+                                    [node.receive_queue, node.control_queue], None, update_queue),
+                              kwargs={'stop_event': stop_event})
+    reader.start()
+
+    configurator.REQUEST_WINDOW = window
+    start = time.perf_counter()
+    config = device.config.read_all(flat_list=True)
+    elapsed = time.perf_counter() - start
+
+    stop_event.set()
+    reader.join()
+
+    assert len(config) == CATEGORIES * PARAMETERS
+    assert all(parameter['value'] == parameter['uid'] * 2 for parameter in config)
+    print(f"{window:3d} outstanding  read_all of {len(config)} parameters {elapsed * 1e3:8.1f} ms")
+
+
+def main():
+    for window in (1, 8, 32):
+        run(window)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark comparing the table-driven CRC-8 in amfiprot.crc with the previous crcmod-based implementation.
+
+Usage: python benchmarks/bench_crc.py
+"""
+import array
+import os
+import timeit
+
+from amfiprot.crc import crc8, crc8_batch, Crc8
+
+try:
+    import crcmod
+except ImportError:
+    crcmod = None
+
+HEADER = array.array('B', [14, 0, 7, 0, 3, 255])
+PAYLOAD = array.array('B', os.urandom(54))
+REPORTS = [array.array('B', os.urandom(62)) for _ in range(1000)]
+NUMBER = 20_000
+
+
+def crcmod_per_call(data):
+    crc = crcmod.Crc(0x12F, initCrc=0, rev=False)
+    crc.update(data[:])
+    return crc.crcValue
+
+
+def report(name, seconds, number):
+    print(f"{name:<40} {seconds / number * 1e6:8.3f} us/call")
+
+
+def main():
+    if crcmod is not None:
+        reference = crcmod_per_call(PAYLOAD)
+        assert reference == crc8(PAYLOAD), "CRC mismatch between crcmod and amfiprot.crc"
+        assert crcmod_per_call(HEADER) == crc8(HEADER), "CRC mismatch between crcmod and amfiprot.crc"
+
+        report("crcmod (new Crc per call), header", timeit.timeit(lambda: crcmod_per_call(HEADER), number=NUMBER), NUMBER)
+        report("crcmod (new Crc per call), payload", timeit.timeit(lambda: crcmod_per_call(PAYLOAD), number=NUMBER), NUMBER)
+    else:
+        print("crcmod not installed, skipping reference measurements")
+
+    view = memoryview(PAYLOAD)
+    report("crc8, header", timeit.timeit(lambda: crc8(HEADER), number=NUMBER), NUMBER)
+    report("crc8, payload (array)", timeit.timeit(lambda: crc8(PAYLOAD), number=NUMBER), NUMBER)
+    report("crc8, payload (memoryview)", timeit.timeit(lambda: crc8(view), number=NUMBER), NUMBER)
+    report("Crc8.update, payload", timeit.timeit(lambda: Crc8().update(PAYLOAD).crc, number=NUMBER), NUMBER)
+
+    batch_number = 20
+    seconds = timeit.timeit(lambda: crc8_batch(REPORTS), number=batch_number)
+    report("crc8_batch, per report", seconds, batch_number * len(REPORTS))
+
+
+if __name__ == '__main__':
+    main()
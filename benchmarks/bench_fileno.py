@@ -0,0 +1,113 @@
+"""
+Benchmark for one thread serving many nodes: by polling each node with packet_available() (as applications did before
+nodes had descriptors), by waiting on the nodes' descriptors with a selector, and by waiting on the connection's
+descriptor.
+
+DEVICES nodes get receive queues with notifiers chained to a connection notifier, as USBConnection creates them. A
+thread per node stands in for the connection's reader: it sends nothing for IDLE_SECONDS, then a sample every
+SAMPLE_INTERVAL seconds for STREAM_SECONDS. The CPU used by the process while idle and the latency from delivery to
+the consumer are reported.
+
+Usage: python benchmarks/bench_fileno.py
+"""
+import selectors
+import statistics
+import threading
+import time
+
+from amfiprot import Packet, Node, StructPayload, Field, payload_registry
+
+from simulation import SimulatedConnection
+
+DEVICES = 32
+IDLE_SECONDS = 1.0
+STREAM_SECONDS = 1.0
+SAMPLE_INTERVAL = 0.01  # Seconds between samples of each device (100 Hz)
+POLL_INTERVAL = 0.001  # Seconds the polling consumer sleeps when no node has packets
+
+
+@payload_registry.register
+class TimestampPayload(StructPayload):
+    PAYLOAD_TYPE = 0x10
+    PAYLOAD_ID = 0x02
+    FIELDS = (Field('sent', 'd'),)
+
+    def __init__(self, sent):
+        self.sent = sent
+
+
+def produce(node: Node, start: threading.Event, stop: threading.Event):
+    start.wait()
+
+    while not stop.wait(SAMPLE_INTERVAL):
+        frame = Packet.from_payload(TimestampPayload(time.perf_counter()), source_id=node.tx_id).to_bytes()
+        node.receive_queue.put_nowait(frame)
+
+
+def consume_polling(connection: SimulatedConnection, latencies: list, done: threading.Event):
+    while not done.is_set():
+        received = False
+
+        for node in connection.nodes:
+            if node.packet_available():
+                packet = node.get_packet()
+                latencies.append(time.perf_counter() - packet.payload.sent)
+                received = True
+
+        if not received:
+            time.sleep(POLL_INTERVAL)
+
+
+def consume_nodes(connection: SimulatedConnection, latencies: list, done: threading.Event):
+    with selectors.DefaultSelector() as selector:
+        for node in connection.nodes:
+            selector.register(node, selectors.EVENT_READ)
+
+        while not done.is_set():
+            for key, _ in selector.select(timeout=0.1):
+                latencies.extend(time.perf_counter() - packet.payload.sent for packet in key.fileobj.drain())
+
+
+def consume_connection(connection: SimulatedConnection, latencies: list, done: threading.Event):
+    with selectors.DefaultSelector() as selector:
+        selector.register(connection, selectors.EVENT_READ)
+
+        while not done.is_set():
+            if len(selector.select(timeout=0.1)) > 0:
+                latencies.extend(time.perf_counter() - packet.payload.sent for packet in connection.drain())
+
+
+def run(consume):
+    connection = SimulatedConnection(notifiers=True)
+    connection.nodes = [Node(tx_id, 0, connection) for tx_id in range(1, DEVICES + 1)]
+    start, stop, done, latencies = threading.Event(), threading.Event(), threading.Event(), []
+
+    threads = [threading.Thread(target=produce, args=(node, start, stop)) for node in connection.nodes]
+    threads.append(threading.Thread(target=consume, args=(connection, latencies, done)))
+    for thread in threads:
+        thread.start()
+
+    cpu_start = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu_start) / IDLE_SECONDS
+
+    start.set()
+    time.sleep(STREAM_SECONDS)
+    stop.set()
+    done.set()
+
+    for thread in threads:
+        thread.join()
+
+    print(f"{consume.__name__:<20} {DEVICES} devices  idle CPU {idle_cpu * 100:5.1f} %   "
+          f"{len(latencies):5d} packets, latency mean {statistics.mean(latencies) * 1e3:6.3f} ms, "
+          f"max {max(latencies) * 1e3:6.3f} ms")
+
+
+def main():
+    for consume in (consume_polling, consume_nodes, consume_connection):
+        run(consume)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark for reading packets from a Node: the CPU used by a consumer waiting for packets that do not come, with the
+polling loop applications used before get_packet() could block and with a blocking get_packet(), and the rate at
+which queued packets are taken one at a time with get_packet() and in batches with get_packets().
+
+The node's queues are filled directly, as a connection's reader would, for each kind of receive queue.
+
+Usage: python benchmarks/bench_get_packets.py
+"""
+import multiprocessing as mp
+import queue
+import time
+
+from amfiprot import Packet, Node
+from amfiprot.common_payload import ReplyFirmwareVersionPerIdPayload
+from amfiprot.connection import Connection
+from amfiprot.receive_queue import ReceiveQueue
+from amfiprot.ring import SharedMemoryRing
+
+IDLE_SECONDS = 1.0
+PACKETS = 20_000
+BATCH = 256
+
+
+class QueueConnection(Connection):
+    """ Creates the receive queues of its nodes with ``create_channel()``, and has no I/O. """
+    def __init__(self, create_channel):
+        self.create_channel = create_channel
+
+    def find_nodes(self):
+        return []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def refresh(self) -> bool:
+        return True
+
+    def enqueue_packet(self, packet: Packet):
+        pass
+
+    def create_receive_queue(self, capacity=None, capacity_bytes=None, policy=None):
+        return ReceiveQueue(self.create_channel())
+
+    def max_payload_size(self) -> int:
+        return 64
+
+
+def idle_cpu(node: Node, blocking: bool) -> float:
+    """ CPU seconds used per second while waiting for packets. """
+    deadline = time.monotonic() + IDLE_SECONDS
+    start = time.process_time()
+
+    while time.monotonic() < deadline:
+        if blocking:
+            node.get_packet(blocking=True, timeout_ms=100)
+        elif node.packet_available():
+            node.get_packet()
+
+    return (time.process_time() - start) / IDLE_SECONDS
+
+
+def drain_rate(node: Node, frame: bytes, batch: bool) -> float:
+    """ Packets per second taken from a full receive queue. """
+    for _ in range(PACKETS):
+        node.receive_queue.put_nowait(frame)
+
+    received = 0
+    start = time.perf_counter()
+
+    while received < PACKETS:
+        if batch:
+            received += len(node.get_packets(BATCH, timeout_ms=100))
+        elif node.get_packet(blocking=True, timeout_ms=100) is not None:
+            received += 1
+
+    return PACKETS / (time.perf_counter() - start)
+
+
+def main():
+    frame = Packet.from_payload(ReplyFirmwareVersionPerIdPayload(1, 2, 3, 4, 0), source_id=3).to_bytes()
+    kinds = (('multiprocessing.Queue', mp.Queue), ('SharedMemoryRing', lambda: SharedMemoryRing(PACKETS)),
+             ('queue.Queue', queue.Queue))
+
+    for name, create_channel in kinds:
+        node = Node(3, 0, QueueConnection(create_channel))
+
+        print(f"{name:<22} idle CPU: polling {idle_cpu(node, False) * 100:5.1f} %, "
+              f"blocking {idle_cpu(node, True) * 100:5.1f} %   "
+              f"drain: get_packet {drain_rate(node, frame, False):8.0f}/s, "
+              f"get_packets {drain_rate(node, frame, True):8.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark for the idle strategies of the USB read and write loops: CPU used by the worker processes while there is no
+traffic, and the latency from a report arriving (or a packet being enqueued) until the worker has handled it.
+
+The loops run in their own processes, as in TransportMode.PROCESS, against a simulated device whose read() blocks on an
+event for up to the given timeout, as libusb does.
+
+Usage: python benchmarks/bench_idle.py    (Unix only, the CPU time of the workers is taken from resource.getrusage)
+"""
+import array
+import multiprocessing as mp
+import resource
+import statistics
+import time
+
+import usb.core
+
+from amfiprot import Packet
+from amfiprot.common_payload import RequestFirmwareVersionPayload
+from amfiprot.connection import IdleStrategy, STOP_SENTINEL
+from amfiprot.packet import packet_from_frame
+from amfiprot.usb_connection import UsbDeviceHandle, usb_read_loop, usb_write_loop
+
+from simulation import TX_ID, make_report
+
+IDLE_SECONDS = 2.0
+SAMPLES = 200
+
+
+class SimulatedDevice:
+    """ Stands in for a usb.core.Device. A report is returned by read() once ``report_ready`` is set, and write() reports
+    the time each report was written. """
+    def __init__(self, report: array.array, report_ready, written):
+        self.report = report
+        self.report_ready = report_ready
+        self.written = written
+
+    def read(self, endpoint, length, timeout=None):
+        if not self.report_ready.wait(timeout / 1000):
+            raise usb.core.USBTimeoutError("Timed out", None, None)
+
+        self.report_ready.clear()
+        return array.array('B', self.report)
+
+    def write(self, endpoint, data, timeout=None):
+        self.written.put(time.perf_counter())
+        return len(data)
+
+
+class DiscardQueue:
+    """ Global receive queue that nobody reads. """
+    def full(self):
+        return False
+
+    def put_nowait(self, item):
+        pass
+
+
+def start_workers(idle_strategy: IdleStrategy):
+    report_ready, written, stop_event = mp.Event(), mp.Queue(), mp.Event()
+    rx_queue, tx_queue = mp.Queue(), mp.Queue()
+    device = UsbDeviceHandle(None, SimulatedDevice(make_report(), report_ready, written))
+
+    reader = mp.Process(target=usb_read_loop, args=(device, [TX_ID], [rx_queue], DiscardQueue(), mp.Queue()),
+                        kwargs={'stop_event': stop_event, 'idle_strategy': idle_strategy})
+    writer = mp.Process(target=usb_write_loop, args=(device, tx_queue, stop_event), kwargs={'idle_strategy': idle_strategy})
+    reader.start()
+    writer.start()
+
+    def stop():
+        tx_queue.put(STOP_SENTINEL)
+        stop_event.set()
+        writer.join()
+        reader.join()
+
+    return report_ready, written, rx_queue, tx_queue, stop
+
+
+def idle_cpu(idle_strategy: IdleStrategy) -> float:
+    """ CPU time used by both workers per second of wall time, without traffic. """
+    cpu_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+
+    *_, stop = start_workers(idle_strategy)
+    time.sleep(IDLE_SECONDS)
+    stop()
+
+    wall = time.perf_counter() - start
+    cpu_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (cpu_after.ru_utime - cpu_before.ru_utime) + (cpu_after.ru_stime - cpu_before.ru_stime)
+    return cpu / wall
+
+
+def wake_latencies(idle_strategy: IdleStrategy):
+    """ Median latency (in seconds) of the read path (report available until the packet is in the node queue) and of
+    the write path (packet enqueued until it is written to the device). """
+    report_ready, written, rx_queue, tx_queue, stop = start_workers(idle_strategy)
+    request = Packet.from_payload(RequestFirmwareVersionPayload(), destination_id=TX_ID)
+    read_latencies, write_latencies = [], []
+
+    time.sleep(0.2)  # Let the workers start
+
+    for _ in range(SAMPLES):
+        time.sleep(0.005)  # Let the workers go idle
+        start = time.perf_counter()
+        report_ready.set()
+        packet_from_frame(rx_queue.get())
+        read_latencies.append(time.perf_counter() - start)
+
+        time.sleep(0.005)
+        start = time.perf_counter()
+        tx_queue.put(request)
+        write_latencies.append(written.get() - start)
+
+    stop()
+    return statistics.median(read_latencies), statistics.median(write_latencies)
+
+
+def main():
+    for idle_strategy in IdleStrategy:
+        cpu = idle_cpu(idle_strategy)
+        read_latency, write_latency = wake_latencies(idle_strategy)
+        print(f"{idle_strategy.name:<6} idle CPU {cpu * 100:6.1f} %,  wake-up latency: read {read_latency * 1e6:8.1f} us, "
+              f"write {write_latency * 1e6:8.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark for handing received packets from an I/O process to the consumer, comparing pickled Packet objects (as
+forwarded before) with the raw frames forwarded now.
+
+Reports the number of bytes each item puts on the pipe, and packets per second through a multiprocessing.Queue,
+including creating the Packet and decoding its payload on the consumer side.
+
+Usage: python benchmarks/bench_ipc.py
+"""
+import multiprocessing as mp
+import pickle
+import time
+
+from amfiprot import Packet
+from amfiprot.packet import packet_from_frame, frame_length
+
+from simulation import make_report
+
+PACKETS = 50_000
+
+
+def as_packet(report):
+    return Packet(report, 2)
+
+
+def as_decoded_packet(report):
+    packet = Packet(report, 2)
+    packet.payload
+    return packet
+
+
+def as_frame(report):
+    return report[2:2 + frame_length(report, 2)].tobytes()
+
+
+def as_timestamped_frame(report):
+    return time.time(), as_frame(report)
+
+
+def produce(tx_queue, forward):
+    report = make_report()
+    for _ in range(PACKETS):
+        tx_queue.put(forward(report))
+
+
+def consume(rx_queue, to_packet) -> float:
+    start = time.perf_counter()
+    for _ in range(PACKETS):
+        packet = to_packet(rx_queue.get())
+        packet.payload
+    return time.perf_counter() - start
+
+
+def main():
+    report = make_report()
+    cases = [
+        ("Packet (payload not decoded)", as_packet, lambda packet: packet),
+        ("Packet (payload decoded)", as_decoded_packet, lambda packet: packet),
+        ("raw frame", as_frame, packet_from_frame),
+        ("(timestamp, raw frame)", as_timestamped_frame, packet_from_frame),
+    ]
+
+    for name, forward, to_packet in cases:
+        pickled_size = len(pickle.dumps(forward(report)))
+
+        rx_queue = mp.Queue()
+        producer = mp.Process(target=produce, args=(rx_queue, forward))
+        producer.start()
+        elapsed = consume(rx_queue, to_packet)
+        producer.join()
+
+        print(f"{name:<32} {pickled_size:5d} bytes/packet {PACKETS / elapsed:10.0f} packets/s")
+
+
+if __name__ == '__main__':
+    main()
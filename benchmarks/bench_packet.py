@@ -0,0 +1,41 @@
+"""
+Micro-benchmark for decoding received packets and for the memory they occupy while queued.
+
+Usage: python benchmarks/bench_packet.py
+"""
+import array
+import pickle
+import timeit
+import tracemalloc
+
+from amfiprot import Packet
+
+from simulation import make_report
+
+NUMBER = 50_000
+
+
+def main():
+    report = make_report()
+
+    seconds = timeit.timeit(lambda: Packet(report, 2), number=NUMBER)
+    print(f"{'decode USB report':<40} {seconds / NUMBER * 1e6:8.3f} us/packet")
+
+    seconds = timeit.timeit(lambda: Packet(report, 2).source_id, number=NUMBER)
+    print(f"{'decode + read source_id':<40} {seconds / NUMBER * 1e6:8.3f} us/packet")
+
+    print(f"{'pickled size':<40} {len(pickle.dumps(Packet(report, 2))):8d} bytes")
+
+    count = 10_000
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    queued = [Packet(array.array('B', report), 2) for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'lineno'))
+    print(f"{'memory per queued packet':<40} {allocated / len(queued):8.1f} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark for stopping the USB read and write workers in processes, as USBConnection.stop() does: the writer is sent
+the stop sentinel and acknowledges once it has sent everything enqueued before it, then the reader is stopped.
+
+The device is simulated: read() returns a report every READ_INTERVAL seconds, and write() takes WRITE_TIME seconds. The
+global receive queue is not read, as in most applications, so its pipe fills up while the workers run. The reader is
+stopped with and without amfiprot.connection.release_receive_channels() at its exit, which lets the process exit
+without writing everything to that pipe.
+
+Usage: python benchmarks/bench_stop.py
+"""
+import multiprocessing as mp
+import time
+
+import usb.core
+
+from amfiprot import Packet
+from amfiprot.common_payload import RequestFirmwareVersionPayload
+from amfiprot.connection import STOP_SENTINEL, release_receive_channels
+from amfiprot.usb_connection import UsbDeviceHandle, usb_read_loop, usb_write_loop
+
+from simulation import TX_ID, SimulatedDevice, make_report
+
+RUN_SECONDS = 1.0
+READ_INTERVAL = 0.0002
+WRITE_TIME = 0.001
+PACKETS_ENQUEUED = 200
+STOP_TIMEOUT = 2  # As in amfiprot.usb_connection
+
+
+def read_task(device, rx_queue, global_receive_queue, node_update_queue, stop_event, release: bool):
+    usb_read_loop(device, [TX_ID], [rx_queue], global_receive_queue, node_update_queue, stop_event=stop_event)
+
+    if release:
+        release_receive_channels([global_receive_queue, rx_queue])
+
+
+def run(release: bool):
+    """ Returns the time stop took, whether a worker had to be terminated, and the number of packets written. """
+    stop_event, drained, written = mp.Event(), mp.Event(), mp.Value('i', 0)
+    rx_queue, global_receive_queue, tx_queue = mp.Queue(), mp.Queue(), mp.Queue()
+    device = UsbDeviceHandle(None, SimulatedDevice(make_report(), READ_INTERVAL, WRITE_TIME, written))
+
+    reader = mp.Process(target=read_task, args=(device, rx_queue, global_receive_queue, mp.Queue(), stop_event, release))
+    writer = mp.Process(target=usb_write_loop, args=(device, tx_queue, stop_event), kwargs={'drained': drained})
+    reader.start()
+    writer.start()
+
+    request = Packet.from_payload(RequestFirmwareVersionPayload(), destination_id=TX_ID)
+    deadline = time.perf_counter() + RUN_SECONDS
+    while time.perf_counter() < deadline:
+        rx_queue.get()  # The node queue is read, the global receive queue is not
+
+    for _ in range(PACKETS_ENQUEUED):
+        tx_queue.put(request)
+
+    start = time.perf_counter()
+    tx_queue.put(STOP_SENTINEL)
+    drained.wait(STOP_TIMEOUT)
+    stop_event.set()
+
+    terminated = False
+    for worker in (writer, reader):
+        worker.join(STOP_TIMEOUT)
+        if worker.is_alive():
+            worker.terminate()
+            worker.join()
+            terminated = True
+
+    return time.perf_counter() - start, terminated, written.value
+
+
+def main():
+    drain_time = PACKETS_ENQUEUED * WRITE_TIME
+    print(f"{PACKETS_ENQUEUED} packets enqueued when stopping ({drain_time * 1000:.0f} ms to send them)")
+
+    for release in (False, True):
+        elapsed, terminated, written = run(release)
+        name = 'release_receive_channels' if release else 'reader exits normally'
+        print(f"{name:<26} stop took {elapsed * 1000:7.1f} ms, {written:4d} packets sent"
+              f"{', reader terminated' if terminated else ''}")
+
+
+if __name__ == '__main__':
+    main()
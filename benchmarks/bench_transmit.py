@@ -0,0 +1,52 @@
+"""
+Micro-benchmark for building outgoing USB reports, comparing the previous array-based path with encode_into.
+
+Usage: python benchmarks/bench_transmit.py
+"""
+import array
+import timeit
+
+from amfiprot import Packet
+from amfiprot.common_payload import SetConfigurationValueUidPayload, ConfigValueType
+from amfiprot.packet import PacketTemplate, calculate_crc
+from amfiprot.usb_connection import create_output_report, encode_output_report
+
+NUMBER = 50_000
+PAYLOAD = SetConfigurationValueUidPayload(0x1234, 12.5, ConfigValueType.FLOAT)
+
+
+def previous_report(payload) -> array.array:
+    data = array.array('B', [len(payload), 0, 0, payload.type, 0, 255])
+    data.append(calculate_crc(data))
+    payload_data = payload.to_bytes()
+    data.extend(payload_data)
+    data.append(calculate_crc(payload_data))
+
+    byte_data = array.array('B', [1])
+    byte_data.extend(data)
+    byte_data.extend([0] * (64 - len(byte_data)))
+    return byte_data
+
+
+def main():
+    report = create_output_report()
+    encode_output_report(Packet.from_payload(PAYLOAD), report)
+    assert report == previous_report(PAYLOAD), "Report mismatch between previous and current TX path"
+
+    seconds = timeit.timeit(lambda: previous_report(PAYLOAD), number=NUMBER)
+    print(f"{'previous (to_bytes + extend + pad)':<40} {seconds / NUMBER * 1e6:8.3f} us/report")
+
+    seconds = timeit.timeit(lambda: encode_output_report(Packet.from_payload(PAYLOAD), report), number=NUMBER)
+    print(f"{'from_payload + encode_output_report':<40} {seconds / NUMBER * 1e6:8.3f} us/report")
+
+    template = PacketTemplate(PAYLOAD)
+    seconds = timeit.timeit(lambda: encode_output_report(template.packet(7), report), number=NUMBER)
+    print(f"{'PacketTemplate + encode_output_report':<40} {seconds / NUMBER * 1e6:8.3f} us/report")
+
+    packet = Packet.from_payload(PAYLOAD)
+    seconds = timeit.timeit(lambda: encode_output_report(packet, report), number=NUMBER)
+    print(f"{'encode_output_report (writer only)':<40} {seconds / NUMBER * 1e6:8.3f} us/report")
+
+
+if __name__ == '__main__':
+    main()
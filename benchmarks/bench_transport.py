@@ -0,0 +1,124 @@
+"""
+Benchmark comparing TransportMode.PROCESS (with multiprocessing queues or shared-memory rings) and TransportMode.THREAD.
+
+Without arguments, the USB read loop is driven by a simulated device that replays one report as fast as possible, so
+the measurement covers everything between libusb and Node.get_packet: the read loop itself, routing, and handing the
+packet to the consumer (pickled through mp.Queue, or passed through queue.Queue). Each mode is measured with and
+without a global receive stream (which nobody reads), i.e. with and without a subscription through
+USBConnection.subscribe().
+
+With a vendor and product ID, start-up time and request/reply round trips are measured on a real device:
+
+Usage: python benchmarks/bench_transport.py [VENDOR_ID PRODUCT_ID]    (IDs in hex, e.g. C17 D12)
+"""
+import array
+import multiprocessing as mp
+import queue
+import sys
+import threading
+import time
+
+import usb.core
+
+from amfiprot import USBConnection, Device
+from amfiprot.connection import TransportMode
+from amfiprot.packet import packet_from_frame
+from amfiprot.ring import SharedMemoryRing
+from amfiprot.usb_connection import UsbDeviceHandle, usb_read_loop
+
+from simulation import TX_ID, make_report
+
+PACKETS = 20_000
+RING_SLOTS = 32768  # Large enough for the unread global queue to never fill up
+
+
+class ReplayDevice:
+    """ Stands in for a usb.core.Device, returning the same report on every read. """
+    def __init__(self, report: array.array, count: int):
+        self.report = report
+        self.remaining = count
+
+    def read(self, endpoint, length, timeout=None):
+        if self.remaining == 0:
+            time.sleep(0.01)
+            raise usb.core.USBTimeoutError("No more reports", None, None)
+
+        self.remaining -= 1
+        return array.array('B', self.report)
+
+
+def simulated(mode: TransportMode, ring_slots: int = 0, global_stream: bool = True):
+    if mode == TransportMode.THREAD:
+        rx_queue, global_queue, update_queue, stop_event = queue.Queue(), queue.Queue(), queue.Queue(), threading.Event()
+        worker_class = threading.Thread
+    elif ring_slots > 0:
+        rx_queue, global_queue, update_queue, stop_event = SharedMemoryRing(ring_slots), SharedMemoryRing(ring_slots), mp.Queue(), mp.Event()
+        worker_class = mp.Process
+    else:
+        rx_queue, global_queue, update_queue, stop_event = mp.Queue(), mp.Queue(), mp.Queue(), mp.Event()
+        worker_class = mp.Process
+
+    if not global_stream:
+        global_queue = None
+
+    device = UsbDeviceHandle(None, ReplayDevice(make_report(), PACKETS))
+    worker = worker_class(target=usb_read_loop, args=(device, [TX_ID], [rx_queue], global_queue, update_queue), kwargs={'stop_event': stop_event}, daemon=True)
+
+    start = time.perf_counter()
+    worker.start()
+    rx_queue.get()
+    started = time.perf_counter()
+
+    for _ in range(PACKETS - 1):
+        packet = packet_from_frame(rx_queue.get())
+
+    elapsed = time.perf_counter() - started
+    assert packet.payload.fw_version['major'] == 1
+
+    stop_event.set()
+
+    while worker.is_alive() and global_queue is not None:  # A process exits once its queues have been read
+        try:
+            global_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    worker.join()
+
+    name = f"{mode.name} (ring)" if ring_slots > 0 else mode.name
+    name += ", global stream" if global_stream else ""
+    print(f"{name:<32} first packet after {(started - start) * 1e3:8.2f} ms, {PACKETS / elapsed:10.0f} packets/s")
+
+
+def real_device(vendor_id: int, product_id: int, mode: TransportMode, ring_slots: int = 0):
+    start = time.perf_counter()
+    conn = USBConnection(vendor_id, product_id, mode=mode, receive_ring_slots=ring_slots)
+    nodes = conn.find_nodes()
+    conn.start()
+    started = time.perf_counter()
+
+    dev = Device(nodes[0])
+    dev.firmware_version()
+
+    rounds = 100
+    round_trip_start = time.perf_counter()
+    for _ in range(rounds):
+        dev.firmware_version()
+    round_trip = (time.perf_counter() - round_trip_start) / rounds
+
+    conn.stop()
+    name = f"{mode.name} (ring)" if ring_slots > 0 else mode.name
+    print(f"{name:<16} start-up {(started - start) * 1e3:8.1f} ms, request/reply {round_trip * 1e3:6.2f} ms")
+
+
+def main():
+    for mode, ring_slots in ((TransportMode.PROCESS, 0), (TransportMode.PROCESS, RING_SLOTS), (TransportMode.THREAD, 0)):
+        if len(sys.argv) == 3:
+            real_device(int(sys.argv[1], 16), int(sys.argv[2], 16), mode, ring_slots)
+        else:
+            simulated(mode, ring_slots, global_stream=True)
+            simulated(mode, ring_slots, global_stream=False)
+
+
+if __name__ == '__main__':
+    main()
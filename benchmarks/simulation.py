@@ -0,0 +1,82 @@
+"""
+Simulated device reports, device and connection shared by the benchmarks (and the tests). The benchmarks import this module by name, since
+Python puts the directory of the script being run first on the module search path.
+"""
+import array
+import queue
+import time
+
+from amfiprot import Packet
+from amfiprot.common_payload import ReplyFirmwareVersionPerIdPayload
+from amfiprot.connection import Connection
+from amfiprot.receive_queue import ReceiveQueue, Notifier, QueuePolicy, DEFAULT_CAPACITY
+
+TX_ID = 3  # Source ID of the packets sent by simulated devices
+REPORT_LENGTH = 64  # Bytes in a USB HID report
+
+
+def make_report(payload=None) -> array.array:
+    """ Returns a USB HID report of a packet from TX_ID, carrying ``payload``. By default, a firmware version reply. """
+    if payload is None:
+        payload = ReplyFirmwareVersionPerIdPayload(1, 2, 3, 4, 0)
+
+    packet = Packet.from_payload(payload, source_id=TX_ID)
+    report = array.array('B', [0x01, len(packet)])
+    report.extend(packet.to_bytes())
+    report.extend([0] * (REPORT_LENGTH - len(report)))
+    return report
+
+
+class SimulatedDevice:
+    """ Stands in for a usb.core.Device. read() returns ``report`` every ``read_interval`` seconds, and write() takes
+    ``write_time`` seconds, counting the reports written in ``written`` (e.g. a ``multiprocessing.Value``), if given. """
+    def __init__(self, report: array.array, read_interval: float, write_time: float, written=None):
+        self.report = report
+        self.read_interval = read_interval
+        self.write_time = write_time
+        self.written = written
+
+    def read(self, endpoint, length, timeout=None):
+        time.sleep(self.read_interval)
+        return array.array('B', self.report)
+
+    def write(self, endpoint, data, timeout=None):
+        time.sleep(self.write_time)
+        if self.written is not None:
+            with self.written.get_lock():
+                self.written.value += 1
+        return len(data)
+
+
+class SimulatedConnection(Connection):
+    """ Creates thread-safe receive queues, and has no I/O. Packets enqueued by nodes are passed to ``enqueue``, if
+    given. With ``notifiers``, the connection has a notifier, and the receive queues have notifiers chained to it, as
+    USBConnection creates them. """
+    def __init__(self, enqueue=None, notifiers: bool = False):
+        self.enqueue = enqueue
+        self.notifier = Notifier() if notifiers else None
+        self.nodes = []
+
+    def find_nodes(self):
+        return []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def refresh(self) -> bool:
+        return True
+
+    def enqueue_packet(self, packet: Packet):
+        if self.enqueue is not None:
+            self.enqueue(packet)
+
+    def create_receive_queue(self, capacity=None, capacity_bytes=None, policy=None):
+        notifier = Notifier(self.notifier) if self.notifier is not None else None
+        return ReceiveQueue(queue.Queue(), DEFAULT_CAPACITY if capacity is None else capacity,
+                            policy=QueuePolicy.DROP_OLDEST if policy is None else policy, notifier=notifier)
+
+    def max_payload_size(self) -> int:
+        return REPORT_LENGTH
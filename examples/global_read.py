@@ -6,11 +6,12 @@ PRODUCT_ID_SOURCE = 0xD01
 
 def main():
     conn = amfiprot.USBConnection(VENDOR_ID, PRODUCT_ID_SENSOR)
+    all_packets = conn.subscribe()
     conn.start()
 
     while True:
-        if conn.global_receive_queue.qsize() > 0:
-            packet = conn.global_receive_queue.get()
+        if not all_packets.empty():
+            packet = amfiprot.packet.packet_from_frame(all_packets.get())
             print(packet)
 
     conn.stop()
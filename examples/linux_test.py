@@ -17,7 +17,7 @@ if __name__ == '__main__':
     start = time.time()
 
     while True: #time.time() - start < 60:
-        packet = dev.get_packet()
+        packet = dev.get_packet(blocking=True, timeout_ms=100)
 
         if packet is not None:
             print(".", end="", flush=True)
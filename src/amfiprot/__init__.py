@@ -1,11 +1,15 @@
-__all__ = ['connection', 'usb_connection', 'uart_connection', 'device', 'packet', 'payload', 'common_payload']
+__all__ = ['connection', 'usb_connection', 'usb_async', 'uart_connection', 'receive_queue', 'correlation', 'aio', 'device', 'packet', 'payload', 'common_payload', 'schema', 'registry']
 __version__ = '0.1.10'
 
 from .payload import Payload, PayloadType
+from .schema import StructPayload, Field, StringTail, BytesTail
+from .registry import PayloadRegistry, payload_registry
 from .node import Node
-from .packet import Packet
+from .packet import Packet, CrcValidation
 from .device import Device
-from .connection import Connection
+from .aio import AsyncConnection, AsyncDevice
+from .connection import Connection, ConnectionStatistics, TransportMode, IdleStrategy
+from .receive_queue import QueuePolicy
 from .usb_connection import USBConnection
 from .uart_connection import UARTConnection
 from .common_payload import *
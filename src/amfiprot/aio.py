@@ -0,0 +1,309 @@
+"""
+asyncio interface.
+
+:class:`AsyncDevice` provides the methods of :class:`amfiprot.Device` (and its configurator) as coroutines. Requests
+are awaited through the futures of the node's correlator (see :mod:`amfiprot.correlation`), and received packets on
+the node's descriptor (see :meth:`amfiprot.Node.fileno`), which the connection's reader signals when it delivers
+packets, so waiting for packets takes no thread and no polling, and one event loop can serve many devices. Replies are
+matched to requests by the correlator's dispatcher thread, which only runs while a node has requests outstanding, and
+then wakes up at least every :data:`amfiprot.correlation.DISPATCH_POLL_INTERVAL` seconds to expire them.
+
+Waiting for packets requires an event loop that supports ``add_reader()``, which on Windows is
+``asyncio.SelectorEventLoop`` (not the default), and receive queues with notifiers, as created by
+:class:`amfiprot.USBConnection` and :class:`amfiprot.UARTConnection`. Otherwise the queues are checked every
+:data:`POLL_INTERVAL` seconds.
+"""
+from __future__ import annotations
+import array
+import asyncio
+import logging
+import os
+import warnings
+import weakref
+from typing import AsyncIterator, List, Optional, Union
+
+from .common_payload import *
+from .configurator import REQUEST_WINDOW
+from .connection import Connection
+from .correlation import ReplySpec, REQUEST_TIMEOUT_MS
+from .node import Node, GET_PACKETS_MAX
+from .packet import Packet, PacketType
+from .payload import Payload
+
+POLL_INTERVAL = 0.01  # Seconds between checks of receive queues that cannot signal the event loop
+
+logger = logging.getLogger(__name__)
+
+_waiters = weakref.WeakKeyDictionary()  # Event loop to {descriptor: futures of the coroutines waiting for it}
+
+
+class AsyncConnection:
+    """ Wraps a :class:`amfiprot.Connection` for use from coroutines. Finding nodes, starting and stopping block for a
+    while, and are run in the event loop's default executor. Packets are sent and received without it. """
+    def __init__(self, connection: Connection):
+        self.connection = connection
+
+    async def find_nodes(self) -> List[Node]:
+        return await self._run(self.connection.find_nodes)
+
+    async def start(self):
+        await self._run(self.connection.start)
+
+    async def stop(self):
+        await self._run(self.connection.stop)
+
+    async def _run(self, function):
+        return await asyncio.get_running_loop().run_in_executor(None, function)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+
+class AsyncDevice:
+    """ Coroutine counterpart of :class:`amfiprot.Device`, for a node of a started connection. """
+    def __init__(self, node: Node):
+        self.node = node
+        self.config = AsyncConfigurator(self)
+
+    async def request(self,
+                      payload: Payload,
+                      packet_type: PacketType = PacketType.NO_ACK,
+                      spec: Optional[ReplySpec] = None,
+                      timeout_ms: Optional[int] = REQUEST_TIMEOUT_MS) -> Packet:
+        """ Send a request and return its reply, see :meth:`amfiprot.Node.request`. """
+        return await asyncio.wrap_future(self.node.request(payload, packet_type, spec, timeout_ms))
+
+    async def request_prepared(self, payload_class, *args, timeout_ms: Optional[int] = REQUEST_TIMEOUT_MS) -> Packet:
+        """ Send a request from a cached template and return its reply, see :meth:`amfiprot.Node.request_prepared`. """
+        return await asyncio.wrap_future(self.node.request_prepared(payload_class, *args, timeout_ms=timeout_ms))
+
+    async def get_tx_id_uuid(self) -> tuple[int, int]:
+        packet = await self.request_prepared(RequestDeviceIdPayload)
+
+        self.node.tx_id = packet.payload.tx_id
+        self.node.uuid = packet.payload.uuid
+
+        return packet.payload.tx_id, packet.payload.uuid
+
+    async def firmware_version(self, processor_id: int = 0) -> dict:
+        packet = await self.request_prepared(RequestFirmwareVersionPerIdPayload, processor_id)
+        return packet.payload.fw_version
+
+    async def name(self) -> str:
+        if self.node.name is None:
+            packet = await self.request_prepared(RequestDeviceNamePayload)
+            self.node.name = packet.payload.name
+
+        return self.node.name
+
+    async def update_firmware(self, path_to_bin: str, log_progress: bool = False):
+        """ See :meth:`amfiprot.Device.update_firmware`. With ``log_progress``, the progress is logged (at INFO level
+        by the ``amfiprot.aio`` logger) rather than printed, which would block the event loop. """
+        file_size = os.path.getsize(path_to_bin)
+        bin_data = array.array('B')
+
+        with open(path_to_bin, 'rb') as bin_file:
+            bin_data.fromfile(bin_file, file_size)
+
+        chunk_size = self.node.max_payload_size() - 2
+        chunks = [bin_data[i:i + chunk_size] for i in range(0, file_size, chunk_size)]
+
+        await self.request(FirmwareStartPayload(), timeout_ms=20_000)
+
+        for index, chunk in enumerate(chunks):
+            await self.request(FirmwareDataPayload(chunk), packet_type=PacketType.REQUEST_ACK, timeout_ms=10_000)
+
+            if log_progress and index % 100 == 0:
+                logger.info("Firmware sent: %.1f%%", (index / len(chunks)) * 100)
+
+        self.node.send_payload(FirmwareEndPayload())
+
+    async def set_tx_id(self, tx_id) -> bool:
+        self.node.send_payload(SetTxIdPayload(tx_id, self.node.uuid))
+
+        # Connection must be informed of new tx_id
+        self.node.tx_id = tx_id
+        await asyncio.get_running_loop().run_in_executor(None, self.node.connection.refresh)
+
+        # Read back tx_id to ensure that it is set
+        new_tx_id, uuid = await self.get_tx_id_uuid()
+        return new_tx_id == tx_id
+
+    async def reboot(self):
+        self.node.send_prepared(RebootPayload)
+
+    async def getProcedureSpec(self, index, uid=None) -> Packet:
+        return await self.request(RequestProcedureSpec(index, uid))
+
+    async def callProcedure(self, uid, Param1Type: ConfigValueType, Param1Value: int, Param2Type=None, Param2Value=None,
+                            Param3Type=None, Param3Value=None, Param4Type=None, Param4Value=None, Param5Type=None,
+                            Param5Value=None) -> Packet:
+        return await self.request(RequestProcedureCall(uid, Param1Type, Param1Value, Param2Type, Param2Value, Param3Type,
+                                                       Param3Value, Param4Type, Param4Value, Param5Type, Param5Value))
+
+    async def get_packet(self, timeout_ms: Optional[int] = None) -> Optional[Packet]:
+        """ The next received packet, control packets first (see :meth:`amfiprot.Node.get_packet`). Waits up to
+        ``timeout_ms``, or indefinitely if None. Returns None if there was none. """
+        packets = await self.get_packets(1, timeout_ms)
+        return packets[0] if len(packets) > 0 else None
+
+    async def get_packets(self, max_packets: int = GET_PACKETS_MAX, timeout_ms: Optional[int] = None) -> List[Packet]:
+        """ Up to ``max_packets`` received packets, waiting up to ``timeout_ms`` (or indefinitely if None) for the
+        first one (see :meth:`amfiprot.Node.get_packets`). Returns an empty list if there were none. """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout_ms is None else loop.time() + timeout_ms / 1000
+
+        while True:
+            packets = self.node.drain(max_packets)
+            if len(packets) > 0:
+                return packets
+
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return []
+
+            if getattr(self.node.receive_queue, 'notifier', None) is not None:
+                await _wait_readable(self.node.fileno(), remaining)
+            else:
+                await asyncio.sleep(POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining))
+
+    async def stream(self, max_packets: int = GET_PACKETS_MAX) -> AsyncIterator[Packet]:
+        """ Received packets, for ``async for``. Packets are taken from the queues up to ``max_packets`` at a time. """
+        while True:
+            for packet in await self.get_packets(max_packets):
+                yield packet
+
+
+class AsyncConfigurator:
+    """ Coroutine counterpart of :class:`amfiprot.configurator.Configurator`. """
+    def __init__(self, device: AsyncDevice):
+        self.device = device
+
+    async def read_all(self, flat_list: bool = False) -> List[dict]:
+        config = []
+
+        for cat_index in range(await self._get_category_count()):
+            category_name = await self._get_category_name(cat_index)
+            category = {'name': category_name, 'parameters': []}
+
+            parameter_count = await self._get_parameter_count(cat_index)
+            names = await self._request_all([RequestConfigurationNameUidPayload(cat_index, param_index)
+                                             for param_index in range(parameter_count)])
+            uids = [packet.payload.configuration_uid for packet in names]
+            values = await self._request_all([RequestConfigurationValueUidPayload(uid) for uid in uids])
+
+            for name, uid, value in zip(names, uids, values):
+                category['parameters'].append({'uid': uid, 'name': name.payload.configuration_name,
+                                               'value': value.payload.config_value})
+
+            if flat_list:
+                for param in category['parameters']:
+                    param['category'] = category_name
+                    config.append(param)
+            else:
+                config.append(category)
+        return config
+
+    async def write_all(self, config):
+        if 'uid' in config[0].keys():  # Flat list
+            parameters = config
+        else:
+            parameters = [parameter for category in config for parameter in category['parameters']]
+
+        for parameter in parameters:
+            try:
+                await self.write(parameter['uid'], parameter['value'])
+            except ValueError:
+                warnings.warn(f"Parameter \"{parameter['name']}\" ({parameter['uid']}) does not exist on device")
+
+    async def read(self, uid, return_datatype: bool = False) -> Union[int, float, bool, str]:
+        packet = await self.device.request_prepared(RequestConfigurationValueUidPayload, uid)
+
+        if return_datatype:
+            return packet.payload.config_value, packet.payload.data_type
+        else:
+            return packet.payload.config_value
+
+    async def write(self, uid, value) -> Union[int, float, bool, str]:
+        try:
+            old_value, data_type = await self.read(uid, return_datatype=True)
+        except TimeoutError:
+            raise ValueError(f"Parameter does not exist on target (UID: {uid}).")
+
+        if type(value) != type(old_value):
+            raise ValueError(f"Data type mismatch (given {type(value)}, expected {type(old_value)}).")
+
+        response = await self.device.request(SetConfigurationValueUidPayload(uid, value, data_type))
+        return response.payload.config_value
+
+    async def reset_to_default(self):
+        self.device.node.send_prepared(LoadDefaultConfigurationPayload)
+
+    async def _get_category_count(self):
+        packet = await self.device.request_prepared(RequestCategoryCountPayload)
+        return packet.payload.category_count
+
+    async def _get_category_name(self, index) -> str:
+        packet = await self.device.request_prepared(RequestConfigurationCategoryPayload, index)
+        return packet.payload.category_name
+
+    async def _get_parameter_count(self, index):
+        packet = await self.device.request_prepared(RequestConfigurationValueCountPayload, index)
+        return packet.payload.config_value_count
+
+    async def _request_all(self, requests: List[Payload]) -> List[Packet]:
+        """ Send ``requests`` with up to :data:`amfiprot.configurator.REQUEST_WINDOW` of them outstanding, and return
+        their replies in order. """
+        window = asyncio.Semaphore(REQUEST_WINDOW)
+
+        async def request(payload: Payload) -> Packet:
+            async with window:
+                return await self.device.request(payload)
+
+        return list(await asyncio.gather(*(request(payload) for payload in requests)))
+
+
+async def _wait_readable(descriptor: int, timeout: Optional[float]):
+    """ Wait until ``descriptor`` is readable, or ``timeout`` seconds have passed (if not None). A loop's
+    ``add_reader()`` replaces the callback of a descriptor that already has one, so the coroutines waiting for the same
+    descriptor (e.g. for the same node) share one callback, which wakes them all. """
+    loop = asyncio.get_running_loop()
+    waiters = _waiters.setdefault(loop, {})
+
+    if descriptor not in waiters:
+        try:
+            loop.add_reader(descriptor, _wake_waiters, loop, descriptor)
+        except NotImplementedError:  # E.g. the proactor event loop on Windows
+            await asyncio.sleep(POLL_INTERVAL if timeout is None else min(POLL_INTERVAL, timeout))
+            return
+
+        waiters[descriptor] = []
+
+    readable = loop.create_future()
+    waiters[descriptor].append(readable)
+
+    try:
+        await asyncio.wait_for(readable, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        futures = waiters.get(descriptor)
+
+        if futures is not None and readable in futures:  # Not woken, so the callback may have to go
+            futures.remove(readable)
+
+            if len(futures) == 0:
+                del waiters[descriptor]
+                loop.remove_reader(descriptor)
+
+
+def _wake_waiters(loop, descriptor: int):
+    # The descriptor stays readable until it is drained, so the callback is removed until the next coroutine waits
+    loop.remove_reader(descriptor)
+
+    for readable in _waiters[loop].pop(descriptor, []):
+        if not readable.done():
+            readable.set_result(None)
@@ -0,0 +1,165 @@
+"""
+Vectorized decoding of many raw packets at once into NumPy structured arrays.
+
+This is intended for bulk consumers and offline tooling that handle high-rate streams, where creating one
+:class:`amfiprot.Packet` per report is too slow. :class:`amfiprot.Packet` and the payload classes remain the reference
+semantics; every column produced here corresponds to a field of those classes.
+
+Requires NumPy (``pip install amfiprot[numpy]``).
+"""
+from typing import Dict, Optional, Tuple, Type
+import numpy as np
+
+from .crc import CRC8_TABLE
+from .packet import HEADER_LENGTH
+from .payload import Payload
+from .schema import StructPayload
+
+USB_REPORT_OFFSET = 2
+""" Offset of the Amfiprot header in a raw USB HID report (report ID and packet length come first). """
+
+UART_FRAME_OFFSET = 0
+""" Offset of the Amfiprot header in a COBS-decoded UART frame. """
+
+HEADER_DTYPE = np.dtype([
+    ('payload_length', 'u1'),
+    ('packet_type', 'u1'),
+    ('packet_number', 'u1'),
+    ('payload_type', 'u1'),
+    ('source_id', 'u1'),
+    ('destination_id', 'u1'),
+    ('header_crc', 'u1'),
+    ('payload_crc', 'u1'),
+    ('crc_ok', '?'),
+])
+
+_CRC_TABLE = np.array(CRC8_TABLE, dtype=np.uint8)
+
+# Explicitly registered wire layouts, as (payload_type, payload_id, dtype). Layouts of StructPayload subclasses are
+# derived from their FIELDS and cached here on first use.
+_payload_layouts: Dict[Type[Payload], Tuple[int, Optional[int], np.dtype]] = {}
+
+
+def register_payload_dtype(payload_class: Type[Payload], dtype, payload_type: int, payload_id: Optional[int] = None):
+    """ Register the wire layout of a payload class so it can be used with :func:`decode_reports`.
+
+    ``dtype`` must describe the payload bytes from the first byte (including the payload ID, if any). If
+    ``payload_id`` is given, only packets whose first payload byte matches it are decoded as ``payload_class``. """
+    _payload_layouts[payload_class] = (payload_type, payload_id, np.dtype(dtype))
+
+
+def payload_dtype(payload_class: Type[Payload]) -> np.dtype:
+    """ Returns the structured dtype describing the wire layout of ``payload_class``. For payloads defined with
+    :class:`amfiprot.schema.StructPayload` this is derived from ``FIELDS`` (any variable-length tail is not included). """
+    return _layout(payload_class)[2]
+
+
+def decode_reports(reports, payload_class: Optional[Type[Payload]] = None, offset: int = USB_REPORT_OFFSET,
+                   report_length: int = 64) -> np.ndarray:
+    """ Decode a batch of raw packets into a structured array with one row per packet.
+
+    :param reports: Either a 2D ``uint8`` array with one report per row, a contiguous bytes-like object containing
+        reports of ``report_length`` bytes each, or a sequence of bytes-like objects (e.g. COBS-decoded UART frames of
+        varying length).
+    :param payload_class: If given, only packets carrying this payload are returned, and the payload fields are added
+        as columns (see :func:`payload_dtype`).
+    :param offset: Position of the Amfiprot header in each report, e.g. :data:`USB_REPORT_OFFSET` or
+        :data:`UART_FRAME_OFFSET`.
+    :param report_length: Length of each report when ``reports`` is a single contiguous buffer.
+    """
+    frames = _as_frame_matrix(reports, report_length)
+    count, width = frames.shape
+
+    if width < offset + HEADER_LENGTH + 1:
+        raise ValueError(f"Reports are too short ({width} bytes) to contain a header at offset {offset}")
+
+    header = frames[:, offset:offset + HEADER_LENGTH]
+    payload_start = offset + HEADER_LENGTH + 1
+    payload_length = header[:, 0].astype(np.intp)
+    rows = np.arange(count)
+
+    # A payload (and its CRC) that would extend past the end of the frame can never be valid
+    fits = payload_start + payload_length + (payload_length > 0) <= width
+    crc_index = np.minimum(payload_start + payload_length, width - 1)
+
+    header_crc = _crc_columns(header)
+    received_header_crc = frames[:, offset + HEADER_LENGTH]
+
+    computed_payload_crc = np.zeros(count, dtype=np.uint8)
+    for column in range(min(int(payload_length.max(initial=0)), width - payload_start)):
+        active = column < payload_length
+        updated = _CRC_TABLE[computed_payload_crc ^ frames[:, payload_start + column]]
+        computed_payload_crc = np.where(active, updated, computed_payload_crc)
+
+    received_payload_crc = np.where(payload_length > 0, frames[rows, crc_index], 0).astype(np.uint8)
+    crc_ok = fits & (received_header_crc == header_crc) & ((payload_length == 0) | (received_payload_crc == computed_payload_crc))
+
+    if payload_class is None:
+        selected = rows
+        dtype = HEADER_DTYPE
+        fields = None
+    else:
+        payload_type, payload_id, fields = _layout(payload_class)
+        match = (header[:, 3] == payload_type) & (payload_length >= fields.itemsize) & fits
+        if payload_id is not None and width > payload_start:
+            match &= frames[:, payload_start] == payload_id
+        selected = np.flatnonzero(match)
+        dtype = np.dtype(HEADER_DTYPE.descr + [('payload', fields)])
+
+    result = np.zeros(len(selected), dtype=dtype)
+    result['payload_length'] = header[selected, 0]
+    result['packet_type'] = header[selected, 1]
+    result['packet_number'] = header[selected, 2]
+    result['payload_type'] = header[selected, 3]
+    result['source_id'] = header[selected, 4]
+    result['destination_id'] = header[selected, 5]
+    result['header_crc'] = received_header_crc[selected]
+    result['payload_crc'] = received_payload_crc[selected]
+    result['crc_ok'] = crc_ok[selected]
+
+    if fields is not None:
+        payload_bytes = np.ascontiguousarray(frames[selected, payload_start:payload_start + fields.itemsize])
+        result['payload'] = payload_bytes.view(fields).reshape(len(selected))
+
+    return result
+
+
+def _layout(payload_class: Type[Payload]) -> Tuple[int, Optional[int], np.dtype]:
+    try:
+        return _payload_layouts[payload_class]
+    except KeyError:
+        pass
+
+    if not issubclass(payload_class, StructPayload):
+        raise ValueError(f"No wire layout registered for {payload_class.__name__}")
+
+    layout = (payload_class.PAYLOAD_TYPE, payload_class.PAYLOAD_ID, np.dtype(payload_class.dtype_descr()))
+    _payload_layouts[payload_class] = layout
+    return layout
+
+
+def _crc_columns(columns: np.ndarray) -> np.ndarray:
+    crc = np.zeros(columns.shape[0], dtype=np.uint8)
+    for column in range(columns.shape[1]):
+        crc = _CRC_TABLE[crc ^ columns[:, column]]
+    return crc
+
+
+def _as_frame_matrix(reports, report_length: int) -> np.ndarray:
+    if isinstance(reports, np.ndarray):
+        if reports.ndim == 2:
+            return reports.astype(np.uint8, copy=False)
+        return reports.astype(np.uint8, copy=False).reshape(-1, report_length)
+
+    if isinstance(reports, (bytes, bytearray, memoryview)):
+        return np.frombuffer(reports, dtype=np.uint8).reshape(-1, report_length)
+
+    # Sequence of individual buffers, possibly of different lengths: pad with zeros to the longest one
+    buffers = [memoryview(report).cast('B') for report in reports]
+    width = max((len(buffer) for buffer in buffers), default=report_length)
+    frames = np.zeros((len(buffers), width), dtype=np.uint8)
+
+    for row, buffer in enumerate(buffers):
+        frames[row, :len(buffer)] = np.frombuffer(buffer, dtype=np.uint8)
+
+    return frames
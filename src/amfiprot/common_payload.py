@@ -1,7 +1,9 @@
-from .payload import Payload
+from .payload import Payload, PayloadType
+from .schema import StructPayload, Field, Tail, StringTail, BytesTail, uuid_field
 import array
 import enum
 import struct
+import typing
 from abc import abstractmethod
 
 
@@ -61,81 +63,86 @@ class ConfigValueType(enum.IntEnum):
     PROCEDURE_CALL = 100
 
 
-class CommonPayload(Payload):
-    @classmethod
-    @abstractmethod
-    def from_bytes(cls, data):
-        """ Used as a common interface to instantiate a payload subclass from incoming raw byte data via a factory """
-        pass
+class CommonPayload(StructPayload):
+    PAYLOAD_TYPE = PayloadType.COMMON
+
+    def __str__(self):
+        return f"<{type(self).__name__}>"
 
     @abstractmethod
-    def __len__(self):
+    def to_dict(self):
         pass
 
-    def __str__(self):
-        return f"<{type(self).__name__}>"
+
+class ConfigValueField(Field):
+    """ Fixed-size slot holding a config value, whose :class:`ConfigValueType` is given by the field ``type_field``. """
+    __slots__ = ('type_field', '_type_index')
+
+    def __init__(self, name: str, type_field: str, size: int = 8):
+        super().__init__(name, f'{size}s')
+        self.type_field = type_field
+        self._type_index = None
+
+    def bind(self, field_names):
+        self._type_index = field_names.index(self.type_field)
+
+    def decode_value(self, raw, values: list):
+        return decode_config_value(values[self._type_index], raw)
+
+    def encode_value(self, value, payload):
+        return encode_config_value(value, getattr(payload, self.type_field))
 
     @property
-    def type(self):
-        return 0
+    def converts(self) -> bool:
+        return True
 
-    @abstractmethod
-    def to_bytes(self):
-        pass
 
-    @abstractmethod
-    def to_dict(self):
-        pass
+class ConfigValueTail(Tail):
+    """ Config value occupying the rest of the payload, whose :class:`ConfigValueType` is given by the field
+    ``type_field``. """
+    __slots__ = ('type_field', '_type_index')
 
+    def __init__(self, name: str, type_field: str):
+        super().__init__(name)
+        self.type_field = type_field
+        self._type_index = None
 
-class RequestDeviceIdPayload(CommonPayload):
-    def __init__(self):
-        self.data = array.array('B', [CommonPayloadId.REQUEST_DEVICE_ID])
+    def bind(self, field_names):
+        self._type_index = field_names.index(self.type_field)
 
-    @classmethod
-    def from_bytes(cls, data):
-        return RequestDeviceIdPayload()
+    def size(self, payload) -> int:
+        return config_value_size(getattr(payload, self.type_field), getattr(payload, self.name))
+
+    def decode(self, data, values: list):
+        return decode_config_value(values[self._type_index], data)
+
+    def encode_into(self, payload, buffer, offset: int) -> int:
+        encoded = encode_config_value(getattr(payload, self.name), getattr(payload, self.type_field))
+        memoryview(buffer)[offset:offset + len(encoded)] = encoded
+        return len(encoded)
 
-    def __len__(self):
-        return len(self.data)
 
-    def to_bytes(self):
-        return self.data
+class RequestDeviceIdPayload(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REQUEST_DEVICE_ID
 
     def to_dict(self):
         return {
-            'payload_id': self.data[0]
+            'payload_id': int(self.PAYLOAD_ID)
         }
 
 
 class ReplyDeviceIdPayload(CommonPayload):
-    SIZE = 14
+    PAYLOAD_ID = CommonPayloadId.REPLY_DEVICE_ID
+    FIELDS = (Field('tx_id', 'B'), uuid_field('uuid'))
 
     def __init__(self, tx_id: int, uuid: int):
         self.tx_id = tx_id
         self.uuid = uuid
 
-    @classmethod
-    def from_bytes(cls, data):
-        tx_id = data[1]
-        uuid = int.from_bytes(data[10:14] + data[6:10] + data[2:6], byteorder='little')     # Reorder uint32 blocks, to match earlier formatting of UUID
-        return ReplyDeviceIdPayload(tx_id, uuid)
-
-    def __len__(self):
-        return self.SIZE
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"tx_id: {self.tx_id}, uuid: {self.uuid:024x}"
 
-    def to_bytes(self):
-        uuid_as_bytes = self.uuid.to_bytes(12, byteorder='little')
-        data = array.array('B', [CommonPayloadId.REPLY_DEVICE_ID, self.tx_id])
-        data.extend(uuid_as_bytes[8:12])                                                     # Reorder uint32 blocks, to match earlier formatting of UUID
-        data.extend(uuid_as_bytes[4:8])
-        data.extend(uuid_as_bytes[0:4])
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_DEVICE_ID,
@@ -145,33 +152,17 @@ class ReplyDeviceIdPayload(CommonPayload):
 
 
 class SetTxIdPayload(CommonPayload):
-    SIZE = 14
+    PAYLOAD_ID = CommonPayloadId.SET_TX_ID
+    FIELDS = (Field('tx_id', 'B'), uuid_field('uuid'))
 
     def __init__(self, tx_id, uuid):
         self.tx_id = tx_id
         self.uuid = uuid
 
-    @classmethod
-    def from_bytes(cls, data):
-        tx_id = data[1]
-        uuid = int.from_bytes(data[10:14] + data[6:10] + data[2:6], byteorder='little')     # Reorder uint32 blocks, to match earlier formatting of UUID
-        return SetTxIdPayload(tx_id, uuid)
-
-    def __len__(self):
-        return self.SIZE
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"tx_id: {self.tx_id}, uuid: {self.uuid:024x}"
 
-    def to_bytes(self):
-        uuid_as_bytes = self.uuid.to_bytes(12, byteorder='little')
-        data = array.array('B', [CommonPayloadId.SET_TX_ID, self.tx_id])
-        data.extend(uuid_as_bytes[8:12])                                                     # Reorder uint32 blocks, to match earlier formatting of UUID
-        data.extend(uuid_as_bytes[4:8])
-        data.extend(uuid_as_bytes[0:4])
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.SET_TX_ID,
@@ -181,18 +172,7 @@ class SetTxIdPayload(CommonPayload):
 
 
 class RequestFirmwareVersionPayload(CommonPayload):
-    def __init__(self):
-        self.data = array.array('B', [CommonPayloadId.REQUEST_FIRMWARE_VERSION])
-
-    @classmethod
-    def from_bytes(cls, data):
-        return RequestFirmwareVersionPayload()
-
-    def __len__(self):
-        return len(self.data)
-
-    def to_bytes(self):
-        return self.data
+    PAYLOAD_ID = CommonPayloadId.REQUEST_FIRMWARE_VERSION
 
     def to_dict(self):
         return {
@@ -201,34 +181,19 @@ class RequestFirmwareVersionPayload(CommonPayload):
 
 
 class ReplyFirmwareVersionPayload(CommonPayload):
-    SIZE = 17
+    PAYLOAD_ID = CommonPayloadId.REPLY_FIRMWARE_VERSION
+    FIELDS = (Field('major', 'I'), Field('minor', 'I'), Field('patch', 'I'), Field('build', 'I'))
 
     def __init__(self, major: int, minor: int, patch: int, build: int):
         self.fw_version = {'major': major, 'minor': minor, 'patch': patch, 'build': build}
 
-    @classmethod
-    def from_bytes(cls, data):
-        major = int.from_bytes(data[1:5], byteorder='little')
-        minor = int.from_bytes(data[5:9], byteorder='little')
-        patch = int.from_bytes(data[9:13], byteorder='little')
-        build = int.from_bytes(data[13:17], byteorder='little')
-        return ReplyFirmwareVersionPayload(major, minor, patch, build)
+    def _values(self):
+        return self.fw_version['major'], self.fw_version['minor'], self.fw_version['patch'], self.fw_version['build']
 
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"fw_version: {self.fw_version['major']}.{self.fw_version['minor']}.{self.fw_version['patch']}.{self.fw_version['build']}"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_FIRMWARE_VERSION])
-        data.extend(self.fw_version['major'].to_bytes(4, byteorder='little'))
-        data.extend(self.fw_version['minor'].to_bytes(4, byteorder='little'))
-        data.extend(self.fw_version['patch'].to_bytes(4, byteorder='little'))
-        data.extend(self.fw_version['build'].to_bytes(4, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_FIRMWARE_VERSION,
@@ -236,58 +201,33 @@ class ReplyFirmwareVersionPayload(CommonPayload):
         }
 
 class RequestFirmwareVersionPerIdPayload(CommonPayload):
-    def __init__(self, processor_id: int = 0):
-        self.data = array.array('B', [CommonPayloadId.REQUEST_FIRMWARE_VERSION_PER_ID, processor_id])
-
-    @classmethod
-    def from_bytes(cls, data):
-        processor_id = data[1]
-        return RequestFirmwareVersionPerIdPayload(processor_id)
-
-    def __len__(self):
-        return len(self.data)
+    PAYLOAD_ID = CommonPayloadId.REQUEST_FIRMWARE_VERSION_PER_ID
+    FIELDS = (Field('processor_id', 'B'),)
 
-    def to_bytes(self):
-        return self.data
+    def __init__(self, processor_id: int = 0):
+        self.processor_id = processor_id
 
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REQUEST_FIRMWARE_VERSION_PER_ID,
-            'processor_id': self.data[1]
+            'processor_id': self.processor_id
         }
 
 class ReplyFirmwareVersionPerIdPayload(CommonPayload):
-    SIZE = 18
+    PAYLOAD_ID = CommonPayloadId.REPLY_FIRMWARE_VERSION_PER_ID
+    FIELDS = (Field('major', 'I'), Field('minor', 'I'), Field('patch', 'I'), Field('build', 'I'), Field('processor_id', 'B'))
 
     def __init__(self, major: int, minor: int, patch: int, build: int, processor_id: int):
         self.fw_version = {'major': major, 'minor': minor, 'patch': patch, 'build': build}
         self.processor_id = processor_id
 
-    @classmethod
-    def from_bytes(cls, data):
-        major = int.from_bytes(data[1:5], byteorder='little')
-        minor = int.from_bytes(data[5:9], byteorder='little')
-        patch = int.from_bytes(data[9:13], byteorder='little')
-        build = int.from_bytes(data[13:17], byteorder='little')
-        processor_id = data[17]
-        return ReplyFirmwareVersionPerIdPayload(major, minor, patch, build, processor_id)
+    def _values(self):
+        return self.fw_version['major'], self.fw_version['minor'], self.fw_version['patch'], self.fw_version['build'], self.processor_id
 
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"fw_version: {self.fw_version['major']}.{self.fw_version['minor']}.{self.fw_version['patch']}.{self.fw_version['build']}"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_FIRMWARE_VERSION])
-        data.extend(self.fw_version['major'].to_bytes(4, byteorder='little'))
-        data.extend(self.fw_version['minor'].to_bytes(4, byteorder='little'))
-        data.extend(self.fw_version['patch'].to_bytes(4, byteorder='little'))
-        data.extend(self.fw_version['build'].to_bytes(4, byteorder='little'))
-        data.extend(self.processor_id.to_bytes(1, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_FIRMWARE_VERSION,
@@ -297,27 +237,16 @@ class ReplyFirmwareVersionPerIdPayload(CommonPayload):
     
 
 class DebugOutputPayload(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.DEBUG_OUTPUT
+    TAIL = StringTail('debug_message')
+
     def __init__(self, debug_message: str):
         self.debug_message = debug_message
 
-    @classmethod
-    def from_bytes(cls, data):
-        debug_message = byte_array_to_string(data[1:])
-        return DebugOutputPayload(debug_message)
-
-    def __len__(self):
-        return len(self.debug_message) + 2
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"debug_message: {self.debug_message}"
 
-    def to_bytes(self):
-        arr = array.array('B', [CommonPayloadId.DEBUG_OUTPUT])
-        arr.extend(self.debug_message.encode('ascii'))
-        arr.append(0)
-        return arr
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.DEBUG_OUTPUT,
@@ -326,47 +255,25 @@ class DebugOutputPayload(CommonPayload):
 
 
 class RequestDeviceNamePayload(CommonPayload):
-    def __init__(self):
-        self.data = array.array('B', [CommonPayloadId.REQUEST_DEVICE_NAME])
-
-    @classmethod
-    def from_bytes(cls, data):
-        return RequestDeviceNamePayload()
-
-    def __len__(self):
-        return len(self.data)
-
-    def to_bytes(self):
-        return self.data
+    PAYLOAD_ID = CommonPayloadId.REQUEST_DEVICE_NAME
 
     def to_dict(self):
         return {
-            'payload_id': self.data[0]
+            'payload_id': int(self.PAYLOAD_ID)
         }
 
 
 class ReplyDeviceNamePayload(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REPLY_DEVICE_NAME
+    TAIL = StringTail('name')
+
     def __init__(self, name: str):
         self.name = name
 
-    @classmethod
-    def from_bytes(cls, data):
-        name = byte_array_to_string(data[1:])
-        return ReplyDeviceNamePayload(name)
-
-    def __len__(self):
-        return len(self.name) + 2
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"name: {self.name}"
 
-    def to_bytes(self):
-        arr = array.array('B', [CommonPayloadId.REPLY_DEVICE_NAME])
-        arr.extend(self.name.encode('ascii'))
-        arr.append(0)
-        return arr
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_DEVICE_NAME,
@@ -375,88 +282,46 @@ class ReplyDeviceNamePayload(CommonPayload):
 
 
 class RebootPayload(CommonPayload):
-    def __init__(self):
-        self.data = array.array('B', [CommonPayloadId.REBOOT])
-
-    @classmethod
-    def from_bytes(cls, data):
-        return RebootPayload()
-
-    def __len__(self):
-        return len(self.data)
-
-    def to_bytes(self):
-        return self.data
+    PAYLOAD_ID = CommonPayloadId.REBOOT
 
     def to_dict(self):
         return {
-            'payload_id': self.data[0]
+            'payload_id': int(self.PAYLOAD_ID)
         }
 
 class ResetParameterPayload(CommonPayload):
-    def __init__(self, ResetParameter: int = 0):
-        self.data = array.array('B', [CommonPayloadId.RESET_PARAMETER, ResetParameter])
-
-    @classmethod
-    def from_bytes(cls, data):
-        ResetParameter = data[1]
-        return RequestFirmwareVersionPerIdPayload(ResetParameter)
-
-    def __len__(self):
-        return len(self.data)
+    PAYLOAD_ID = CommonPayloadId.RESET_PARAMETER
+    FIELDS = (Field('reset_parameter', 'B'),)
 
-    def to_bytes(self):
-        return self.data
+    def __init__(self, ResetParameter: int = 0):
+        self.reset_parameter = ResetParameter
 
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.RESET_PARAMETER,
-            'resetParameter_id': self.data[1]
+            'resetParameter_id': self.reset_parameter
         }
 
 class RequestCategoryCountPayload(CommonPayload):
-    def __init__(self):
-        self.data = array.array('B', [CommonPayloadId.REQUEST_CATEGORY_COUNT])
-
-    @classmethod
-    def from_bytes(cls, data):
-        return RequestCategoryCountPayload()
-
-    def __len__(self):
-        return len(self.data)
-
-    def to_bytes(self):
-        return self.data
+    PAYLOAD_ID = CommonPayloadId.REQUEST_CATEGORY_COUNT
 
     def to_dict(self):
         return {
-            'payload_id': self.data[0]
+            'payload_id': int(self.PAYLOAD_ID)
         }
 
 
 class ReplyCategoryCountPayload(CommonPayload):
-    SIZE = 2
+    PAYLOAD_ID = CommonPayloadId.REPLY_CATEGORY_COUNT
+    FIELDS = (Field('category_count', 'B'),)
 
     def __init__(self, category_count):
         self.category_count = category_count
 
-    @classmethod
-    def from_bytes(cls, data):
-        category_count = int.from_bytes(data[1:2], byteorder='little', signed=False)
-        return ReplyCategoryCountPayload(category_count)
-
-    def __len__(self):
-        return self.SIZE
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"category_count: {self.category_count}"
 
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_CATEGORY_COUNT])
-        data.extend(self.category_count.to_bytes(2, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_CATEGORY_COUNT,
@@ -465,26 +330,16 @@ class ReplyCategoryCountPayload(CommonPayload):
 
 
 class RequestConfigurationCategoryPayload(CommonPayload):
-    SIZE = 2
+    PAYLOAD_ID = CommonPayloadId.REQUEST_CONFIGURATION_CATEGORY
+    FIELDS = (Field('category_id', 'B'),)
 
     def __init__(self, category_id):
         self.category_id = category_id
 
-    @classmethod
-    def from_bytes(cls, data):
-        category_id = data[1]
-        return RequestConfigurationCategoryPayload(category_id)
-
-    def __len__(self):
-        return self.SIZE
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"category_id: {self.category_id}"
 
-    def to_bytes(self):
-        return array.array('B', [CommonPayloadId.REQUEST_CONFIGURATION_CATEGORY, self.category_id])
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REQUEST_CONFIGURATION_CATEGORY,
@@ -493,29 +348,18 @@ class RequestConfigurationCategoryPayload(CommonPayload):
 
 
 class ReplyConfigurationCategory(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REPLY_CONFIGURATION_CATEGORY
+    FIELDS = (Field('category_id', 'B'),)
+    TAIL = StringTail('category_name')
+
     def __init__(self, category_id: int, category_name: str):
         self.category_id = category_id
         self.category_name = category_name
 
-    @classmethod
-    def from_bytes(cls, data):
-        category_id = data[1]
-        category_name = byte_array_to_string(data[2:])
-        return ReplyConfigurationCategory(category_id, category_name)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"category_id: {self.category_id}, category_name: {self.category_name}"
 
-    def __len__(self):
-        return 2 + len(self.category_name) + 1
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_CONFIGURATION_CATEGORY, self.category_id])
-        data.extend(self.category_name.encode('ascii'))
-        data.append(0)
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_CONFIGURATION_CATEGORY,
@@ -525,30 +369,17 @@ class ReplyConfigurationCategory(CommonPayload):
 
 
 class RequestConfigurationNameUidPayload(CommonPayload):
-    SIZE = 4
+    PAYLOAD_ID = CommonPayloadId.REQUEST_CONFIGURATION_NAME_AND_UID
+    FIELDS = (Field('category_index', 'B'), Field('config_index', 'H'))
 
     def __init__(self, category_index: int, config_index: int):
         self.category_index = category_index
         self.config_index = config_index
 
-    @classmethod
-    def from_bytes(cls, data):
-        category_index = data[1]
-        config_index = int.from_bytes(data[2:4], byteorder='little')
-        return RequestConfigurationNameUidPayload(category_index, config_index)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"cate"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REQUEST_CONFIGURATION_NAME_AND_UID, self.category_index])
-        data.extend(int.to_bytes(self.config_index, length=2, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REQUEST_CONFIGURATION_NAME_AND_UID,
@@ -558,6 +389,10 @@ class RequestConfigurationNameUidPayload(CommonPayload):
 
 
 class ReplyConfigurationNameUidPayload(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REPLY_CONFIGURATION_NAME_AND_UID
+    FIELDS = (Field('config_index', 'H'), Field('category_index', 'B'), Field('configuration_uid', 'I'))
+    TAIL = StringTail('configuration_name')
+
     def __init__(self, configuration_name: str, configuration_uid: int, config_index: int, category_index: int):
         self.configuration_uid = configuration_uid
         self.configuration_name = configuration_name
@@ -565,29 +400,13 @@ class ReplyConfigurationNameUidPayload(CommonPayload):
         self.category_index = category_index
 
     @classmethod
-    def from_bytes(cls, data):
-        config_index = int.from_bytes(data[1:3], byteorder='little')
-        category_index = int.from_bytes(data[3:4], byteorder='little')
-        uid = int.from_bytes(data[4:8], byteorder='little')
-        name = byte_array_to_string(data[8:])
-        return ReplyConfigurationNameUidPayload(name, uid, config_index, category_index)
+    def _from_values(cls, config_index, category_index, uid, name):
+        return cls(name, uid, config_index, category_index)
 
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"category_index: {self.category_index}, config_index: {self.config_index}, config_name: {self.configuration_name}, config_uid: {self.configuration_uid}"
 
-    def __len__(self):
-        return 8 + len(self.configuration_name) + 1
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_CONFIGURATION_NAME_AND_UID])
-        data.extend(self.config_index.to_bytes(2, byteorder='little'))
-        data.extend(self.category_index.to_bytes(1, byteorder='little'))
-        data.extend(self.configuration_uid.to_bytes(2, byteorder='little'))
-        data.extend(self.configuration_name.encode('ascii'))
-        data.append(0)
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_CONFIGURATION_NAME_AND_UID,
@@ -599,26 +418,16 @@ class ReplyConfigurationNameUidPayload(CommonPayload):
 
 
 class RequestConfigurationValueCountPayload(CommonPayload):
-    SIZE = 2
+    PAYLOAD_ID = CommonPayloadId.REQUEST_CONFIGURATION_VALUE_COUNT
+    FIELDS = (Field('category_index', 'B'),)
 
     def __init__(self, category_index: int):
         self.category_index = category_index
 
-    @classmethod
-    def from_bytes(cls, data):
-        category_index = data[1]
-        return RequestConfigurationValueCountPayload(category_index)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"category_index: {self.category_index}"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        return array.array('B', [CommonPayloadId.REQUEST_CONFIGURATION_VALUE_COUNT, self.category_index])
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_CONFIGURATION_VALUE_UID,
@@ -627,31 +436,17 @@ class RequestConfigurationValueCountPayload(CommonPayload):
 
 
 class ReplyConfigurationValueCountPayload(CommonPayload):
-    SIZE = 4
+    PAYLOAD_ID = CommonPayloadId.REPLY_CONFIGURATION_VALUE_COUNT
+    FIELDS = (Field('category_index', 'B'), Field('config_value_count', 'H'))
 
     def __init__(self, category_index: int, config_value_count: int):
         self.category_index = category_index
         self.config_value_count = config_value_count
 
-    @classmethod
-    def from_bytes(cls, data):
-        category_index = int.from_bytes(data[1:2], byteorder='little')
-        config_value_count = int.from_bytes(data[2:4], byteorder='little')
-        return ReplyConfigurationValueCountPayload(category_index, config_value_count)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"category_index: {self.category_index}, config_value_count: {self.config_value_count}"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_CONFIGURATION_VALUE_COUNT])
-        data.extend(self.category_index.to_bytes(1, byteorder='little'))
-        data.extend(self.config_value_count.to_bytes(2, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_CONFIGURATION_VALUE_COUNT,
@@ -660,28 +455,16 @@ class ReplyConfigurationValueCountPayload(CommonPayload):
 
 
 class RequestConfigurationValueUidPayload(CommonPayload):
-    SIZE = 5
+    PAYLOAD_ID = CommonPayloadId.REQUEST_CONFIGURATION_VALUE_UID
+    FIELDS = (Field('config_uid', 'I'),)
 
     def __init__(self, config_uid: int):
         self.config_uid = config_uid
 
-    @classmethod
-    def from_bytes(cls, data):
-        config_uid = int.from_bytes(data[1:5], byteorder='little')
-        return RequestConfigurationValueUidPayload(config_uid)
-
     def __str__(self):
         class_prefix = super().__str__() + ""
         return class_prefix + f"config_uid: {self.config_uid}"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REQUEST_CONFIGURATION_VALUE_UID])
-        data.extend(int.to_bytes(self.config_uid, length=4, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REQUEST_CONFIGURATION_VALUE_UID,
@@ -690,32 +473,23 @@ class RequestConfigurationValueUidPayload(CommonPayload):
 
 
 class ReplyConfigurationValueUidPayload(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REPLY_CONFIGURATION_VALUE_UID
+    FIELDS = (Field('uid', 'I'), Field('data_type', 'B'))
+    TAIL = ConfigValueTail('config_value', type_field='data_type')
+
     def __init__(self, uid, config_value: int, data_type: ConfigValueType):
         self.config_value = config_value
         self.data_type = data_type
         self.uid = uid
 
     @classmethod
-    def from_bytes(cls, data):
-        uid = int.from_bytes(data[1:5], byteorder='little')
-        value_type = int.from_bytes(data[5:6], byteorder='little')
-        value = decode_config_value(value_type, data[6:])
-        return ReplyConfigurationValueUidPayload(uid, value, value_type)
+    def _from_values(cls, uid, data_type, value):
+        return cls(uid, value, data_type)
 
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"config_value: {self.config_value}"
 
-    def __len__(self):
-        return len(self.to_bytes())  # FIXME: hack
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_CONFIGURATION_VALUE_UID])
-        data.extend(int.to_bytes(self.uid, 4, byteorder='little'))
-        data.append(self.data_type)
-        data.extend(encode_config_value(self.data_type, self.config_value))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_CONFIGURATION_VALUE_UID,
@@ -725,18 +499,7 @@ class ReplyConfigurationValueUidPayload(CommonPayload):
 
 
 class LoadDefaultConfigurationPayload(CommonPayload):
-    def __init__(self):
-        self.data = array.array('B', [CommonPayloadId.LOAD_DEFAULT])
-
-    @classmethod
-    def from_bytes(cls, data):
-        return LoadDefaultConfigurationPayload()
-
-    def __len__(self):
-        return len(self.data)
-
-    def to_bytes(self):
-        return self.data
+    PAYLOAD_ID = CommonPayloadId.LOAD_DEFAULT
 
     def to_dict(self):
         return {
@@ -744,32 +507,16 @@ class LoadDefaultConfigurationPayload(CommonPayload):
         }
 
 class SaveAsDefaultConfigurationPayload(CommonPayload):
-    SIZE = 13
+    PAYLOAD_ID = CommonPayloadId.SAVE_AS_DEFAULT
+    FIELDS = (uuid_field('uuid'),)
 
     def __init__(self, uuid):
         self.uuid = uuid
 
-    @classmethod
-    def from_bytes(cls, data):
-        #uuid = int.from_bytes(data[1:13], byteorder='little')
-        uuid = int.from_bytes(data[9:13] + data[5:9] + data[1:5], byteorder='little')       # Reorder uint32 blocks, to match earlier formatting of UUID
-        return SaveAsDefaultConfigurationPayload(uuid)
-
-    def __len__(self):
-        return self.SIZE
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"uuid: {self.uuid:024x}"
 
-    def to_bytes(self):
-        uuid_as_bytes = self.uuid.to_bytes(12, byteorder='little')
-        data = array.array('B', [CommonPayloadId.SAVE_AS_DEFAULT])
-        data.extend(uuid_as_bytes[8:12])                                                    # Reorder uint32 blocks, to match earlier formatting of UUID
-        data.extend(uuid_as_bytes[4:8])
-        data.extend(uuid_as_bytes[0:4])
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.SAVE_AS_DEFAULT,
@@ -777,26 +524,16 @@ class SaveAsDefaultConfigurationPayload(CommonPayload):
         }
 
 class FirmwareStartPayload(CommonPayload):
-    SIZE = 2
+    PAYLOAD_ID = CommonPayloadId.FIRMWARE_START
+    FIELDS = (Field('processor_id', 'B'),)
 
     def  __init__(self, processor_id: int = 0):
         self.processor_id = processor_id
 
-    @classmethod
-    def from_bytes(cls, data):
-        processor_id = data[1]
-        return FirmwareStartPayload(processor_id)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"processor_id: {self.processor_id}"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        return array.array('B', [CommonPayloadId.FIRMWARE_START, self.processor_id])
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.FIRMWARE_START,
@@ -805,51 +542,36 @@ class FirmwareStartPayload(CommonPayload):
 
 
 class FirmwareDataPayload(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.FIRMWARE_DATA
+    FIELDS = (Field('processor_id', 'B'),)
+    TAIL = BytesTail('firmware_data')
+
     def __init__(self, firmware_data, processor_id: int = 0):
-        self.data = array.array('B', [CommonPayloadId.FIRMWARE_DATA, processor_id])
-        firmware_bytes = array.array('B', firmware_data)
-        self.data.extend(firmware_bytes)
+        self.firmware_data = firmware_data
+        self.processor_id = processor_id
 
     @classmethod
-    def from_bytes(cls, data):
-        processor_id = data[1]
-        firmware_data = data[2:]
-        return FirmwareDataPayload(firmware_data, processor_id)
+    def _from_values(cls, processor_id, firmware_data):
+        return cls(firmware_data, processor_id)
 
     def __str__(self):
-        return "Firmware data payload: " + str(self.data)
-
-    def __len__(self):
-        return len(self.data)
-
-    def to_bytes(self):
-        return self.data
+        return "Firmware data payload: " + str(self.to_bytes())
 
     def to_dict(self):
         pass
 
 
 class FirmwareEndPayload(CommonPayload):
-    SIZE = 2
+    PAYLOAD_ID = CommonPayloadId.FIRMWARE_END
+    FIELDS = (Field('processor_id', 'B'),)
 
     def  __init__(self, processor_id: int = 0):
         self.processor_id = processor_id
 
-    @classmethod
-    def from_bytes(cls, data):
-        processor_id = data[1]
-        return FirmwareEndPayload(processor_id)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"processor_id: {self.processor_id}"
 
-    def __len__(self):
-        return self.SIZE
-
-    def to_bytes(self):
-        return array.array('B', [CommonPayloadId.FIRMWARE_END, self.processor_id])
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.FIRMWARE_END,
@@ -858,32 +580,23 @@ class FirmwareEndPayload(CommonPayload):
 
 
 class SetConfigurationValueUidPayload(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.SET_CONFIGURATION_VALUE_UID
+    FIELDS = (Field('config_uid', 'I'), Field('data_type', 'B'))
+    TAIL = ConfigValueTail('config_value', type_field='data_type')
+
     def __init__(self, uid, value, data_type):
         self.config_uid = uid
         self.config_value = value
         self.data_type = data_type
 
     @classmethod
-    def from_bytes(cls, data):
-        config_uid = int.from_bytes(data[1:5], byteorder='little')
-        data_type = data[5]
-        value = decode_config_value(data_type, data[6:])
-        return SetConfigurationValueUidPayload(config_uid, value, data_type)
+    def _from_values(cls, config_uid, data_type, value):
+        return cls(config_uid, value, data_type)
 
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"config_uid: {self.config_uid}, config_value: {self.config_value}"
 
-    def __len__(self):
-        return len(self.to_bytes())  # FIXME: hack
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.SET_CONFIGURATION_VALUE_UID])
-        data.extend(int.to_bytes(self.config_uid, length=4, byteorder='little'))
-        data.extend(int.to_bytes(self.data_type, length=1, byteorder='little'))
-        data.extend(encode_config_value(self.config_value, self.data_type))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.SET_CONFIGURATION_VALUE_UID,
@@ -892,29 +605,17 @@ class SetConfigurationValueUidPayload(CommonPayload):
         }
     
 class RequestProcedureSpec(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REQUEST_PROCEDURE_SPEC
+    FIELDS = (Field('RPC_Index', 'H'), Field('RPC_UID', 'I', encode=lambda uid: 0 if uid is None else uid))
+
     def __init__(self, index, uid=None):
         self.RPC_Index = index
         self.RPC_UID = uid
 
-    @classmethod
-    def from_bytes(cls, data):
-        RPC_Index = int.from_bytes(data[1:3], byteorder='little')
-        RPC_UID = int.from_bytes(data[3:7], byteorder='little')
-        return RequestProcedureSpec(RPC_Index, RPC_UID)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"RPC_Index: {self.RPC_Index}, RPC_UID: {self.RPC_UID}"
 
-    def __len__(self):
-        return len(self.to_bytes())  # FIXME: hack
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REQUEST_PROCEDURE_SPEC])
-        data.extend(int.to_bytes(self.RPC_Index, length=2, byteorder='little'))
-        data.extend(int.to_bytes(self.RPC_UID, length=4, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REQUEST_PROCEDURE_SPEC,
@@ -923,6 +624,17 @@ class RequestProcedureSpec(CommonPayload):
         }
     
 class ReplyProcedureSpec(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REPLY_PROCEDURE_SPEC
+    FIELDS = (Field('RPC_Index', 'H'),
+              Field('RPC_UID', 'I'),
+              Field('RPC_ReturnValueType', 'B'),
+              Field('RPC_Param1Type', 'B'),
+              Field('RPC_Param2Type', 'B'),
+              Field('RPC_Param3Type', 'B'),
+              Field('RPC_Param4Type', 'B'),
+              Field('RPC_Param5Type', 'B'))
+    TAIL = StringTail('RPC_Name', encoding='utf-8', terminated=False)
+
     def __init__(self, index=None, uid=None, returnValueType=None, Param1Type=None, Param2Type=None, Param3Type=None, Param4Type=None, Param5Type=None, Name=None):
         self.RPC_Index = index
         self.RPC_UID = uid
@@ -934,40 +646,10 @@ class ReplyProcedureSpec(CommonPayload):
         self.RPC_Param5Type = Param5Type
         self.RPC_Name = Name
 
-    @classmethod
-    def from_bytes(cls, data):
-        RPC_Index = int.from_bytes(data[1:3], byteorder='little')
-        RPC_UID = int.from_bytes(data[3:7], byteorder='little')
-        RPC_ReturnValueType = data[7]
-        RPC_Param1Type = data[8]
-        RPC_Param2Type = data[9]
-        RPC_Param3Type = data[10]
-        RPC_Param4Type = data[11]
-        RPC_Param5Type = data[12]
-        string_bytes = data[13:].tobytes()
-        RPC_Name = string_bytes.decode('utf-8')
-        return ReplyProcedureSpec(RPC_Index, RPC_UID, RPC_ReturnValueType, RPC_Param1Type, RPC_Param2Type, RPC_Param3Type, RPC_Param4Type, RPC_Param5Type, RPC_Name)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"RPC_Index: {self.RPC_Index}, RPC_UID: {self.RPC_UID}, RPC_ReturnValueType: {self.RPC_ReturnValueType}, RPC_Param1Type: {self.RPC_Param1Type}, RPC_Param2Type: {self.RPC_Param2Type}, RPC_Param3Type: {self.RPC_Param3Type}, RPC_Param4Type: {self.RPC_Param4Type}, RPC_Param5Type: {self.RPC_Param5Type}, RPC_Name: {self.RPC_Name}"
 
-    def __len__(self):
-        return len(self.to_bytes())  # FIXME: hack
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_PROCEDURE_SPEC])
-        data.extend(int.to_bytes(self.RPC_Index, length=2, byteorder='little'))
-        data.extend(int.to_bytes(self.RPC_UID, length=4, byteorder='little'))
-        data.append(self.RPC_ReturnValueType)
-        data.append(self.RPC_Param1Type)
-        data.append(self.RPC_Param2Type)
-        data.append(self.RPC_Param3Type)
-        data.append(self.RPC_Param4Type)
-        data.append(self.RPC_Param5Type)
-        data.extend(self.RPC_Name)
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_PROCEDURE_SPEC,
@@ -983,6 +665,14 @@ class ReplyProcedureSpec(CommonPayload):
         }
     
 class RequestProcedureCall(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REQUEST_PROCEDURE_CALL
+    FIELDS = (Field('RPC_UID', 'I'),
+              Field('RPC_Param1Type', 'B'), ConfigValueField('RPC_Param1Value', 'RPC_Param1Type'),
+              Field('RPC_Param2Type', 'B'), ConfigValueField('RPC_Param2Value', 'RPC_Param2Type'),
+              Field('RPC_Param3Type', 'B'), ConfigValueField('RPC_Param3Value', 'RPC_Param3Type'),
+              Field('RPC_Param4Type', 'B'), ConfigValueField('RPC_Param4Value', 'RPC_Param4Type'),
+              Field('RPC_Param5Type', 'B'), ConfigValueField('RPC_Param5Value', 'RPC_Param5Type'))
+
     def __init__(self, uid, Param1Type: ConfigValueType, Param1Value: int, Param2Type: int=None, Param2Value: int=None, Param3Type: int=None, Param3Value: int=None, Param4Type: int=None, Param4Value: int=None, Param5Type: int=None, Param5Value: int=None):
         self.RPC_UID = uid
         self.RPC_Param1Type = Param1Type
@@ -1023,43 +713,10 @@ class RequestProcedureCall(CommonPayload):
         else:
             self.RPC_Param5Value = Param5Value
 
-    @classmethod
-    def from_bytes(cls, data):
-        RPC_UID = int.from_bytes(data[1:5], byteorder='little')
-        RPC_Param1Type = data[5]
-        RPC_Param1Value = decode_config_value(RPC_Param1Type, data[6:14])
-        RPC_Param2Type = data[14]
-        RPC_Param2Value = decode_config_value(RPC_Param2Type, data[15:23])
-        RPC_Param3Type = data[23]
-        RPC_Param3Value = decode_config_value(RPC_Param3Type, data[24:32])
-        RPC_Param4Type = data[32]
-        RPC_Param4Value = decode_config_value(RPC_Param4Type, data[33:41])
-        RPC_Param5Type = data[41]
-        RPC_Param5Value = decode_config_value(RPC_Param5Type, data[42:50])
-        return RequestProcedureCall(RPC_UID, RPC_Param1Type, RPC_Param1Value, RPC_Param2Type, RPC_Param2Value, RPC_Param3Type, RPC_Param3Value, RPC_Param4Type, RPC_Param4Value, RPC_Param5Type, RPC_Param5Value)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"RPC_UID: {self.RPC_UID}, RPC_Param1Type: {self.RPC_Param1Type}, RPC_Param1Value: {self.RPC_Param1Value}, RPC_Param2Type: {self.RPC_Param2Type}, RPC_Param2Value: {self.RPC_Param2Value}, RPC_Param3Type: {self.RPC_Param3Type}, RPC_Param3Value: {self.RPC_Param3Value}, RPC_Param4Type: {self.RPC_Param4Type}, RPC_Param4Value: {self.RPC_Param4Value}, RPC_Param5Type: {self.RPC_Param5Type}, RPC_Param5Value: {self.RPC_Param5Value}"
 
-    def __len__(self):
-        return len(self.to_bytes())  # FIXME: hack
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REQUEST_PROCEDURE_CALL])
-        data.extend(int.to_bytes(self.RPC_UID, length=4, byteorder='little'))
-        data.append(self.RPC_Param1Type)
-        data.extend(int.to_bytes(self.RPC_Param1Value, length=8, byteorder='little'))
-        data.append(self.RPC_Param2Type)
-        data.extend(int.to_bytes(self.RPC_Param2Value, length=8, byteorder='little'))
-        data.append(self.RPC_Param3Type)
-        data.extend(int.to_bytes(self.RPC_Param3Value, length=8, byteorder='little'))
-        data.append(self.RPC_Param4Type)
-        data.extend(int.to_bytes(self.RPC_Param4Value, length=8, byteorder='little'))
-        data.append(self.RPC_Param5Type)
-        data.extend(int.to_bytes(self.RPC_Param5Value, length=8, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REQUEST_PROCEDURE_CALL,
@@ -1077,32 +734,18 @@ class RequestProcedureCall(CommonPayload):
         }
 
 class ReplyProcedureCall(CommonPayload):
+    PAYLOAD_ID = CommonPayloadId.REPLY_PROCEDURE_CALL
+    FIELDS = (Field('RPC_UID', 'I'), Field('RPC_ReturnType', 'B'), ConfigValueField('RPC_ReturnValue', 'RPC_ReturnType'))
+
     def __init__(self, uid=None, ReturnType: ConfigValueType=None, ReturnValue: int=None):
         self.RPC_UID = uid
         self.RPC_ReturnType = ReturnType
         self.RPC_ReturnValue = ReturnValue
 
-    @classmethod
-    def from_bytes(cls, data):
-        RPC_UID = int.from_bytes(data[1:5], byteorder='little')
-        RPC_ReturnType = data[5]
-        RPC_ReturnValue = decode_config_value(RPC_ReturnType, data[6:14])
-        return ReplyProcedureCall(RPC_UID, RPC_ReturnType, RPC_ReturnValue)
-
     def __str__(self):
         class_prefix = super().__str__() + " "
         return class_prefix + f"RPC_UID: {self.RPC_UID}, RPC_ReturnType: {self.RPC_ReturnType}, RPC_ReturnValue: {self.RPC_ReturnValue}"
 
-    def __len__(self):
-        return len(self.to_bytes())  # FIXME: hack
-
-    def to_bytes(self):
-        data = array.array('B', [CommonPayloadId.REPLY_PROCEDURE_CALL])
-        data.extend(int.to_bytes(self.RPC_UID, length=4, byteorder='little'))
-        data.append(self.RPC_ReturnType)
-        data.extend(int.to_bytes(self.RPC_ReturnValue, length=8, byteorder='little'))
-        return data
-
     def to_dict(self):
         return {
             'payload_id': CommonPayloadId.REPLY_PROCEDURE_CALL,
@@ -1115,53 +758,125 @@ def byte_array_to_string(byte_array: array.array):
     return bytes(byte_array).decode('ascii').rstrip('\x00')
 
 
+class ConfigValueCodec:
+    """ Encoder/decoder for a single :class:`ConfigValueType`. ``format`` is the :mod:`struct` format character of the
+    value, or None for variable-length (character string) values. """
+    __slots__ = ('data_type', 'format', 'struct', 'size')
+
+    def __init__(self, data_type: ConfigValueType, format: typing.Optional[str]):
+        self.data_type = data_type
+        self.format = format
+        self.struct = None if format is None else struct.Struct('<' + format)
+        self.size = 0 if format is None else self.struct.size
+
+    def decode(self, byte_data):
+        if self.struct is None:
+            return str(byte_data, 'ascii')
+
+        if len(byte_data) < self.size:
+            byte_data = bytes(byte_data).ljust(self.size, b'\x00')
+
+        return self.struct.unpack_from(byte_data)[0]
+
+    def encode(self, value) -> bytes:
+        if self.struct is None:
+            if isinstance(value, str):
+                return value.encode('ascii')
+            if isinstance(value, bytes):
+                return value
+
+            raise TypeError(f"{self.data_type.name} value must be str or bytes, not {type(value).__name__}")
+
+        return self.struct.pack(value)
+
+    def encoded_size(self, value=None) -> int:
+        if self.struct is None:
+            return 1 if value is None else len(value)
+
+        return self.size
+
+
+config_value_codecs: typing.Dict[int, ConfigValueCodec] = {
+    data_type: ConfigValueCodec(data_type, format) for data_type, format in [
+        (ConfigValueType.BOOL, '?'),
+        (ConfigValueType.CHAR, None),
+        (ConfigValueType.INT8, 'b'),
+        (ConfigValueType.UINT8, 'B'),
+        (ConfigValueType.INT16, 'h'),
+        (ConfigValueType.UINT16, 'H'),
+        (ConfigValueType.INT32, 'i'),
+        (ConfigValueType.UINT32, 'I'),
+        (ConfigValueType.INT64, 'q'),
+        (ConfigValueType.UINT64, 'Q'),
+        (ConfigValueType.FLOAT, 'f'),
+        (ConfigValueType.DOUBLE, 'd'),
+        (ConfigValueType.PROCEDURE_CALL, '?'),
+    ]
+}
+
+
 def decode_config_value(data_type: ConfigValueType, byte_data: array.array):
-    if data_type == ConfigValueType.BOOL:
-        return bool(int.from_bytes(byte_data, byteorder='little'))
-    elif data_type == ConfigValueType.CHAR:
-        return byte_data.tobytes().decode('ascii')
-    elif data_type in [ConfigValueType.INT8, ConfigValueType.INT16, ConfigValueType.INT32, ConfigValueType.INT64]:
-        return int.from_bytes(byte_data, byteorder='little', signed=True)
-    elif data_type in [ConfigValueType.UINT8, ConfigValueType.UINT16, ConfigValueType.UINT32, ConfigValueType.UINT64]:
-        return int.from_bytes(byte_data, byteorder='little', signed=False)
-    elif data_type == ConfigValueType.FLOAT:
-        return struct.unpack('f', byte_data)[0]
-    elif data_type == ConfigValueType.DOUBLE:
-        return struct.unpack('d', byte_data)[0]
-    elif data_type == ConfigValueType.PROCEDURE_CALL:
-        return bool(int.from_bytes(byte_data, byteorder='little'))
-    else:
+    codec = config_value_codecs.get(data_type)
+
+    if codec is None:
         return None
 
+    return codec.decode(byte_data)
+
+
+def decode_config_values(values: typing.Iterable[typing.Tuple[ConfigValueType, typing.Any]]) -> list:
+    """ Decode a batch of (data_type, byte_data) pairs, e.g. a full configuration snapshot. Values of the same type are
+    decoded together with a single struct call. Returns the decoded values in the order they were given. """
+    values = list(values)
+    decoded: list = [None] * len(values)
+    indices_by_type: typing.Dict[int, typing.List[int]] = {}
+
+    for index, (data_type, _) in enumerate(values):
+        indices_by_type.setdefault(data_type, []).append(index)
+
+    for data_type, indices in indices_by_type.items():
+        codec = config_value_codecs.get(data_type)
+
+        if codec is None:
+            continue
+
+        if codec.struct is None:
+            for index in indices:
+                decoded[index] = codec.decode(values[index][1])
+            continue
+
+        size = codec.size
+        chunks = []
+
+        for index in indices:
+            byte_data = values[index][1]
+            if len(byte_data) != size:
+                byte_data = bytes(byte_data[:size]).ljust(size, b'\x00')
+            chunks.append(byte_data)
+
+        for index, value in zip(indices, struct.unpack(f'<{len(indices)}{codec.format}', b''.join(chunks))):
+            decoded[index] = value
+
+    return decoded
+
+
 def encode_config_value(value, data_type: ConfigValueType):
-    if data_type == ConfigValueType.BOOL:
-        return struct.pack("?", value)
-    elif data_type == ConfigValueType.CHAR:
-        return struct.pack("c", value)
-    elif data_type == ConfigValueType.INT8:
-        return struct.pack("b", value)
-    elif data_type == ConfigValueType.UINT8:
-        return struct.pack("B", value)
-    elif data_type == ConfigValueType.INT16:
-        return struct.pack("<h", value)
-    elif data_type == ConfigValueType.UINT16:
-        return struct.pack("<H", value)
-    elif data_type == ConfigValueType.INT32:
-        return struct.pack("<i", value)
-    elif data_type == ConfigValueType.UINT32:
-        return struct.pack("<I", value)
-    elif data_type == ConfigValueType.INT64:
-        return struct.pack("<q", value)
-    elif data_type == ConfigValueType.UINT64:
-        return struct.pack("<Q", value)
-    elif data_type == ConfigValueType.FLOAT:
-        return struct.pack("f", value)
-    elif data_type == ConfigValueType.DOUBLE:
-        return struct.pack("d", value)
-    elif data_type == ConfigValueType.PROCEDURE_CALL:
-        return struct.pack("?", value)
-    else:
-        return None
+    codec = config_value_codecs.get(data_type)
+
+    if codec is None:
+        raise ValueError(f"Unknown config value type: {data_type}")
+
+    return codec.encode(value)
+
+
+def config_value_size(data_type: ConfigValueType, value=None) -> int:
+    """ Size in bytes of an encoded config value of the given type """
+    codec = config_value_codecs.get(data_type)
+
+    if codec is None:
+        return 0
+
+    return codec.encoded_size(value)
 
 
 payload_ids = {
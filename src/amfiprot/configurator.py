@@ -1,6 +1,10 @@
+import collections
 import warnings
-from typing import List, Union, Tuple
+from typing import Iterable, List, Union, Tuple
 from .common_payload import *
+from .packet import Packet
+
+REQUEST_WINDOW = 8  # Requests kept outstanding at a time when reading many values
 
 
 class Configurator:
@@ -14,11 +18,15 @@ class Configurator:
             category_name = self._get_category_name(cat_index)
             category = {'name': category_name, 'parameters': []}
 
-            for param_index in range(self._get_parameter_count(cat_index)):
-                name, uid = self._get_parameter_name_uid(cat_index, param_index)
-                value = self.read(uid)
+            parameter_count = self._get_parameter_count(cat_index)
+            names = self._request_all(RequestConfigurationNameUidPayload(cat_index, param_index)
+                                      for param_index in range(parameter_count))
+            uids = [packet.payload.configuration_uid for packet in names]
+            values = self._request_all(RequestConfigurationValueUidPayload(uid) for uid in uids)
 
-                category['parameters'].append({'uid': uid, 'name': name, 'value': value})
+            for name, uid, value in zip(names, uids, values):
+                category['parameters'].append({'uid': uid, 'name': name.payload.configuration_name,
+                                               'value': value.payload.config_value})
 
             if flat_list:
                 for param in category['parameters']:
@@ -52,12 +60,7 @@ class Configurator:
                         warnings.warn(f"Parameter \"{parameter['name']}\" ({parameter['uid']}) does not exist on device")
 
     def read(self, uid, return_datatype: bool = False) -> Union[int, float, bool, str]:
-        self.device.node.send_payload(RequestConfigurationValueUidPayload(uid))
-        packet = self.device._await_packet(ReplyConfigurationValueUidPayload)
-
-        if packet.payload.uid != uid:  # Does this ever happen?
-            warnings.warn("Config UIDs did not match. Trying again...")
-            packet = self.device._await_packet(ReplyConfigurationValueUidPayload)
+        packet = self.device.node.request_prepared(RequestConfigurationValueUidPayload, uid).result()
 
         if return_datatype:
             return packet.payload.config_value, packet.payload.data_type
@@ -73,33 +76,44 @@ class Configurator:
         if type(value) != type(old_value):
             raise ValueError(f"Data type mismatch (given {type(value)}, expected {type(old_value)}).")
 
-        self.device.node.send_payload(SetConfigurationValueUidPayload(uid, value, data_type))
-        response = self.device._await_packet(ReplyConfigurationValueUidPayload)
+        response = self.device.node.request(SetConfigurationValueUidPayload(uid, value, data_type)).result()
 
         return response.payload.config_value
 
     def reset_to_default(self):
-        self.device.node.send_payload(LoadDefaultConfigurationPayload())
+        self.device.node.send_prepared(LoadDefaultConfigurationPayload)
 
     def _get_category_count(self):
-        self.device.node.send_payload(RequestCategoryCountPayload())
-        packet = self.device._await_packet(ReplyCategoryCountPayload)
+        packet = self.device.node.request_prepared(RequestCategoryCountPayload).result()
         return packet.payload.category_count
 
     def _get_category_name(self, index) -> str:
-        self.device.node.send_payload(RequestConfigurationCategoryPayload(index))
-        packet = self.device._await_packet(ReplyConfigurationCategory)
+        packet = self.device.node.request_prepared(RequestConfigurationCategoryPayload, index).result()
         return packet.payload.category_name
 
     def _get_parameter_count(self, index):
-        self.device.node.send_payload(RequestConfigurationValueCountPayload(index))
-        packet = self.device._await_packet(ReplyConfigurationValueCountPayload)
+        packet = self.device.node.request_prepared(RequestConfigurationValueCountPayload, index).result()
         return packet.payload.config_value_count
 
     def _get_parameter_name_uid(self, category_index, parameter_index) -> Tuple[str, int]:
-        self.device.node.send_payload(RequestConfigurationNameUidPayload(category_index, parameter_index))
-        packet = self.device._await_packet(ReplyConfigurationNameUidPayload)
+        packet = self.device.node.request_prepared(RequestConfigurationNameUidPayload, category_index,
+                                                   parameter_index).result()
         return packet.payload.configuration_name, packet.payload.configuration_uid
 
+    def _request_all(self, requests: Iterable[Payload]) -> List[Packet]:
+        """ Send ``requests`` with up to :data:`REQUEST_WINDOW` of them outstanding, and return their replies in
+        order. """
+        replies = []
+        outstanding = collections.deque()
+
+        for request in requests:
+            if len(outstanding) >= REQUEST_WINDOW:
+                replies.append(outstanding.popleft().result())
+
+            outstanding.append(self.device.node.request(request))
+
+        replies.extend(future.result() for future in outstanding)
+        return replies
+
     def __save_current_config_as_default(self):
         raise NotImplementedError
@@ -1,7 +1,115 @@
 from abc import ABC, abstractmethod
-from typing import List
-from .packet import Packet
-from .node import Node
+from typing import Callable, Dict, List, Optional, Tuple
+import enum
+import io
+import multiprocessing as mp
+import multiprocessing.queues
+import queue
+import threading
+import time
+from .packet import Packet, PacketDestination, PacketTemplate, FrameError, packet_from_frame
+from .node import Node, GET_PACKETS_MAX
+from .receive_queue import ReceiveQueue, QueuePolicy
+from .common_payload import RequestDeviceIdPayload, ReplyDeviceIdPayload, RequestDeviceNamePayload, ReplyDeviceNamePayload
+
+DISCOVERY_TIMEOUT = 1  # Seconds to wait for replies to each request sent by discover_nodes()
+SPARE_RECEIVE_CHANNELS = 8  # Extra receive queues given to a reader process, for nodes found while it runs (two each)
+SYNC_MARKER = b''  # Put in a receive channel by a reader once it has applied an update (see apply_node_update). An
+                   # empty frame, so that every kind of channel (including shared-memory rings) can hold it
+FLUSH_TIMEOUT = 0.1  # Seconds an exiting reader process waits for its queues to be flushed (see release_receive_channels)
+
+REQUEST_DEVICE_ID_TEMPLATE = PacketTemplate(RequestDeviceIdPayload(), destination_id=PacketDestination.BROADCAST)
+
+
+class TransportMode(enum.IntEnum):
+    PROCESS = 0
+    """ Transmit and receive in separate processes. Packets are pickled through multiprocessing queues. """
+    THREAD = 1
+    """ Transmit and receive in threads of the calling process. Packets are handed over without pickling. """
+
+
+class IdleStrategy(enum.IntEnum):
+    """ What the I/O workers do while there is nothing to send or receive. """
+    BLOCK = 0
+    """ Block in the OS (USB read, serial read or queue get) with a bounded timeout. Uses no CPU while idle. """
+    YIELD = 1
+    """ Poll without blocking and yield the CPU to other threads between polls. """
+    SPIN = 2
+    """ Poll without blocking or yielding. Lowest wake-up latency, but keeps a core busy per worker. """
+
+
+STOP_SENTINEL = None
+""" Put into a transmit queue to make the worker reading it exit after sending everything enqueued before it. """
+
+
+class ConnectionStatistics:
+    """ Counters for received frames, and for packets that could not be sent. The counters live in shared memory, so
+    they are updated by the connection's I/O process and can be read from the main process at any time. """
+    def __init__(self):
+        self.counters = mp.RawArray('Q', len(FrameError))  # Indexed by FrameError, only written by one process
+        self.queue_drops = mp.RawValue('Q', 0)
+        self.transmit_drops = mp.RawValue('Q', 0)  # Only written by the writer
+
+    def count(self, error: FrameError):
+        self.counters[error] += 1
+
+    def count_queue_drops(self, count: int):
+        self.queue_drops.value += count
+
+    def count_transmit_drop(self):
+        self.transmit_drops.value += 1
+
+    @property
+    def dropped_queue_full(self) -> int:
+        """ Valid frames discarded because a receive queue was full (see :class:`amfiprot.QueuePolicy`). """
+        return self.queue_drops.value
+
+    @property
+    def dropped_transmit(self) -> int:
+        """ Packets that were not sent, because the device was not connected or the write failed. """
+        return self.transmit_drops.value
+
+    @property
+    def accepted(self) -> int:
+        return self.counters[FrameError.NONE]
+
+    @property
+    def dropped_malformed(self) -> int:
+        return self.counters[FrameError.MALFORMED]
+
+    @property
+    def dropped_header_crc(self) -> int:
+        return self.counters[FrameError.HEADER_CRC]
+
+    @property
+    def dropped_payload_crc(self) -> int:
+        return self.counters[FrameError.PAYLOAD_CRC]
+
+    @property
+    def dropped(self) -> int:
+        return self.dropped_malformed + self.dropped_header_crc + self.dropped_payload_crc
+
+    def reset(self):
+        for index in range(len(self.counters)):
+            self.counters[index] = 0
+
+        self.queue_drops.value = 0
+        self.transmit_drops.value = 0
+
+    def to_dict(self) -> dict:
+        return {
+            'accepted': self.accepted,
+            'dropped_malformed': self.dropped_malformed,
+            'dropped_header_crc': self.dropped_header_crc,
+            'dropped_payload_crc': self.dropped_payload_crc,
+            'dropped_queue_full': self.dropped_queue_full,
+            'dropped_transmit': self.dropped_transmit
+        }
+
+    def __str__(self):
+        return f"<ConnectionStatistics> accepted: {self.accepted}, dropped: {self.dropped} (malformed: "\
+               f"{self.dropped_malformed}, header CRC: {self.dropped_header_crc}, payload CRC: {self.dropped_payload_crc}), "\
+               f"dropped on full queues: {self.dropped_queue_full}, not sent: {self.dropped_transmit}"
 
 
 class Connection(ABC):
@@ -20,12 +128,14 @@ class Connection(ABC):
 
     @abstractmethod
     def stop(self):
-        """ Stops the subprocesses that were created when invoking start(). """
+        """ Stops the subprocesses that were created when invoking start(), after sending the packets that were
+        enqueued before. Does nothing if they are not running. """
         pass
 
     @abstractmethod
-    def refresh(self):
-        """ Inform the connection that e.g. a previously registered node has changed """
+    def refresh(self) -> bool:
+        """ Inform the connection that e.g. a previously registered node has changed, or that nodes were added or
+        removed. Returns False if the running workers cannot be updated and the connection must be restarted. """
         pass
 
     @abstractmethod
@@ -33,8 +143,295 @@ class Connection(ABC):
         """ Enqueue a packet for transmission. """
         pass
 
+    def create_receive_queue(self, capacity: Optional[int] = None, capacity_bytes: Optional[int] = None,
+                             policy: Optional[QueuePolicy] = None):
+        """ Create a queue that the connection can deliver received packets to (e.g. for a new Node). Connections that
+        do not bound their receive queues ignore ``capacity``, ``capacity_bytes`` and ``policy``. """
+        return mp.Queue()
+
+    def subscribe(self, capacity: Optional[int] = None, capacity_bytes: Optional[int] = None,
+                  policy: Optional[QueuePolicy] = None) -> ReceiveQueue:
+        """ Returns a queue that receives every packet on the connection, from any node (including nodes not found by
+        :meth:`find_nodes`). Packets are only copied to such queues while they are subscribed, so unsubscribe queues
+        that are no longer read. Capacity and policy default to those of the connection.
+
+        Subscriptions are passed to the workers as taps of the connection's ``receive_channels`` (see
+        :class:`ReceiveChannels`), through its ``node_update_queue``. """
+        channel = self.create_receive_queue(capacity, capacity_bytes, policy)
+        self.receive_channels.taps.append(channel)
+        self._update_or_restart()
+        return channel
+
+    def unsubscribe(self, channel):
+        """ Stop copying packets to a queue returned by :meth:`subscribe`. Packets received before the change reaches
+        the running workers may still be put in it. """
+        self.receive_channels.taps.remove(channel)
+        self._update_or_restart()
+
+    @property
+    def global_receive_queue(self):
+        """ A queue receiving every packet on the connection, subscribed when first accessed (see :meth:`subscribe`). """
+        if self._global_receive_queue is None:
+            self._global_receive_queue = self.subscribe()
+
+        return self._global_receive_queue
+
+    def fileno(self) -> int:
+        """ A descriptor that becomes readable when packets are received, for any node. Edge-triggered like
+        :meth:`amfiprot.Node.fileno`: it is cleared by :meth:`drain`. It is the descriptor of the connection's
+        ``notifier``, which the notifiers of its receive queues signal. Raises ``io.UnsupportedOperation`` if the
+        connection has none. """
+        notifier = getattr(self, 'notifier', None)
+        if notifier is None:
+            raise io.UnsupportedOperation(f"{type(self).__name__} has no descriptor")
+
+        return notifier.fileno()
+
+    def drain(self, max_packets: int = GET_PACKETS_MAX) -> List[Packet]:
+        """ Clear :meth:`fileno` and return the packets already received by the nodes, up to ``max_packets`` per
+        node (see :meth:`amfiprot.Node.drain`). """
+        notifier = getattr(self, 'notifier', None)
+        if notifier is not None:
+            notifier.clear()
+
+        return [packet for node in list(self.nodes) for packet in node.drain(max_packets)]
+
+    def _update_or_restart(self):
+        if not self.refresh():
+            # The workers cannot be given the new queues, so they have to be restarted
+            self.stop()
+            self.start()
+
+    def _update_workers(self, sync=None) -> bool:
+        """ Send the running reader the current nodes and taps, see :meth:`ReceiveChannels.update`. Returns False if a
+        node's queue cannot be sent to it. """
+        update = self.receive_channels.update(self.nodes, self._channels_transferable(), sync)
+        if update is None:
+            return False
+
+        self.node_update_queue.put(update)
+        return True
+
+    def _channels_transferable(self) -> bool:
+        """ True if receive channels can be sent to the running reader through the node update queue. The shared state
+        of a ReceiveQueue can only be passed to a process when it is started, so by default they cannot. """
+        return False
+
     @abstractmethod
     def max_payload_size(self) -> int:
         """ Returns the maximum size (in bytes) of the payload (not the entire packet) for the connection. """
         pass
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class ReceiveChannels:
+    """ The receive channels (node queues, or rings) that a connection's reader was given, kept in the main process so
+    nodes can be added, removed and re-addressed while the reader runs (see :func:`apply_node_update`).
+
+    Channels are referred to by their position in :attr:`channels`. A reader process can only use channels that it got
+    when it was started, or that can be pickled (shared-memory rings), so readers using ``multiprocessing.Queue``
+    objects are given a few spare channels for nodes found later. """
+    def __init__(self):
+        self.channels = []  # In the order known by the reader
+        self.spares = []  # Channels known by the reader, not yet used by a node
+        self.taps = []  # Channels that receive every packet
+
+    def reset(self, nodes: List[Node], spares: list = (), others: list = ()) -> list:
+        """ Start over with the channels of ``nodes``, ``spares``, ``others`` (e.g. a channel used for discovery) and
+        the current taps. Returns the channels to give to a new reader, which must then be sent an :meth:`update` for
+        the taps to take effect. """
+        self.channels = [node.receive_queue for node in nodes] + [node.control_queue for node in nodes]
+        self.channels += list(spares) + list(others)
+        self.channels += [tap for tap in self.taps if self.index(tap) is None]
+        self.spares = list(spares)
+        return list(self.channels)
+
+    def take_spare(self):
+        """ Returns a channel already known by the reader, or None if there is none left. """
+        return self.spares.pop(0) if len(self.spares) > 0 else None
+
+    def index(self, channel) -> Optional[int]:
+        for index, known in enumerate(self.channels):
+            if known is channel:
+                return index
+
+        return None
+
+    def update(self, nodes: List[Node], transferable: bool, sync=None) -> Optional[dict]:
+        """ Create the message that makes the reader route packets to ``nodes`` (by their current TX IDs), control
+        packets to their control lanes. Channels the reader does not know yet are included if ``transferable``,
+        otherwise None is returned.
+
+        If a ``sync`` channel is given, the reader puts :data:`SYNC_MARKER` in it once the message has been applied. """
+        new_channels = {}
+
+        for channel in [node.receive_queue for node in nodes] + [node.control_queue for node in nodes] + self.taps:
+            if self.index(channel) is None:
+                if not transferable:
+                    return None
+
+                new_channels[len(self.channels)] = channel
+                self.channels.append(channel)
+
+        update = {
+            'channels': new_channels,
+            'routes': {node.tx_id: self.index(node.receive_queue) for node in nodes},
+            'control_routes': {node.tx_id: self.index(node.control_queue) for node in nodes},
+            'taps': [self.index(channel) for channel in self.taps]
+        }
+
+        if sync is not None and self.index(sync) is not None:
+            update['sync'] = self.index(sync)
+
+        return update
+
+
+def apply_node_update(update: dict, channels: list) -> Tuple[Dict[int, object], Dict[int, object], list]:
+    """ Apply a message from a connection's ``node_update_queue`` in a reader. ``channels`` is the reader's list of
+    receive channels, extended in place with channels sent in the message. Returns the routing tables (source TX ID to
+    channel) for data and for control packets (see :func:`amfiprot.packet.is_control_frame`), and the channels that
+    receive every packet. Without control lanes in the message, control packets are routed with the data. """
+    for index, channel in update.get('channels', {}).items():
+        channels.extend([None] * (index + 1 - len(channels)))
+        channels[index] = channel
+
+    if 'routes' in update:
+        routes = {tx_id: channels[index] for tx_id, index in update['routes'].items()}
+    else:  # TX IDs in the order of the channels
+        routes = dict(zip(update['tx_ids'], channels))
+
+    if 'control_routes' in update:
+        control_routes = {tx_id: channels[index] for tx_id, index in update['control_routes'].items()}
+
+        for tx_id, control_channel in control_routes.items():
+            # Signal the node's data lane as well, so a node has one descriptor (see Node.fileno()), while the control
+            # lane keeps its own notifier for its reader (see Correlator)
+            notifier = getattr(routes.get(tx_id), 'notifier', None)
+            control_notifier = getattr(control_channel, 'notifier', None)
+            if notifier is not None and control_notifier is not None and control_notifier is not notifier:
+                control_notifier.parent = notifier
+    else:
+        control_routes = routes
+
+    taps = [channels[index] for index in update.get('taps', ())]
+
+    if 'sync' in update:
+        channels[update['sync']].put_nowait(SYNC_MARKER)
+
+    return routes, control_routes, taps
+
+
+def discover_nodes(connection: Connection, send: Callable[[Packet], None],
+                   receive: Callable[[float], Optional[Packet]], known_nodes: List[Node] = ()) -> List[Node]:
+    """ Broadcast a device ID request, and ask each node that replies for its name.
+
+    ``send(packet)`` transmits a packet, and ``receive(timeout)`` returns the next received packet, or None if there
+    was none within ``timeout`` seconds. Nodes in ``known_nodes`` are reused (matched by UUID, with their TX ID
+    updated), so their receive queues stay valid. New nodes are created on ``connection``. """
+    known = {node.uuid: node for node in known_nodes}
+    nodes = []
+
+    send(REQUEST_DEVICE_ID_TEMPLATE.packet())
+
+    for packet in _receive_until(receive, time.monotonic() + DISCOVERY_TIMEOUT):
+        payload = packet.payload
+
+        if type(payload) == ReplyDeviceIdPayload and payload.uuid not in [node.uuid for node in nodes]:
+            node = known.get(payload.uuid)
+
+            if node is None:
+                node = Node(tx_id=payload.tx_id, uuid=payload.uuid, connection=connection)
+            else:
+                node.tx_id = payload.tx_id
+
+            nodes.append(node)
+
+    for node in nodes:
+        send(Packet.from_payload(RequestDeviceNamePayload(), destination_id=node.tx_id))
+
+        for packet in _receive_until(receive, time.monotonic() + DISCOVERY_TIMEOUT):
+            if type(packet.payload) == ReplyDeviceNamePayload and packet.header.source_tx_id == node.tx_id:
+                node.name = packet.payload.name
+                break
+
+    return nodes
+
+
+def release_receive_channels(channels, timeout: float = FLUSH_TIMEOUT):
+    """ Called by a reader process before it exits. Frames put in a ``multiprocessing.Queue`` are written to its pipe by
+    a background thread, and the process cannot exit before they are, which is never if nobody reads the queue (e.g.
+    the global receive queue). Waits up to ``timeout`` seconds for the frames to be written, then gives up on the rest. """
+    channels = [channel.queue if isinstance(channel, ReceiveQueue) else channel for channel in channels]
+    queues = [channel for channel in channels if isinstance(channel, mp.queues.Queue)]
+
+    for channel in queues:
+        channel.close()  # No more puts, the background thread exits once everything is written
+
+    flusher = threading.Thread(target=lambda: [channel.join_thread() for channel in queues], daemon=True)
+    flusher.start()
+    flusher.join(timeout)
+
+    for channel in queues:
+        channel.cancel_join_thread()
+
+
+def receive_packet(channel, timeout: float) -> Optional[Packet]:
+    """ Get the next packet from a receive channel, or None if there was none within ``timeout`` seconds. """
+    try:
+        frame = channel.get(timeout=timeout)
+    except queue.Empty:
+        return None
+
+    return None if frame == SYNC_MARKER else packet_from_frame(frame)
+
+
+def wait_for_sync(channel, timeout: float) -> bool:
+    """ Discard everything in a receive channel up to :data:`SYNC_MARKER`. Returns False if it did not arrive within
+    ``timeout`` seconds. """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            if channel.get(timeout=max(0.0, deadline - time.monotonic())) == SYNC_MARKER:
+                return True
+        except queue.Empty:
+            return False
+
+
+def drain(channel):
+    """ Discard everything in a receive channel. """
+    try:
+        while True:
+            channel.get_nowait()
+    except queue.Empty:
+        pass
+
+
+def discard_until_stop(tx_queue, timeout: float = FLUSH_TIMEOUT):
+    """ Discard what a transmit queue holds up to :data:`STOP_SENTINEL`, waiting up to ``timeout`` seconds for it. For
+    a writer that stopped before dequeuing the sentinel: the next writer would otherwise send the packets left before
+    it, and then exit on it. """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            if tx_queue.get(timeout=max(0.0, deadline - time.monotonic())) is STOP_SENTINEL:
+                return
+        except queue.Empty:
+            return
+
+
+def _receive_until(receive: Callable[[float], Optional[Packet]], deadline: float):
+    remaining = deadline - time.monotonic()
+
+    while remaining > 0:
+        packet = receive(remaining)
+        if packet is not None:
+            yield packet
+
+        remaining = deadline - time.monotonic()
@@ -0,0 +1,278 @@
+"""
+Correlation of replies with requests.
+
+A request is registered with the :class:`Correlator` of its node before it is sent, and gets a
+``concurrent.futures.Future``. While requests are outstanding, a dispatcher thread reads the node's control lane and
+resolves the future of the request each reply answers, so any number of requests can be in flight at once, from any
+number of threads.
+
+Replies are recognized by payload class and the fields that identify what was requested (see :data:`REPLY_SPECS`),
+status replies (e.g. ``PayloadType.SUCCESS``) by payload type, and acks by packet number. Outstanding requests that the
+same reply would answer are answered in the order they were made.
+"""
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type
+
+from .common_payload import (RequestDeviceIdPayload, ReplyDeviceIdPayload, RequestFirmwareVersionPayload,
+                             ReplyFirmwareVersionPayload, RequestFirmwareVersionPerIdPayload,
+                             ReplyFirmwareVersionPerIdPayload, RequestDeviceNamePayload, ReplyDeviceNamePayload,
+                             RequestCategoryCountPayload, ReplyCategoryCountPayload,
+                             RequestConfigurationCategoryPayload, ReplyConfigurationCategory,
+                             RequestConfigurationNameUidPayload, ReplyConfigurationNameUidPayload,
+                             RequestConfigurationValueCountPayload, ReplyConfigurationValueCountPayload,
+                             RequestConfigurationValueUidPayload, ReplyConfigurationValueUidPayload,
+                             SetConfigurationValueUidPayload, FirmwareStartPayload, FirmwareDataPayload,
+                             RequestProcedureSpec, ReplyProcedureSpec, RequestProcedureCall, ReplyProcedureCall)
+from .packet import Packet, PacketType, packet_from_frame
+from .payload import Payload, PayloadType
+
+REQUEST_TIMEOUT_MS = 1000  # Default time to wait for a reply
+DISPATCH_POLL_INTERVAL = 0.1  # Seconds, the longest the dispatcher waits on the control lane between expiry checks
+UNMATCHED_CAPACITY = 256  # Control packets kept that did not answer a request
+
+
+class ReplySpec(NamedTuple):
+    """ How the reply to a request is recognized: by ``reply_class``, with the values of ``keys`` (pairs of request
+    and reply attribute names) equal in request and reply, or, for status replies, by ``payload_type``. Keys that are
+    None in the request are not compared. If all of ``keys`` are None, ``fallback_keys`` are compared instead, e.g. the
+    index of a procedure requested without its UID. """
+    reply_class: Optional[Type[Payload]] = None
+    keys: Tuple[Tuple[str, str], ...] = ()
+    payload_type: Optional[PayloadType] = None
+    fallback_keys: Tuple[Tuple[str, str], ...] = ()
+
+
+REPLY_SPECS: Dict[Type[Payload], ReplySpec] = {
+    RequestDeviceIdPayload: ReplySpec(ReplyDeviceIdPayload),
+    RequestFirmwareVersionPayload: ReplySpec(ReplyFirmwareVersionPayload),
+    RequestFirmwareVersionPerIdPayload: ReplySpec(ReplyFirmwareVersionPerIdPayload, (('processor_id', 'processor_id'),)),
+    RequestDeviceNamePayload: ReplySpec(ReplyDeviceNamePayload),
+    RequestCategoryCountPayload: ReplySpec(ReplyCategoryCountPayload),
+    RequestConfigurationCategoryPayload: ReplySpec(ReplyConfigurationCategory, (('category_id', 'category_id'),)),
+    RequestConfigurationNameUidPayload: ReplySpec(ReplyConfigurationNameUidPayload,
+                                                  (('category_index', 'category_index'),
+                                                   ('config_index', 'config_index'))),
+    RequestConfigurationValueCountPayload: ReplySpec(ReplyConfigurationValueCountPayload,
+                                                     (('category_index', 'category_index'),)),
+    RequestConfigurationValueUidPayload: ReplySpec(ReplyConfigurationValueUidPayload, (('config_uid', 'uid'),)),
+    SetConfigurationValueUidPayload: ReplySpec(ReplyConfigurationValueUidPayload, (('config_uid', 'uid'),)),
+    RequestProcedureSpec: ReplySpec(ReplyProcedureSpec, (('RPC_UID', 'RPC_UID'),),
+                                    fallback_keys=(('RPC_Index', 'RPC_Index'),)),
+    RequestProcedureCall: ReplySpec(ReplyProcedureCall, (('RPC_UID', 'RPC_UID'),)),
+    FirmwareStartPayload: ReplySpec(payload_type=PayloadType.SUCCESS),
+    FirmwareDataPayload: ReplySpec(payload_type=PayloadType.SUCCESS),
+}
+""" Reply specifications of the common requests, by request payload class. """
+
+
+def register_reply(request_class: Type[Payload], spec: ReplySpec):
+    """ Declare how replies to ``request_class`` are recognized, e.g. for the requests of a custom device. """
+    REPLY_SPECS[request_class] = spec
+
+
+class Expectation:
+    """ The reply awaited by one outstanding request. """
+    __slots__ = ('future', 'deadline', 'reply_class', 'values', 'payload_type', 'ack_number', 'description')
+
+    def __init__(self, request: Payload, packet_number: int, packet_type: PacketType = PacketType.NO_ACK,
+                 spec: Optional[ReplySpec] = None, timeout_ms: Optional[int] = REQUEST_TIMEOUT_MS):
+        if spec is None:
+            spec = REPLY_SPECS.get(type(request))
+
+        self.future = concurrent.futures.Future()
+        self.deadline = None if timeout_ms is None else time.monotonic() + timeout_ms / 1000
+        self.description = type(request).__name__
+        self.reply_class, self.values, self.payload_type, self.ack_number = None, (), None, None
+
+        if spec is not None:
+            self.reply_class = spec.reply_class
+            self.payload_type = spec.payload_type
+            self.values = _key_values(request, spec.keys) or _key_values(request, spec.fallback_keys)
+        elif packet_type == PacketType.REQUEST_ACK:
+            self.ack_number = packet_number
+        else:
+            raise ValueError(f"No reply is known for {self.description}, see amfiprot.correlation.register_reply().")
+
+    def matches(self, packet: Packet) -> bool:
+        if self.ack_number is not None:
+            return packet.packet_type == PacketType.ACK and packet.header.packet_number == self.ack_number
+
+        if self.payload_type is not None:
+            return packet.payload_type == self.payload_type
+
+        payload = packet.payload
+        return type(payload) is self.reply_class and all(getattr(payload, key) == value for key, value in self.values)
+
+
+def _key_values(request: Payload, keys: Tuple[Tuple[str, str], ...]) -> Tuple[Tuple[str, object], ...]:
+    """ (reply attribute name, value) pairs of the keys that are not None in ``request``. """
+    return tuple((reply_key, getattr(request, request_key)) for request_key, reply_key in keys
+                 if getattr(request, request_key) is not None)
+
+
+class Correlator:
+    """ Matches the packets on a node's control lane to the node's outstanding requests (see the module
+    documentation). The dispatcher thread only runs while requests are outstanding (or :meth:`get` waits), and is then
+    the only reader of the lane, which may be a single-consumer ring. Control packets that do not answer a request are
+    returned by :meth:`get`, at most :data:`UNMATCHED_CAPACITY` of them are kept, and signal the ``notifier`` (if
+    given) when the dispatcher keeps them. """
+    def __init__(self, control_queue, notifier=None):
+        self.control_queue = control_queue
+        self.notifier = notifier
+        self._pending: List[Expectation] = []
+        self._unmatched = collections.deque(maxlen=UNMATCHED_CAPACITY)
+        self._condition = threading.Condition()
+        self._dispatcher: Optional[threading.Thread] = None
+        self._waiting = 0  # Calls of get() waiting for the dispatcher
+
+    def expect(self, request: Payload, packet_number: int, packet_type: PacketType = PacketType.NO_ACK,
+               spec: Optional[ReplySpec] = None, timeout_ms: Optional[int] = REQUEST_TIMEOUT_MS) -> concurrent.futures.Future:
+        """ Register a request, before sending it. The returned future gets the reply packet, or a ``TimeoutError`` if
+        there was none within ``timeout_ms`` (None to wait until the future is cancelled). Raises ValueError if it is
+        not known what the reply to ``request`` is, and ``spec`` is not given. """
+        expectation = Expectation(request, packet_number, packet_type, spec, timeout_ms)
+
+        with self._condition:
+            self._pending.append(expectation)
+            self._start_dispatcher()
+
+        return expectation.future
+
+    def outstanding(self) -> int:
+        """ Number of requests waiting for a reply. """
+        with self._condition:
+            return len(self._pending)
+
+    def available(self) -> bool:
+        """ Whether :meth:`get` has a packet to return (as far as can be told without reading the lane). """
+        with self._condition:
+            if len(self._unmatched) > 0:
+                return True
+
+            return self._dispatcher is None and not self.control_queue.empty()
+
+    def get(self, timeout_ms: float = 0) -> Optional[Packet]:
+        """ The next control packet that did not answer a request, waiting up to ``timeout_ms`` for one. Returns None
+        if there was none. """
+        deadline = time.monotonic() + timeout_ms / 1000
+
+        with self._condition:
+            if len(self._unmatched) == 0 and self._dispatcher is None:
+                # Nothing else reads the lane (a dispatcher is only started with the lock held), and no requests are
+                # outstanding, so every packet on it is unmatched
+                try:
+                    return packet_from_frame(self.control_queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+            if len(self._unmatched) == 0 and timeout_ms > 0:
+                self._waiting += 1
+                self._start_dispatcher()
+
+                try:
+                    while len(self._unmatched) == 0:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            return self._unmatched.popleft() if len(self._unmatched) > 0 else None
+
+    def _start_dispatcher(self):
+        # With the lock held
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch, name='amfiprot-correlator', daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch(self):
+        error = None
+
+        try:
+            while True:
+                with self._condition:
+                    expired = self._take_expired()
+
+                    if len(self._pending) == 0 and len(expired) == 0 and self._waiting == 0:
+                        self._dispatcher = None
+                        return
+
+                    now = time.monotonic()
+                    wait = min([DISPATCH_POLL_INTERVAL] + [expectation.deadline - now for expectation in self._pending
+                                                            if expectation.deadline is not None])
+
+                for expectation in expired:
+                    expectation.future.set_exception(TimeoutError(f"No reply to {expectation.description}."))
+
+                try:
+                    frame = self.control_queue.get(timeout=max(wait, 0.001))
+                except queue.Empty:
+                    continue
+
+                packet = packet_from_frame(frame)
+
+                if not self._resolve(packet):
+                    with self._condition:
+                        self._unmatched.append(packet)
+                        self._condition.notify_all()
+
+                    if self.notifier is not None:
+                        self.notifier.notify()
+        except BaseException as exception:
+            error = exception
+            raise
+        finally:
+            failed = []
+
+            with self._condition:
+                if self._dispatcher is threading.current_thread():  # Stopped by an error, not for being idle
+                    self._dispatcher = None
+                    failed, self._pending = self._pending, []
+                    self._condition.notify_all()
+
+            for expectation in failed:  # Rather than leaving them waiting for a dispatcher that is gone
+                if expectation.future.set_running_or_notify_cancel():
+                    expectation.future.set_exception(error)
+
+    def _resolve(self, packet: Packet) -> bool:
+        """ Give ``packet`` to the first outstanding request it answers. Returns False if there is none. """
+        with self._condition:
+            for expectation in list(self._pending):
+                try:
+                    matched = expectation.matches(packet)
+                except Exception:  # The payload cannot be decoded (e.g. truncated), so it answers no request by payload
+                    matched = False
+
+                if not matched:
+                    continue
+
+                self._pending.remove(expectation)
+
+                if expectation.future.set_running_or_notify_cancel():  # False if it was cancelled
+                    break
+            else:
+                return False
+
+        expectation.future.set_result(packet)
+        return True
+
+    def _take_expired(self) -> List[Expectation]:
+        """ Remove cancelled and expired requests, returning the expired ones (with futures that can be resolved). """
+        now = time.monotonic()
+        expired = []
+
+        for expectation in list(self._pending):
+            if expectation.future.cancelled():
+                self._pending.remove(expectation)
+            elif expectation.deadline is not None and now >= expectation.deadline:
+                self._pending.remove(expectation)
+
+                if expectation.future.set_running_or_notify_cancel():
+                    expired.append(expectation)
+
+        return expired
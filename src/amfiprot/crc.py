@@ -0,0 +1,94 @@
+"""
+Table-driven CRC-8 used for Amfiprot header and payload checksums.
+
+The polynomial is 0x12F (x^8 + x^5 + x^3 + x^2 + x + 1), non-reflected, with an initial value of 0 and no final XOR.
+All functions accept any object that yields byte values when iterated (``bytes``, ``bytearray``, ``memoryview``,
+``array.array('B')``), so data can be checked in place without being copied first.
+"""
+from typing import Iterable, List, Optional
+
+CRC8_POLYNOMIAL = 0x12F
+
+
+def _generate_table(polynomial: int) -> List[int]:
+    table = []
+    poly = polynomial & 0xFF
+
+    for index in range(256):
+        crc = index
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ poly) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table.append(crc)
+
+    return table
+
+
+CRC8_TABLE = tuple(_generate_table(CRC8_POLYNOMIAL))
+
+
+def crc8(data, crc: int = 0) -> int:
+    """ Calculate the CRC of ``data`` in one shot. ``crc`` can be used to continue from a previous value. """
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+def crc8_range(data, start: int, stop: int, crc: int = 0) -> int:
+    """ Calculate the CRC of ``data[start:stop]`` without slicing the buffer. """
+    table = CRC8_TABLE
+    for byte in memoryview(data)[start:stop]:
+        crc = table[crc ^ byte]
+    return crc
+
+
+def crc8_batch(buffers: Iterable, start: int = 0, stop: Optional[int] = None) -> List[int]:
+    """ Calculate the CRC of ``buffer[start:stop]`` for each buffer in ``buffers``. """
+    table = CRC8_TABLE
+    results = []
+
+    for buffer in buffers:
+        crc = 0
+        for byte in memoryview(buffer)[start:stop]:
+            crc = table[crc ^ byte]
+        results.append(crc)
+
+    return results
+
+
+class Crc8:
+    """ Incremental CRC-8 calculator with the same update/digest interface as e.g. :mod:`hashlib` and ``crcmod``. """
+    __slots__ = ('crc',)
+
+    def __init__(self, data=None, crc: int = 0):
+        self.crc = crc
+
+        if data is not None:
+            self.update(data)
+
+    def update(self, data) -> 'Crc8':
+        table = CRC8_TABLE
+        crc = self.crc
+        for byte in data:
+            crc = table[crc ^ byte]
+        self.crc = crc
+        return self
+
+    def update_byte(self, byte: int) -> 'Crc8':
+        self.crc = CRC8_TABLE[self.crc ^ byte]
+        return self
+
+    def copy(self) -> 'Crc8':
+        return Crc8(crc=self.crc)
+
+    def reset(self):
+        self.crc = 0
+
+    def digest(self) -> bytes:
+        return bytes((self.crc,))
+
+    def hexdigest(self) -> str:
+        return f"{self.crc:02X}"
@@ -1,10 +1,11 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, List, Optional
 import time
 import os
-from .packet import Packet, PacketType
+from .packet import Packet, PacketType, is_control_payload_type
 from .common_payload import *
 from .configurator import Configurator
+from .node import GET_PACKETS_MAX
 from .payload import *
 
 if TYPE_CHECKING:
@@ -21,8 +22,7 @@ class Device:
         self.config = Configurator(self)
 
     def get_tx_id_uuid(self) -> tuple[int, int]:
-        self.node.send_payload(RequestDeviceIdPayload())
-        packet = self._await_packet(ReplyDeviceIdPayload)
+        packet = self.node.request_prepared(RequestDeviceIdPayload).result()
 
         self.node.tx_id = packet.payload.tx_id
         self.node.uuid = packet.payload.uuid
@@ -30,14 +30,12 @@ class Device:
         return packet.payload.tx_id, packet.payload.uuid
 
     def firmware_version(self, processor_id: int = 0) -> dict:
-        self.node.send_payload(RequestFirmwareVersionPerIdPayload(processor_id))
-        packet = self._await_packet(ReplyFirmwareVersionPerIdPayload)
+        packet = self.node.request_prepared(RequestFirmwareVersionPerIdPayload, processor_id).result()
         return packet.payload.fw_version
 
     def name(self) -> str:
         if self.node.name is None:
-            self.node.send_payload(RequestDeviceNamePayload())
-            packet = self._await_packet(ReplyDeviceNamePayload)
+            packet = self.node.request_prepared(RequestDeviceNamePayload).result()
             self.node.name = packet.payload.name
 
         return self.node.name
@@ -55,16 +53,14 @@ class Device:
         chunks = [bin_data[i:i + chunk_size] for i in range(0, file_size, chunk_size)]
 
         # Send firmware start command
-        self.node.send_payload(FirmwareStartPayload())
-        self._await_reply(PayloadType.SUCCESS, timeout_ms=20_000)
+        self.node.request(FirmwareStartPayload(), timeout_ms=20_000).result()
 
         # Send data packets and receive Ack for each packet
         progress_timer = MilliTimer(1000, autostart=True)
 
         for index, chunk in enumerate(chunks):
             payload = FirmwareDataPayload(chunk)
-            self.node.send_payload(payload, packet_type=PacketType.REQUEST_ACK)
-            self._await_reply(PayloadType.SUCCESS, timeout_ms=10_000)
+            self.node.request(payload, packet_type=PacketType.REQUEST_ACK, timeout_ms=10_000).result()
 
             if progress_timer.expired() and print_progress:
                 progress = (index / len(chunks)) * 100
@@ -87,63 +83,72 @@ class Device:
         return new_tx_id == tx_id
 
     def reboot(self):
-        self.node.send_payload(RebootPayload())
+        self.node.send_prepared(RebootPayload)
 
     def getProcedureSpec(self, index, uid=None) -> ReplyProcedureCall:
-        payload = RequestProcedureSpec(index, uid)
-        self.node.send_payload(payload)
-        packet = self._await_packet(ReplyProcedureSpec, timeout_ms=1000)
-        return packet
+        return self.node.request(RequestProcedureSpec(index, uid)).result()
 
     def callProcedure(self, uid, Param1Type: ConfigValueType, Param1Value: int, Param2Type=None, Param2Value=None, Param3Type=None, Param3Value=None, Param4Type=None, Param4Value=None, Param5Type=None, Param5Value=None):
         payload = RequestProcedureCall(uid, Param1Type, Param1Value, Param2Type, Param2Value, Param3Type, Param3Value, Param4Type, Param4Value, Param5Type, Param5Value)
-        self.node.send_payload(payload)
-        packet = self._await_packet(ReplyProcedureCall, timeout_ms=1000)
-        return packet
+        return self.node.request(payload).result()
 
     def packet_available(self) -> bool:
         return self.node.packet_available()
 
-    def get_packet(self) -> Optional[Packet]:
-        """ For specialized devices, this is where we reinterpret UndefinedPayloads as
-        application-specific payload types """
-        return self.node.get_packet()
+    def get_packet(self, blocking: bool = False, timeout_ms: Optional[int] = 1000) -> Optional[Packet]:
+        """ Application-specific payload types are decoded directly, as long as they are registered in
+        :data:`amfiprot.payload_registry`. See :meth:`amfiprot.Node.get_packet`. """
+        return self.node.get_packet(blocking, timeout_ms)
 
-    def _await_packet(self, payload_class, timeout_ms=1000):
-        packet = None
-        timer = MilliTimer(timeout_ms, autostart=True)
+    def get_packets(self, max_packets: int = GET_PACKETS_MAX, timeout_ms: Optional[int] = 0) -> List[Packet]:
+        """ Up to ``max_packets`` received packets at once, see :meth:`amfiprot.Node.get_packets`. """
+        return self.node.get_packets(max_packets, timeout_ms)
 
-        while packet is None or type(packet.payload) != payload_class:
-            packet = self.get_packet()
+    # The following wait for a packet without correlating it with a request, see Node.request() instead
 
-            if timer.expired():
-                raise TimeoutError("Packet not returned.")
+    def _await_packet(self, payload_class, timeout_ms=1000):
+        matches = lambda packet: type(packet.payload) == payload_class
 
-        return packet
+        if not is_control_payload_type(getattr(payload_class, 'PAYLOAD_TYPE', None)):
+            # Application payloads are delivered with the data, unless sent as replies
+            return self._await_any(matches, timeout_ms, "Packet not returned.")
+
+        return self._await_control(matches, timeout_ms, "Packet not returned.")
 
     def _await_ack(self, timeout_ms=1000):
-        packet = None
-        timer = MilliTimer(timeout_ms, autostart=True)
+        self._await_control(lambda packet: packet.packet_type == PacketType.ACK, timeout_ms,
+                            "Timed out waiting for Ack.")
 
-        while packet is None or packet.packet_type != PacketType.ACK:
-            packet = self.get_packet()
+    def _await_reply(self, payload_type: PayloadType, timeout_ms: int = 1000):
+        self._await_control(lambda packet: packet.payload_type == payload_type, timeout_ms, "Packet not returned.")
 
-            if timer.expired():
-                raise TimeoutError("Timed out waiting for Ack.")
+    def _await_control(self, matches, timeout_ms: int, message: str) -> Packet:
+        """ Wait for a packet on the node's control lane for which ``matches(packet)`` is true. Other control packets
+        are discarded, the data lane is left alone. """
+        deadline = time.monotonic() + timeout_ms / 1000
 
-        return
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(message)
 
-    def _await_reply(self, payload_type: PayloadType, timeout_ms: int = 1000):
+            packet = self.node.get_control_packet(timeout_ms=remaining * 1000)
+
+            if packet is not None and matches(packet):
+                return packet
+
+    def _await_any(self, matches, timeout_ms: int, message: str) -> Packet:
+        """ Wait for a matching packet from either lane, discarding the others. """
         packet = None
         timer = MilliTimer(timeout_ms, autostart=True)
 
-        while packet is None or packet.payload_type != payload_type:
+        while packet is None or not matches(packet):
             packet = self.get_packet()
 
             if timer.expired():
-                raise TimeoutError("Packet not returned.")
+                raise TimeoutError(message)
 
-        return
+        return packet
 
 
 class MilliTimer:
@@ -1,36 +1,183 @@
 from __future__ import annotations
 import multiprocessing as mp
+import concurrent.futures
+import io
+import queue
+import threading
 import time
 import typing
-from .packet import Packet, PacketType
+from .correlation import Correlator, ReplySpec, REQUEST_TIMEOUT_MS
+from .packet import Packet, PacketType, PacketTemplate, packet_from_frame
 from .payload import Payload
+from .receive_queue import QueuePolicy, get_many
 
 if typing.TYPE_CHECKING:
     from .connection import Connection
 
+TEMPLATE_CACHE_SIZE = 256
+CONTROL_QUEUE_CAPACITY = 256  # Packets, the capacity of a node's control lane
+LANE_POLL_INTERVAL = 0.01  # Seconds, how often a blocking get_packet() checks the lanes if they have no notifier
+GET_PACKETS_MAX = 256  # Default number of packets get_packets() returns at most
+
 
 class Node:
     """ A `Node` represents a single endpoint on a `Connection`. One `Connection` can
     have multiple nodes, e.g. if the PC connects via USB to a device which in turn is connected
-    to additional devices via RF. """
+    to additional devices via RF.
+
+    Received packets are delivered to two queues: acks, replies and status packets to the control lane
+    (:attr:`control_queue`, see :func:`amfiprot.packet.is_control_frame`), everything else (e.g. sensor data) to
+    :attr:`receive_queue`. Requests made with :meth:`request` (as by :class:`amfiprot.Device`) are answered from the
+    control lane only, so their replies do not queue behind streamed data, and do not consume it. """
     def __init__(self, tx_id, uuid, connection: Connection):
         self.connection = connection
         self.tx_id = tx_id
         self.uuid = uuid
-        self.receive_queue: mp.Queue = mp.Queue()
+        self.receive_queue: mp.Queue = connection.create_receive_queue()
+        self.control_queue: mp.Queue = connection.create_receive_queue(capacity=CONTROL_QUEUE_CAPACITY,
+                                                                       policy=QueuePolicy.DROP_OLDEST)
+        self.correlator = Correlator(self.control_queue, getattr(self.receive_queue, 'notifier', None))
         self.packet_number = 0
         self.name = None
+        self._templates: typing.Dict[tuple, typing.Tuple[PacketTemplate, Payload]] = {}
+        self._send_lock = threading.RLock()  # Keeps packet numbers unique, and requests registered in sending order
 
     def packet_available(self) -> bool:
-        return not self.receive_queue.empty()  # Do not use qsize() as it is unreliable, and not supported on Mac
+        # Do not use qsize() as it is unreliable, and not supported on Mac
+        return self.correlator.available() or not self.receive_queue.empty()
+
+    def get_packet(self, blocking=False, timeout_ms: typing.Optional[int] = 1000) -> typing.Optional[Packet]:
+        """ The next packet from either lane, control packets first. If ``blocking``, waits up to ``timeout_ms`` (or
+        indefinitely if None) for one. Returns None if there was none.
+
+        While waiting, the node's notifier (see :meth:`fileno`) is cleared, and then waited on. Lanes without notifiers
+        are checked every :data:`LANE_POLL_INTERVAL`. """
+        packet = self._take_packet()
+        if packet is not None or not blocking:
+            return packet
+
+        deadline = None if timeout_ms is None else time.monotonic() + timeout_ms / 1000
+        notifier = getattr(self.receive_queue, 'notifier', None)
+
+        if notifier is None:
+            return self._poll_lanes(deadline)
+
+        while True:
+            notifier.clear()  # Before checking the lanes, so that a packet delivered from now on signals it again
+            packet = self._take_packet()
+
+            if packet is not None:
+                if self.packet_available():
+                    notifier.notify()  # Packets left, so that fileno() stays readable as after drain()
+                return packet
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
 
-    def get_packet(self, blocking=False, timeout_ms=1000) -> typing.Optional[Packet]:
-        if self.receive_queue.empty() and not blocking:
+            notifier.wait(remaining)
+
+    def _take_packet(self) -> typing.Optional[Packet]:
+        """ The next packet from either lane, control packets first, without waiting. """
+        packet = self.get_control_packet()
+        if packet is not None:
+            return packet
+
+        try:
+            return packet_from_frame(self.receive_queue.get_nowait())
+        except queue.Empty:
             return None
 
-        # TODO: Implement timeout
+    def _poll_lanes(self, deadline: typing.Optional[float]) -> typing.Optional[Packet]:
+        """ Wait for a packet on queues without notifiers: on the data lane, checking the control lane in between. """
+        while True:
+            wait = LANE_POLL_INTERVAL if deadline is None else min(LANE_POLL_INTERVAL, deadline - time.monotonic())
+
+            try:
+                return packet_from_frame(self.receive_queue.get(timeout=max(wait, 0)))
+            except queue.Empty:
+                packet = self.get_control_packet()
+                if packet is not None or (deadline is not None and time.monotonic() >= deadline):
+                    return packet
+
+    def get_packets(self, max_packets: int = GET_PACKETS_MAX,
+                    timeout_ms: typing.Optional[int] = 0) -> typing.List[Packet]:
+        """ Up to ``max_packets`` packets from either lane, control packets first. Waits up to ``timeout_ms`` (or
+        indefinitely if None) for the first one, and then returns the others that are already queued. Returns an
+        empty list if there were none. """
+        packet = self.get_packet(blocking=timeout_ms != 0, timeout_ms=timeout_ms)
+        if packet is None:
+            return []
+
+        packets = [packet]
+
+        while len(packets) < max_packets:
+            packet = self.get_control_packet()
+            if packet is None:
+                break
+            packets.append(packet)
+
+        packets.extend(packet_from_frame(frame) for frame in get_many(self.receive_queue, max_packets - len(packets)))
+        return packets
+
+    def fileno(self) -> int:
+        """ A descriptor that becomes readable when packets are received, so that many nodes can be waited on with
+        ``select``, ``selectors`` or an event loop. It is edge-triggered: it stays readable until :meth:`drain` is
+        called, and only becomes readable again for packets received after that. Raises ``io.UnsupportedOperation`` if
+        the connection's queues do not signal it. """
+        notifier = getattr(self.receive_queue, 'notifier', None)
+        if notifier is None:
+            raise io.UnsupportedOperation(f"The receive queues of {type(self.connection).__name__} have no descriptor")
+
+        return notifier.fileno()
 
-        return self.receive_queue.get()
+    def drain(self, max_packets: int = GET_PACKETS_MAX) -> typing.List[Packet]:
+        """ Clear :meth:`fileno` and return the packets already received, up to ``max_packets``. If packets are left
+        (or still on their way through a queue), the descriptor is signalled again, so that they are not missed. """
+        notifier = getattr(self.receive_queue, 'notifier', None)
+        if notifier is None:
+            return self.get_packets(max_packets)
+
+        notifier.clear()
+        packets = self.get_packets(max_packets)
+
+        if len(packets) == max_packets or self.packet_available():
+            notifier.notify()
+
+        return packets
+
+    def get_control_packet(self, timeout_ms: int = 0) -> typing.Optional[Packet]:
+        """ The next packet from the control lane that does not answer a :meth:`request`, waiting up to ``timeout_ms``
+        for one. Returns None if there was none. """
+        return self.correlator.get(timeout_ms)
+
+    def request(self,
+                payload: Payload,
+                packet_type: PacketType = PacketType.NO_ACK,
+                spec: typing.Optional[ReplySpec] = None,
+                timeout_ms: typing.Optional[int] = REQUEST_TIMEOUT_MS) -> concurrent.futures.Future:
+        """ Send a request, returning a future that gets its reply packet (or a ``TimeoutError``). How the reply is
+        recognized is given by ``spec``, or else looked up in :data:`amfiprot.correlation.REPLY_SPECS`. Requests sent
+        with ``PacketType.REQUEST_ACK`` and without a known reply are answered by their ack. """
+        with self._send_lock:
+            future = self.correlator.expect(payload, self.packet_number, packet_type, spec, timeout_ms)
+            self.send_payload(payload, packet_type=packet_type)
+
+        return future
+
+    def request_prepared(self,
+                         payload_class: typing.Type[Payload],
+                         *args,
+                         packet_type: PacketType = PacketType.NO_ACK,
+                         spec: typing.Optional[ReplySpec] = None,
+                         timeout_ms: typing.Optional[int] = REQUEST_TIMEOUT_MS) -> concurrent.futures.Future:
+        """ :meth:`request` with a cached template, see :meth:`send_prepared`. """
+        with self._send_lock:
+            template, payload = self._prepared(payload_class, args, 0, packet_type)
+            future = self.correlator.expect(payload, self.packet_number, packet_type, spec, timeout_ms)
+            self.send_template(template)
+
+        return future
 
     def send_packet(self, packet: Packet):
         """ Send a pre-assembled packet. Note that this does not increment the packet number! """
@@ -40,18 +187,65 @@ class Node:
                      payload: Payload,
                      source_id: int = 0,
                      packet_type: PacketType = PacketType.NO_ACK):
-        packet = Packet.from_payload(payload,
-                                     destination_id=self.tx_id,
-                                     source_id=source_id,
-                                     packet_type=packet_type,
-                                     packet_number=self.packet_number)
-        self.send_packet(packet)
+        with self._send_lock:
+            packet = Packet.from_payload(payload,
+                                         destination_id=self.tx_id,
+                                         source_id=source_id,
+                                         packet_type=packet_type,
+                                         packet_number=self.packet_number)
+            self.send_packet(packet)
+
+            self.packet_number = (self.packet_number + 1) % 255
 
-        self.packet_number = (self.packet_number + 1) % 255
+    def prepare_payload(self,
+                        payload: Payload,
+                        source_id: int = 0,
+                        packet_type: PacketType = PacketType.NO_ACK) -> PacketTemplate:
+        """ Pre-encode a payload addressed to this node, to be sent (repeatedly) with :meth:`send_template`. """
+        return PacketTemplate(payload, destination_id=self.tx_id, source_id=source_id, packet_type=packet_type)
+
+    def send_template(self, template: PacketTemplate):
+        """ Send a packet created from a pre-encoded template, using (and incrementing) the packet number. """
+        with self._send_lock:
+            self.send_packet(template.packet(self.packet_number))
+
+            self.packet_number = (self.packet_number + 1) % 255
+
+    def send_prepared(self,
+                      payload_class: typing.Type[Payload],
+                      *args,
+                      source_id: int = 0,
+                      packet_type: PacketType = PacketType.NO_ACK):
+        """ Send ``payload_class(*args)``, reusing a template cached per payload class and (hashable) arguments.
+        Intended for requests that are sent repeatedly with the same arguments, e.g. when polling. """
+        template, _ = self._prepared(payload_class, args, source_id, packet_type)
+        self.send_template(template)
+
+    def _prepared(self, payload_class: typing.Type[Payload], args: tuple, source_id: int,
+                  packet_type: PacketType) -> typing.Tuple[PacketTemplate, Payload]:
+        """ The cached template for ``payload_class(*args)``, and the payload it was created from. """
+        key = (payload_class, args, self.tx_id, source_id, packet_type)
+        prepared = self._templates.get(key)
+
+        if prepared is None:
+            if len(self._templates) >= TEMPLATE_CACHE_SIZE:
+                self._templates.clear()
+
+            payload = payload_class(*args)
+            prepared = (self.prepare_payload(payload, source_id=source_id, packet_type=packet_type), payload)
+            self._templates[key] = prepared
+
+        return prepared
 
     def flush_receive_queue(self):
         while not self.receive_queue.empty():
-            self.receive_queue.get_nowait()
+            try:
+                self.receive_queue.get_nowait()
+            except queue.Empty:  # Evicted by the reader meanwhile
+                break
+
+        while self.get_control_packet() is not None:
+            pass
 
     def max_payload_size(self):
         return self.connection.max_payload_size()
@@ -3,10 +3,11 @@ Packet module docstring
 """
 import array
 import enum
-import crcmod
-from .payload import Payload, PayloadType, UndefinedPayload
-from .common_payload import create_common_payload
-from .response_payload import *
+import struct
+import typing
+from .payload import Payload, PayloadType
+from .registry import payload_registry
+from .crc import crc8, crc8_range
 
 
 class PacketType(enum.IntEnum):
@@ -21,7 +22,28 @@ class PacketDestination(enum.IntEnum):
     BROADCAST = 255
 
 
+class CrcValidation(enum.IntEnum):
+    """ How received frames are validated by a connection before they are passed on. """
+    OFF = 0
+    HEADER = 1
+    """ Check the frame length and the header CRC only. """
+    FULL = 2
+    """ Check the frame length, the header CRC and the payload CRC. """
+
+
+class FrameError(enum.IntEnum):
+    NONE = 0
+    MALFORMED = 1
+    """ Frame too short for the header, or for the payload length given in the header. """
+    HEADER_CRC = 2
+    PAYLOAD_CRC = 3
+
+
 class Header:
+    """ Decoded packet header. The six header fields are read from the packet buffer in a single unpack, and no
+    copy of the buffer is kept. """
+    __slots__ = ('payload_length', 'packet_type', 'packet_number', 'payload_type', 'source_tx_id', 'destination_tx_id')
+
     class HeaderIndex(enum.IntEnum):
         PAYLOAD_LENGTH = 0
         """
@@ -45,65 +67,92 @@ class Header:
 
     @classmethod
     def length(cls):
-        return len(cls.HeaderIndex)
+        return HEADER_LENGTH
 
-    def __init__(self, data):
-        self.data = data
-        self.payload_length = data[self.HeaderIndex.PAYLOAD_LENGTH]
-        self.packet_type = data[self.HeaderIndex.PACKET_TYPE]
-        self.packet_number = data[self.HeaderIndex.PACKET_NUMBER]
-        self.payload_type = data[self.HeaderIndex.PAYLOAD_TYPE]
-        self.source_tx_id = data[self.HeaderIndex.SOURCE_TX_ID]
-        self.destination_tx_id = data[self.HeaderIndex.DESTINATION_TX_ID]
+    def __init__(self, data, offset: int = 0):
+        (self.payload_length,
+         self.packet_type,
+         self.packet_number,
+         self.payload_type,
+         self.source_tx_id,
+         self.destination_tx_id) = _HEADER_STRUCT.unpack_from(data, offset)
 
     def __len__(self):
-        return self.length()
+        return HEADER_LENGTH
 
     def __str__(self):
         return f"<Header> src: {self.source_tx_id}, dest: {self.destination_tx_id}, payload_type: {self.payload_type}, packet_number: {self.packet_number}"
 
     def to_bytes(self):
-        return array.array('B', self.data)
+        return array.array('B', _HEADER_STRUCT.pack(self.payload_length,
+                                                     self.packet_type,
+                                                     self.packet_number,
+                                                     self.payload_type,
+                                                     self.source_tx_id,
+                                                     self.destination_tx_id))
+
+
+HEADER_LENGTH = len(Header.HeaderIndex)
+_HEADER_STRUCT = struct.Struct(f'{HEADER_LENGTH}B')
 
 
 class Packet:
-    def __init__(self, byte_data: array.array):  # Using array.array('B') since it's faster than bytearray()
-        self.data: array.array = byte_data
-        self.header = Header(self.data[:Header.length()])
+    """ A single Amfiprot packet backed by one byte buffer.
 
-        if self.header.payload_length == 0:
-            self.payload = None
-        else:
-            payload_start_index = Header.length() + 1  # CRC
-            payload_end_index = payload_start_index + self.header.payload_length
-            payload_data = self.data[payload_start_index:payload_end_index]
+    ``byte_data`` can be an ``array.array('B')``, ``bytes``, ``bytearray`` or ``memoryview``, and ``offset`` gives the
+    position of the header within it (e.g. 2 for a raw USB HID report), so received data never has to be sliced before
+    it is decoded. Packets that are passed between processes must be backed by an array or bytes object, since
+    memoryviews cannot be pickled. The payload is decoded lazily (see :attr:`Packet.payload`); a packet that has not
+    been decoded yet is pickled as its raw bytes only.
 
-            # Create payload object that corresponds to payload_type
-            self.payload = create_payload_from_type(payload_data, self.header.payload_type)
+    ``timestamp`` is the time the packet was received (as returned by ``time.time()``), if the connection was asked
+    to record it.
+    """
+    __slots__ = ('data', 'offset', 'header', 'timestamp', '_payload')
+
+    def __init__(self, byte_data, offset: int = 0, timestamp: typing.Optional[float] = None):  # Using array.array('B') since it's faster than bytearray()
+        self.data = byte_data
+        self.offset = offset
+        self.header = Header(byte_data, offset)
+        self.timestamp = timestamp
 
     @classmethod
     def from_payload(cls, payload, destination_id=PacketDestination.BROADCAST, source_id=0, packet_type=PacketType.NO_ACK, packet_number: int = 0):
-        data = array.array('B', [len(payload),
-                                 packet_type,
-                                 packet_number,
-                                 payload.type,
-                                 source_id,
-                                 destination_id])
-
-        # Append header CRC (not including report_id and packet_length)
-        header_crc = calculate_crc(data[:])
-        data.append(header_crc)
-
-        # Append payload and CRC
-        payload_data = payload.to_bytes()
-        payload_crc = calculate_crc(payload_data)
-        data.extend(payload_data)
-        data.append(payload_crc)
-
+        data = array.array('B', bytes(HEADER_LENGTH + len(payload) + 2))  # Header CRC and payload CRC
+        encode_packet_into(data, 0, payload, destination_id, source_id, packet_type, packet_number)
         return Packet(data)
 
     def __len__(self):
-        return len(self.data)
+        return len(self.data) - self.offset
+
+    @property
+    def payload(self) -> typing.Optional[Payload]:
+        """ The decoded payload. Decoding is deferred until the first access and the result is cached, so packets
+        that are filtered on header fields alone never pay for it. The payload class is looked up in
+        :data:`amfiprot.registry.payload_registry`. """
+        try:
+            return self._payload
+        except AttributeError:
+            pass
+
+        if self.header.payload_length == 0:
+            payload = None
+        else:
+            payload = payload_registry.create(self.header.payload_type, self.payload_bytes)
+
+        self._payload = payload
+        return payload
+
+    @payload.setter
+    def payload(self, payload: typing.Optional[Payload]):
+        self._payload = payload
+
+    @property
+    def payload_bytes(self) -> memoryview:
+        """ The raw payload bytes (without CRC), as a view into the packet buffer. Nothing is decoded or copied, so
+        this is the cheapest way to handle payload types that are not registered. """
+        payload_start_index = self.offset + HEADER_LENGTH + 1  # CRC
+        return memoryview(self.data)[payload_start_index:payload_start_index + self.header.payload_length]
 
     @property
     def packet_type(self):
@@ -131,14 +180,14 @@ class Packet:
 
     @property
     def header_crc(self):
-        return self.data[Header.length()]
+        return self.data[self.offset + HEADER_LENGTH]
 
     @property
     def payload_crc(self):
         if self.header.payload_length == 0:
             return 0
 
-        return self.data[len(self.header) + 1 + self.header.payload_length]
+        return self.data[self.offset + HEADER_LENGTH + 1 + self.header.payload_length]
 
     @destination_id.setter
     def destination_id(self, identifier):
@@ -151,40 +200,137 @@ class Packet:
         """
         Convert packet to an array of bytes (array.array('B')) for transmission
         """
-        return self.data
+        if self.offset == 0:
+            return self.data
+
+        return self.data[self.offset:]
+
+    def encode_into(self, buffer, offset: int = 0) -> int:
+        """ Write the packet bytes into ``buffer`` (e.g. a preallocated report buffer) at ``offset``. Returns the
+        number of bytes written. """
+        length = len(self)
+        memoryview(buffer)[offset:offset + length] = memoryview(self.data)[self.offset:self.offset + length]
+        return length
 
     def crc_is_good(self) -> bool:
-        new_header_crc = calculate_crc(self.header.to_bytes())
-        header_crc_is_good = (self.header_crc == new_header_crc)
+        """ Checks both CRCs against the bytes the packet was created from (the payload is not re-encoded). """
+        return check_frame(self.data, self.offset, CrcValidation.FULL) == FrameError.NONE
 
-        if not header_crc_is_good:
-            return False
 
-        if self.header.payload_length == 0:
-            return True
-        else:
-            # print(f"Checking crc for {self.payload}")
-            new_payload_crc = calculate_crc(self.payload.to_bytes())
-            return self.payload_crc == new_payload_crc
+class PacketTemplate:
+    """ A pre-encoded packet, for payloads that are sent repeatedly. The payload, the payload CRC and all header fields
+    except the packet number are encoded once, so creating a packet from the template only copies the bytes and
+    patches the packet number and header CRC. """
+    __slots__ = ('data', 'header_crc')
+
+    def __init__(self, payload: Payload, destination_id=PacketDestination.BROADCAST, source_id=0, packet_type=PacketType.NO_ACK):
+        self.data = Packet.from_payload(payload, destination_id, source_id, packet_type, packet_number=0).data
+        self.header_crc = self.data[HEADER_LENGTH]  # Header CRC with packet number 0
+
+    def packet(self, packet_number: int = 0) -> Packet:
+        data = self.data[:]
+        data[Header.HeaderIndex.PACKET_NUMBER] = packet_number
+        # The CRC is linear, so the header CRC is patched with the contribution of the packet number alone
+        data[HEADER_LENGTH] = self.header_crc ^ _PACKET_NUMBER_CRC[packet_number]
+        return Packet(data)
+
+    def encode_into(self, buffer, offset: int = 0, packet_number: int = 0) -> int:
+        """ Write a packet with the given packet number into ``buffer`` at ``offset``. Returns the number of bytes written. """
+        length = len(self.data)
+        memoryview(buffer)[offset:offset + length] = memoryview(self.data)
+        buffer[offset + Header.HeaderIndex.PACKET_NUMBER] = packet_number
+        buffer[offset + HEADER_LENGTH] = self.header_crc ^ _PACKET_NUMBER_CRC[packet_number]
+        return length
+
+    def __len__(self):
+        return len(self.data)
+
+
+def encode_packet_into(buffer, offset: int, payload: Payload, destination_id=PacketDestination.BROADCAST, source_id=0,
+                       packet_type=PacketType.NO_ACK, packet_number: int = 0) -> int:
+    """ Encode a complete packet (header, header CRC, payload and payload CRC) directly into ``buffer`` at ``offset``,
+    without any intermediate copies. Returns the number of bytes written. """
+    _HEADER_STRUCT.pack_into(buffer, offset, len(payload), packet_type, packet_number, payload.type, source_id, destination_id)
+
+    header_crc_index = offset + HEADER_LENGTH
+    buffer[header_crc_index] = crc8_range(buffer, offset, header_crc_index)
+
+    payload_start_index = header_crc_index + 1
+    payload_end_index = payload_start_index + payload.encode_into(buffer, payload_start_index)
+    buffer[payload_end_index] = crc8_range(buffer, payload_start_index, payload_end_index)
+
+    return payload_end_index + 1 - offset
+
+
+def packet_from_frame(frame) -> Packet:
+    """ Create a packet from an item forwarded by a connection's I/O worker: either the raw packet bytes, or a
+    ``(timestamp, bytes)`` tuple. """
+    if type(frame) is tuple:
+        return Packet(frame[1], 0, frame[0])
+
+    return Packet(frame)
+
+
+def frame_length(data, offset: int = 0) -> int:
+    """ Length of the packet starting at ``offset`` in ``data``, according to its header (not including anything
+    after it, such as the padding of a USB report). """
+    return HEADER_LENGTH + 2 + data[offset]  # Header CRC and payload CRC
+
+
+def check_frame(data, offset: int = 0, validation: CrcValidation = CrcValidation.FULL) -> FrameError:
+    """ Validate a raw received frame, with the header starting at ``offset``, without creating a :class:`Packet`. """
+    if validation == CrcValidation.OFF:
+        return FrameError.NONE
+
+    header_crc_index = offset + HEADER_LENGTH
+    if len(data) <= header_crc_index:
+        return FrameError.MALFORMED
+
+    if crc8_range(data, offset, header_crc_index) != data[header_crc_index]:
+        return FrameError.HEADER_CRC
+
+    payload_length = data[offset]
+    if payload_length == 0 or validation == CrcValidation.HEADER:
+        return FrameError.NONE
+
+    payload_start_index = header_crc_index + 1
+    payload_end_index = payload_start_index + payload_length
+    if len(data) <= payload_end_index:
+        return FrameError.MALFORMED
+
+    if crc8_range(data, payload_start_index, payload_end_index) != data[payload_end_index]:
+        return FrameError.PAYLOAD_CRC
+
+    return FrameError.NONE
+
+
+# Payload types that are routed to a node's control lane, regardless of packet type (see is_control_frame)
+_CONTROL_PAYLOAD_TYPES = frozenset(int(payload_type) for payload_type in (
+    PayloadType.COMMON, PayloadType.SUCCESS, PayloadType.NOT_IMPLEMENTED, PayloadType.FAILURE,
+    PayloadType.INVALID_REQUEST))
+_PACKET_TYPE_INDEX = int(Header.HeaderIndex.PACKET_TYPE)
+_PAYLOAD_TYPE_INDEX = int(Header.HeaderIndex.PAYLOAD_TYPE)
+
+
+def is_control_payload_type(payload_type: int) -> bool:
+    """ Whether packets with ``payload_type`` are control packets, whatever their packet type. """
+    return payload_type in _CONTROL_PAYLOAD_TYPES
+
+
+def is_control_frame(data, offset: int = 0) -> bool:
+    """ Whether the packet starting at ``offset`` in ``data`` is a control packet: an ack or reply, a common payload
+    (device ID, name, configuration, ...) or a status payload. Everything else, e.g. sensor data, is data. Used by the
+    readers to deliver control packets to a node's control lane, so they do not queue behind streamed data. """
+    return (data[offset + _PACKET_TYPE_INDEX] >= PacketType.ACK
+            or data[offset + _PAYLOAD_TYPE_INDEX] in _CONTROL_PAYLOAD_TYPES)
 
 
-amfiprot_payload_mappings = {
-        PayloadType.COMMON: create_common_payload,  # type: ignore
-        PayloadType.SUCCESS: SuccessPayload,
-        PayloadType.NOT_IMPLEMENTED: NotImplementedPayload,
-        PayloadType.FAILURE: FailurePayload,
-        PayloadType.INVALID_REQUEST: InvalidRequestPayload
-    }
+_PACKET_NUMBER_CRC = tuple(crc8(bytes([0, 0, packet_number, 0, 0, 0])) for packet_number in range(256))
 
 
-def create_payload_from_type(payload_data: array.array, payload_type: PayloadType):
-    if payload_type in amfiprot_payload_mappings:
-        return amfiprot_payload_mappings[payload_type](payload_data)  # type: ignore
-    else:
-        return UndefinedPayload(payload_data, payload_type)
+def create_payload_from_type(payload_data, payload_type: PayloadType):
+    return payload_registry.create(payload_type, payload_data)
 
 
 def calculate_crc(data):
-    crc8 = crcmod.Crc(0x12F, initCrc=0, rev=False)
-    crc8.update(data[:])
-    return crc8.crcValue
+    return crc8(data)
@@ -31,6 +31,21 @@ class Payload(metaclass=ABCMeta):
     def to_bytes(self) -> array.array:
         """ Returns the payload as an array of raw bytes (without CRC) """
         pass
+
+    def encode_into(self, buffer, offset: int = 0) -> int:
+        """ Writes the payload (without CRC) into ``buffer`` at ``offset`` and returns the number of bytes written.
+        The default implementation copies the result of :meth:`to_bytes`; payloads that can write themselves
+        directly should override it. """
+        data = self.to_bytes()
+        length = len(data)
+
+        try:
+            view = memoryview(data)
+        except TypeError:  # E.g. a list of ints
+            view = memoryview(bytes(data))
+
+        memoryview(buffer)[offset:offset + length] = view
+        return length
     
     @abstractmethod
     def to_dict(self) -> dict:
@@ -62,6 +77,11 @@ class UndefinedPayload(Payload):
     def to_bytes(self):
         return array.array('B', self.data)
 
+    def encode_into(self, buffer, offset: int = 0) -> int:
+        length = len(self.data)
+        memoryview(buffer)[offset:offset + length] = memoryview(self.data)
+        return length
+
     def to_dict(self):
         data_dict = {
             'data': self.data
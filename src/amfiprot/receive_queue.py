@@ -0,0 +1,387 @@
+"""
+Bounded receive queues with a policy for frames that do not fit.
+
+A :class:`ReceiveQueue` wraps the queue that a connection's reader delivers frames to (a ``multiprocessing.Queue``, a
+``queue.Queue`` or a :class:`amfiprot.ring.SharedMemoryRing`) and bounds it by number of frames and/or bytes. When a
+frame does not fit, the reader applies the queue's :class:`QueuePolicy` and counts the frames it drops, instead of
+printing a message per frame.
+
+Occupancy is tracked with counters in shared memory, each written by one side only: frames put and evicted by the
+reader, frames taken by the consumer. Policy and capacities live in the same block, so they can be changed from the
+main process while the reader runs. The counters are also what :meth:`ReceiveQueue.empty` reports, and a frame that
+was counted is taken by :meth:`ReceiveQueue.get_nowait` even if it is still on its way through a
+``multiprocessing.Queue``'s pipe, so a consumer that was signalled for a frame does not miss it.
+
+A queue can be given a :class:`Notifier`, a socket that the reader makes readable when it delivers frames, so that
+event loops can wait for packets instead of polling.
+"""
+import enum
+import multiprocessing as mp
+import queue
+import select
+import socket
+import time
+from typing import Callable, List, Optional
+
+DEFAULT_CAPACITY = 4096  # Frames, the default capacity of the receive queues created by the connections
+BLOCK_TIMEOUT = 0.5  # Seconds the reader waits for room in a queue with QueuePolicy.BLOCK before dropping the frame
+_BLOCK_POLL_INTERVAL = 0.0005  # Seconds
+ARRIVAL_TIMEOUT = 0.1  # Seconds to wait for a frame that was put, but is still on its way through a pipe
+
+# Indices in the shared state
+_POLICY, _CAPACITY, _CAPACITY_BYTES = 0, 1, 2  # Written by the main process
+_PUT, _PUT_BYTES, _EVICTED, _EVICTED_BYTES, _DROPPED = 3, 4, 5, 6, 7  # Written by the reader
+_TAKEN, _TAKEN_BYTES = 8, 9  # Written by the consumer
+_STATE_LENGTH = 10
+
+
+class QueuePolicy(enum.IntEnum):
+    """ What the reader does with a frame that does not fit in a full :class:`ReceiveQueue`. """
+    DROP_OLDEST = 0
+    """ Discard the oldest queued frames to make room. If none can be taken (rings cannot be evicted from, and a
+    ``multiprocessing.Queue`` only once the frames have reached its pipe), the new frame is discarded instead. """
+    DROP_NEWEST = 1
+    """ Discard the new frame. """
+    BLOCK = 2
+    """ Wait up to :data:`BLOCK_TIMEOUT` for the consumer to make room, then discard the new frame. Delivery to every
+    other queue of the connection waits as well. """
+    CONFLATE = 3
+    """ Keep only the newest frame, e.g. for a consumer that only needs the latest measurement. Rings keep their
+    frames, and drop new frames when full. """
+
+
+class Notifier:
+    """ A socket that becomes readable when frames are delivered to the receive queues it is given to. It is
+    edge-triggered: the reader writes a byte only if the notifier is not signalled already, and the consumer calls
+    :meth:`clear` before taking the queued frames, after which the next delivery signals it again. A ``parent`` (e.g.
+    the notifier of a connection) is signalled along with it.
+
+    Like a :class:`ReceiveQueue`, it can be passed to a reader process when the process is started. """
+    def __init__(self, parent: Optional['Notifier'] = None):
+        self.parent = parent
+        self._receiver, self._sender = socket.socketpair()
+        self._receiver.setblocking(False)
+        self._signalled = mp.RawValue('b', 0)
+
+    def fileno(self) -> int:
+        """ The descriptor to wait on for reading (with select, selectors, or an event loop). """
+        return self._receiver.fileno()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """ Wait up to ``timeout`` seconds (indefinitely if None) for the notifier to be signalled. Returns False if it
+        was not. """
+        readable, _, _ = select.select([self._receiver], [], [], None if timeout is None else max(0.0, timeout))
+        return len(readable) > 0
+
+    def notify(self):
+        """ Signal the notifier, as the reader does after delivering a frame. """
+        if not self._signalled.value:
+            self._signalled.value = 1
+            self._sender.send(b'\0')
+
+        if self.parent is not None:
+            self.parent.notify()
+
+    def clear(self):
+        """ Called by the consumer before taking frames, so that frames delivered from now on signal again. """
+        try:
+            while len(self._receiver.recv(4096)) > 0:
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        self._signalled.value = 0  # After reading, so that a byte sent for a later frame is not read here
+
+    def close(self):
+        self._receiver.close()
+        self._sender.close()
+
+
+class ReceiveQueue:
+    """ A bounded queue of received frames, with the interface of ``multiprocessing.Queue`` that the connections and
+    :class:`amfiprot.Node` use (``get``, ``get_nowait``, ``put_nowait``, ``empty``, ``full`` and ``qsize``), plus
+    :meth:`offer` for the reader and :meth:`get_many` for batches.
+
+    ``capacity`` is in frames and ``capacity_bytes`` in frame bytes (not counting timestamps). 0 means no limit. Set
+    ``evictable`` to False if frames cannot be taken from ``queue`` by the reader while the consumer reads it (rings).
+    The ``notifier`` (if given) is signalled whenever a frame is put. """
+
+    def __init__(self, queue, capacity: int = 0, capacity_bytes: int = 0,
+                 policy: QueuePolicy = QueuePolicy.DROP_OLDEST, evictable: bool = True,
+                 notifier: Optional[Notifier] = None):
+        self.queue = queue
+        self.evictable = evictable
+        self.notifier = notifier
+        self._state = mp.RawArray('q', _STATE_LENGTH)
+        self._state[_POLICY] = policy
+        self._state[_CAPACITY] = capacity
+        self._state[_CAPACITY_BYTES] = capacity_bytes
+        self._init_watermarks()
+
+    def __getstate__(self):
+        return {'queue': self.queue, 'evictable': self.evictable, 'state': self._state, 'notifier': self.notifier}
+
+    def __setstate__(self, state):
+        self.queue = state['queue']
+        self.evictable = state['evictable']
+        self._state = state['state']
+        self.notifier = state['notifier']
+        self._init_watermarks()  # Callbacks only run in the process that set them
+
+    def _init_watermarks(self):
+        self._high_watermark: Optional[int] = None
+        self._low_watermark = 0
+        self._on_high: Optional[Callable[['ReceiveQueue'], None]] = None
+        self._on_low: Optional[Callable[['ReceiveQueue'], None]] = None
+        self._above_high = False
+
+    @property
+    def policy(self) -> QueuePolicy:
+        return QueuePolicy(self._state[_POLICY])
+
+    @policy.setter
+    def policy(self, policy: QueuePolicy):
+        self._state[_POLICY] = policy
+
+    @property
+    def capacity(self) -> int:
+        return self._state[_CAPACITY]
+
+    @capacity.setter
+    def capacity(self, capacity: int):
+        self._state[_CAPACITY] = capacity
+
+    @property
+    def capacity_bytes(self) -> int:
+        return self._state[_CAPACITY_BYTES]
+
+    @capacity_bytes.setter
+    def capacity_bytes(self, capacity_bytes: int):
+        self._state[_CAPACITY_BYTES] = capacity_bytes
+
+    @property
+    def dropped(self) -> int:
+        """ Number of frames discarded by the reader, new or evicted. """
+        return self._state[_DROPPED]
+
+    def set_watermarks(self, high: int, low: int, on_high: Callable[['ReceiveQueue'], None] = None,
+                       on_low: Callable[['ReceiveQueue'], None] = None):
+        """ Call ``on_high(queue)`` when at least ``high`` frames are queued, and then ``on_low(queue)`` once no more
+        than ``low`` are. The levels are checked by the consumer, in :meth:`get` and :meth:`empty`, so the callbacks
+        run in the consuming process. """
+        self._high_watermark = high
+        self._low_watermark = low
+        self._on_high = on_high
+        self._on_low = on_low
+        self._above_high = False
+
+    def qsize(self) -> int:
+        state = self._state
+        return max(0, state[_PUT] - state[_EVICTED] - state[_TAKEN])
+
+    def qsize_bytes(self) -> int:
+        state = self._state
+        return max(0, state[_PUT_BYTES] - state[_EVICTED_BYTES] - state[_TAKEN_BYTES])
+
+    def empty(self) -> bool:
+        """ Whether no frames are queued, by the counters, so unlike ``multiprocessing.Queue.empty()`` it is False for
+        frames still on their way through the pipe. """
+        self._check_watermarks()
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        return not self._has_room(0)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        """ Take the oldest frame. A queue with a notifier waits on it for frames to be put (clearing it), instead of
+        on the wrapped queue, which for a ring would poll. """
+        if block and self.notifier is not None:
+            frame = self._wait(timeout)
+        elif block:
+            frame = self.queue.get(True, timeout)
+        else:
+            frame = self._get_nowait()
+
+        state = self._state
+        state[_TAKEN] += 1
+        state[_TAKEN_BYTES] += frame_size(frame)
+
+        self._check_watermarks()
+        return frame
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def get_many(self, max_frames: int) -> list:
+        """ Returns up to ``max_frames`` frames that can be taken without waiting (possibly none), except for a frame
+        that was counted and is still on its way through a pipe, as with :meth:`get_nowait`. """
+        frames = get_many(self.queue, max_frames)
+
+        if len(frames) == 0 and max_frames > 0 and self.qsize() > 0:
+            try:
+                frames.append(self._get_nowait())
+            except queue.Empty:
+                pass
+
+        if len(frames) > 0:
+            state = self._state
+            state[_TAKEN] += len(frames)
+            state[_TAKEN_BYTES] += sum(frame_size(frame) for frame in frames)
+
+            self._check_watermarks()
+
+        return frames
+
+    def _get_nowait(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            if self.qsize() == 0:
+                raise
+
+        # Put, but still on its way through a multiprocessing.Queue's pipe
+        return self.queue.get(timeout=ARRIVAL_TIMEOUT)
+
+    def _wait(self, timeout: Optional[float]):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            self.notifier.clear()  # Before trying, so that a frame put from now on signals it again
+
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise queue.Empty
+
+            if self.qsize() > 0:  # Put, but still on its way through a multiprocessing.Queue's pipe
+                return self.queue.get(timeout=remaining)
+
+            self.notifier.wait(remaining)
+
+    def put_nowait(self, frame):
+        """ Put ``frame`` regardless of capacity and policy. """
+        self.queue.put_nowait(frame)
+        self._count_put(frame_size(frame))
+
+    def offer(self, frame) -> int:
+        """ Called by the reader to put ``frame`` according to the policy. Returns the number of frames dropped. """
+        size = frame_size(frame)
+        policy = self._state[_POLICY]
+        dropped = 0
+
+        if policy == QueuePolicy.CONFLATE and self.evictable:
+            while self.qsize() > 0 and self._evict():
+                dropped += 1
+
+        if not self._has_room(size):
+            if policy in (QueuePolicy.DROP_OLDEST, QueuePolicy.CONFLATE) and self.evictable:
+                while not self._has_room(size) and self._evict():
+                    dropped += 1
+
+                if not self._has_room(size):
+                    # Nothing left to evict, e.g. because the frames are still on their way to the pipe
+                    return dropped + self._drop()
+            elif policy == QueuePolicy.BLOCK:
+                deadline = time.monotonic() + BLOCK_TIMEOUT
+                while not self._has_room(size) and time.monotonic() < deadline:
+                    time.sleep(_BLOCK_POLL_INTERVAL)
+
+                if not self._has_room(size):
+                    return self._drop()
+            else:
+                return dropped + self._drop()
+
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:  # The wrapped queue's own limit
+            return dropped + self._drop()
+
+        self._count_put(size)
+        return dropped
+
+    def _has_room(self, size: int) -> bool:
+        state = self._state
+        capacity, capacity_bytes = state[_CAPACITY], state[_CAPACITY_BYTES]
+        return ((capacity <= 0 or self.qsize() < capacity)
+                and (capacity_bytes <= 0 or self.qsize_bytes() + size <= capacity_bytes))
+
+    def _evict(self) -> bool:
+        try:
+            frame = self.queue.get_nowait()
+        except queue.Empty:  # Taken by the consumer meanwhile (or, for a multiprocessing.Queue, locked by it)
+            return False
+
+        state = self._state
+        state[_EVICTED] += 1
+        state[_EVICTED_BYTES] += frame_size(frame)
+        state[_DROPPED] += 1
+        return True
+
+    def _drop(self) -> int:
+        self._state[_DROPPED] += 1
+        return 1
+
+    def _count_put(self, size: int):
+        state = self._state
+        state[_PUT] += 1
+        state[_PUT_BYTES] += size
+
+        if self.notifier is not None:
+            self.notifier.notify()
+
+    def _check_watermarks(self):
+        if self._high_watermark is None:
+            return
+
+        level = self.qsize()
+
+        if not self._above_high and level >= self._high_watermark:
+            self._above_high = True
+            if self._on_high is not None:
+                self._on_high(self)
+        elif self._above_high and level <= self._low_watermark:
+            self._above_high = False
+            if self._on_low is not None:
+                self._on_low(self)
+
+
+def frame_size(frame) -> int:
+    """ Number of packet bytes in a frame forwarded by a reader (0 for anything that is not a frame). """
+    if type(frame) is tuple:
+        frame = frame[1]
+
+    return 0 if frame is None else len(frame)
+
+
+def deliver(channel, frame) -> int:
+    """ Put a frame in a receive channel without blocking (unless its policy is ``QueuePolicy.BLOCK``). Returns the
+    number of frames dropped. Channels other than :class:`ReceiveQueue` drop the new frame when they are full. """
+    if isinstance(channel, ReceiveQueue):
+        return channel.offer(frame)
+
+    if channel.full():
+        return 1
+
+    channel.put_nowait(frame)
+    return 0
+
+
+def get_many(channel, max_frames: int) -> List:
+    """ Take up to ``max_frames`` frames from a receive channel without waiting. Channels with a ``get_many`` method
+    (:class:`ReceiveQueue`, rings) hand them over at once, others one by one. """
+    if hasattr(channel, 'get_many'):
+        return channel.get_many(max_frames)
+
+    frames = []
+
+    try:
+        while len(frames) < max_frames:
+            frames.append(channel.get_nowait())
+    except queue.Empty:
+        pass
+
+    return frames
@@ -0,0 +1,134 @@
+"""
+Registry mapping (payload_type, payload_id) to payload classes.
+
+Received packets are decoded through :data:`payload_registry`, so payloads registered by device plugins are created
+directly as their final class, and never go through :class:`amfiprot.payload.UndefinedPayload` first.
+
+Plugins register their payloads either explicitly::
+
+    amfiprot.payload_registry.register(MyStructPayload)                       # uses PAYLOAD_TYPE and PAYLOAD_ID
+    amfiprot.payload_registry.register(MyPayload, payload_type=0x42, payload_id=0x01)
+    amfiprot.payload_registry.register_type(0x43, MyPayloadFactory)           # every payload of type 0x43
+
+or lazily, through an ``amfiprot.payloads`` entry point that refers to a callable taking the registry as its only
+argument. Entry points are loaded the first time a packet with an unregistered payload type is decoded. A plugin that
+fails to load or register is skipped with a warning, so it cannot break decoding.
+"""
+import array
+import warnings
+from typing import Callable, Dict, Optional, Type
+from .payload import Payload, PayloadType, UndefinedPayload
+from .common_payload import payload_ids
+from .response_payload import SuccessPayload, NotImplementedPayload, FailurePayload, InvalidRequestPayload
+
+ENTRY_POINT_GROUP = 'amfiprot.payloads'
+
+
+class PayloadRegistry:
+    def __init__(self, entry_point_group: Optional[str] = ENTRY_POINT_GROUP):
+        self._classes: Dict[int, Dict[int, Type[Payload]]] = {}  # payload_type -> payload_id -> class
+        self._factories: Dict[int, Callable] = {}                # payload_type -> factory(data)
+        self._entry_point_group = entry_point_group
+        self._entry_points_loaded = entry_point_group is None
+
+    def register(self, payload_class=None, payload_type: Optional[int] = None, payload_id: Optional[int] = None):
+        """ Register a payload class, which must implement ``from_bytes(data)``. ``payload_type`` and ``payload_id``
+        default to the class attributes ``PAYLOAD_TYPE`` and ``PAYLOAD_ID``. Can also be used as a class decorator. """
+        if payload_class is None:
+            return lambda cls: self.register(cls, payload_type, payload_id)
+
+        if payload_type is None:
+            payload_type = payload_class.PAYLOAD_TYPE
+        if payload_id is None:
+            payload_id = getattr(payload_class, 'PAYLOAD_ID', None)
+        if payload_id is None:
+            raise ValueError(f"No payload ID given for {payload_class.__name__} (use register_type() for payload types without IDs)")
+
+        self._classes.setdefault(payload_type, {})[payload_id] = payload_class
+        return payload_class
+
+    def register_type(self, payload_type: int, factory: Callable):
+        """ Register a factory creating the payload for every payload of the given type, regardless of payload ID.
+        The factory is called with the payload bytes as an ``array.array('B')``. Payload classes registered with a
+        specific ID for the same type take precedence. """
+        self._factories[payload_type] = factory
+
+    def unregister(self, payload_type: int, payload_id: Optional[int] = None):
+        if payload_id is None:
+            self._factories.pop(payload_type, None)
+            self._classes.pop(payload_type, None)
+        else:
+            self._classes.get(payload_type, {}).pop(payload_id, None)
+
+    def lookup(self, payload_type: int, payload_id: Optional[int] = None):
+        """ Returns the class (or factory) used for the given payload type and ID, or None. """
+        ids = self._classes.get(payload_type)
+        if ids is not None and payload_id in ids:
+            return ids[payload_id]
+
+        return self._factories.get(payload_type)
+
+    def is_registered(self, payload_type: int) -> bool:
+        return payload_type in self._classes or payload_type in self._factories
+
+    def create(self, payload_type: int, data) -> Payload:
+        """ Create the payload object for raw payload bytes ``data`` (any object supporting the buffer protocol). """
+        ids = self._classes.get(payload_type)
+
+        if ids is not None and len(data) > 0:
+            payload_class = ids.get(data[0])
+            if payload_class is not None:
+                return payload_class.from_bytes(data)
+
+        factory = self._factories.get(payload_type)
+        if factory is not None:
+            return factory(_to_array(data))
+
+        if ids is None and not self._entry_points_loaded:
+            self.load_entry_points()
+            return self.create(payload_type, data)
+
+        return UndefinedPayload(_to_array(data), payload_type)
+
+    def load_entry_points(self):
+        """ Load all payload plugins advertised through the registry's entry point group. Plugins raising an exception
+        are skipped with a warning. """
+        self._entry_points_loaded = True
+
+        try:
+            from importlib import metadata
+        except ImportError:  # Python < 3.8
+            return
+
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, 'select'):
+            group = entry_points.select(group=self._entry_point_group)
+        else:
+            group = entry_points.get(self._entry_point_group, [])
+
+        for entry_point in group:
+            try:
+                register_payloads = entry_point.load()
+                register_payloads(self)
+            except Exception as e:
+                warnings.warn(f"Payload plugin \"{entry_point.name}\" ({entry_point.value}) failed to load: {e!r}")
+
+
+def _to_array(data) -> array.array:
+    if type(data) == array.array:
+        return data
+
+    arr = array.array('B')
+    arr.frombytes(data)
+    return arr
+
+
+payload_registry = PayloadRegistry()
+
+for _payload_class in payload_ids.values():
+    payload_registry.register(_payload_class)
+
+payload_registry.register_type(PayloadType.SUCCESS, SuccessPayload)
+payload_registry.register_type(PayloadType.NOT_IMPLEMENTED, NotImplementedPayload)
+payload_registry.register_type(PayloadType.FAILURE, FailurePayload)
+payload_registry.register_type(PayloadType.INVALID_REQUEST, InvalidRequestPayload)
@@ -0,0 +1,177 @@
+"""
+Single-producer, single-consumer ring buffer in shared memory, used in place of ``multiprocessing.Queue`` on the receive
+path (see the ``receive_ring_slots`` argument of the connections).
+
+Each slot holds one frame (the raw bytes of a packet, optionally with its receive timestamp, see
+:func:`amfiprot.packet.packet_from_frame`) of up to :data:`MAX_FRAME_LENGTH` bytes. The producer (the connection's
+I/O process) and the consumer (a :class:`amfiprot.Node`) each own one sequence counter in the shared block, so
+handing over a packet involves no pickling, no pipe write and no lock. When the ring is full, new packets are dropped.
+
+Requires Python 3.8 or newer (:mod:`multiprocessing.shared_memory`).
+"""
+import math
+import os
+import queue
+import struct
+import time
+import weakref
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple, Union
+
+MAX_FRAME_LENGTH = 64
+""" Largest frame that fits in a slot (a USB report without report ID and length is 62 bytes). """
+
+_COUNTER = struct.Struct('<Q')
+_SLOT_HEADER = struct.Struct('<H6xd')  # Frame length and timestamp (NaN if none)
+SLOT_SIZE = _SLOT_HEADER.size + MAX_FRAME_LENGTH
+_WRITE_SEQUENCE_OFFSET = 0
+_READ_SEQUENCE_OFFSET = 64  # Separate cache line from the write sequence
+_SLOTS_OFFSET = 128
+_POLL_INTERVAL = 0.0005  # Seconds between checks in blocking get()/put()
+
+
+class SharedMemoryRing:
+    """ A bounded queue of frames in shared memory, with the interface of ``multiprocessing.Queue`` that the
+    connections and :class:`amfiprot.Node` use (``put_nowait``, ``get``, ``get_nowait``, ``empty``, ``full`` and
+    ``qsize``), plus :meth:`get_many`. The ring can be passed to a ``multiprocessing.Process``, which attaches to the same shared block.
+
+    Frames are bytes-like objects or ``(timestamp, frame)`` tuples, and are returned as ``bytes`` (or
+    ``(timestamp, bytes)``). The process that created the ring unlinks the shared block when the ring is garbage
+    collected. """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._shm = shared_memory.SharedMemory(create=True, size=_SLOTS_OFFSET + capacity * SLOT_SIZE)
+        self._buffer = self._shm.buf
+        self._buffer[:_SLOTS_OFFSET] = bytes(_SLOTS_OFFSET)
+        self._finalizer = weakref.finalize(self, _destroy, self._shm, os.getpid())
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'capacity': self.capacity}
+
+    def __setstate__(self, state):
+        self.capacity = state['capacity']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._buffer = self._shm.buf
+        self._finalizer = weakref.finalize(self, _destroy, self._shm, None)
+
+    def close(self):
+        """ Detach from the shared block. The creating process also unlinks it. """
+        self._buffer = None
+        self._finalizer()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def qsize(self) -> int:
+        return self._write_sequence() - self._read_sequence()
+
+    def empty(self) -> bool:
+        return self._write_sequence() == self._read_sequence()
+
+    def full(self) -> bool:
+        return self.qsize() >= self.capacity
+
+    def put_nowait(self, frame: Union[bytes, Tuple[float, bytes]]):
+        """ Copy ``frame`` into the next free slot. Raises queue.Full if the ring is full. """
+        if type(frame) is tuple:
+            timestamp, frame = frame
+        else:
+            timestamp = math.nan
+
+        length = len(frame)
+        if length > MAX_FRAME_LENGTH:
+            raise ValueError(f"Frame of {length} bytes does not fit in a ring slot")
+
+        write_sequence = self._write_sequence()
+        if write_sequence - self._read_sequence() >= self.capacity:
+            raise queue.Full
+
+        slot = _SLOTS_OFFSET + (write_sequence % self.capacity) * SLOT_SIZE
+        _SLOT_HEADER.pack_into(self._buffer, slot, length, timestamp)
+        start = slot + _SLOT_HEADER.size
+        self._buffer[start:start + length] = frame
+
+        # Publish the slot only after it has been written
+        self._set_sequence(_WRITE_SEQUENCE_OFFSET, write_sequence + 1)
+
+    def put(self, frame, block: bool = True, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            try:
+                return self.put_nowait(frame)
+            except queue.Full:
+                if not block or (deadline is not None and time.monotonic() >= deadline):
+                    raise
+
+            time.sleep(_POLL_INTERVAL)
+
+    def get_nowait(self) -> Union[bytes, Tuple[float, bytes]]:
+        """ Returns the oldest frame. Raises queue.Empty if the ring is empty. """
+        read_sequence = self._read_sequence()
+        if read_sequence == self._write_sequence():
+            raise queue.Empty
+
+        slot = _SLOTS_OFFSET + (read_sequence % self.capacity) * SLOT_SIZE
+        length, timestamp = _SLOT_HEADER.unpack_from(self._buffer, slot)
+        start = slot + _SLOT_HEADER.size
+        frame = bytes(self._buffer[start:start + length])
+
+        # Release the slot only after it has been copied
+        self._set_sequence(_READ_SEQUENCE_OFFSET, read_sequence + 1)
+
+        if timestamp != timestamp:  # NaN: no timestamp
+            return frame
+
+        return timestamp, frame
+
+    def get_many(self, max_frames: int) -> List[Union[bytes, Tuple[float, bytes]]]:
+        """ Returns up to ``max_frames`` of the oldest frames (possibly none), releasing their slots at once. """
+        read_sequence = self._read_sequence()
+        count = min(max_frames, self._write_sequence() - read_sequence)
+        frames = []
+
+        for sequence in range(read_sequence, read_sequence + count):
+            slot = _SLOTS_OFFSET + (sequence % self.capacity) * SLOT_SIZE
+            length, timestamp = _SLOT_HEADER.unpack_from(self._buffer, slot)
+            start = slot + _SLOT_HEADER.size
+            frame = bytes(self._buffer[start:start + length])
+            frames.append(frame if timestamp != timestamp else (timestamp, frame))
+
+        if count > 0:
+            self._set_sequence(_READ_SEQUENCE_OFFSET, read_sequence + count)
+
+        return frames
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Union[bytes, Tuple[float, bytes]]:
+        """ Take the oldest frame, checking for one every :data:`_POLL_INTERVAL` while waiting. A ring wrapped in a
+        :class:`amfiprot.receive_queue.ReceiveQueue` with a notifier is waited for on the notifier instead. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                if not block or (deadline is not None and time.monotonic() >= deadline):
+                    raise
+
+            time.sleep(_POLL_INTERVAL)
+
+    def _write_sequence(self) -> int:
+        return _COUNTER.unpack_from(self._buffer, _WRITE_SEQUENCE_OFFSET)[0]
+
+    def _read_sequence(self) -> int:
+        return _COUNTER.unpack_from(self._buffer, _READ_SEQUENCE_OFFSET)[0]
+
+    def _set_sequence(self, offset: int, value: int):
+        # Not _COUNTER.pack_into(), which clears the target before packing, so the other process could read a zero
+        self._buffer[offset:offset + _COUNTER.size] = value.to_bytes(_COUNTER.size, 'little')
+
+
+def _destroy(shm: shared_memory.SharedMemory, creator_pid: Optional[int]):
+    shm.close()
+
+    if creator_pid == os.getpid():  # Not in a forked child that inherited the ring
+        shm.unlink()
@@ -0,0 +1,307 @@
+"""
+Declarative payload layouts.
+
+A payload class derived from :class:`StructPayload` describes its wire layout with a list of :class:`Field`\\ s (and
+optionally a variable-length :class:`Tail`). The layout is compiled once, when the class is created, into a single
+precompiled :class:`struct.Struct`, which gives every such payload fast ``from_bytes``, ``to_bytes`` and
+``encode_into`` implementations and an O(1) ``__len__``.
+
+Example::
+
+    class TemperaturePayload(StructPayload):
+        PAYLOAD_TYPE = 0x42
+        PAYLOAD_ID = 0x01
+        FIELDS = (Field('sensor_id', 'B'), Field('temperature', 'f'))
+
+        def __init__(self, sensor_id, temperature):
+            self.sensor_id = sensor_id
+            self.temperature = temperature
+
+Decoded field values are passed positionally to the constructor (in layout order, followed by the tail value). Classes
+whose constructor differs from the layout override :meth:`StructPayload._from_values` and
+:meth:`StructPayload._values`.
+"""
+import array
+import struct
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Sequence, Tuple
+from .payload import Payload
+
+
+class Field:
+    """ A single fixed-size value in a payload layout.
+
+    :param name: Attribute name holding the value on the payload object.
+    :param format: A single :mod:`struct` format item, e.g. ``'B'``, ``'H'``, ``'f'`` or ``'12s'`` (always
+        little-endian and unpadded).
+    :param decode: Optional conversion applied to the unpacked value.
+    :param encode: Optional conversion applied to the attribute value before packing.
+    :param dtype: Optional NumPy dtype string used for this field by :mod:`amfiprot.batch`.
+    """
+    __slots__ = ('name', 'format', 'decode', 'encode', 'dtype')
+
+    def __init__(self, name: str, format: str, decode=None, encode=None, dtype: Optional[str] = None):
+        self.name = name
+        self.format = format
+        self.decode = decode
+        self.encode = encode
+        self.dtype = dtype
+
+    def bind(self, field_names: Sequence[str]):
+        """ Called once when the layout is compiled, with the names of all fields in the layout. """
+        pass
+
+    def decode_value(self, raw, values: list):
+        return raw if self.decode is None else self.decode(raw)
+
+    def encode_value(self, value, payload):
+        return value if self.encode is None else self.encode(value)
+
+    @property
+    def converts(self) -> bool:
+        return self.decode is not None or self.encode is not None
+
+
+class Tail(ABC):
+    """ Variable-length data following the fixed-size fields, stored in attribute ``name``. """
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def bind(self, field_names: Sequence[str]):
+        pass
+
+    @abstractmethod
+    def size(self, payload) -> int:
+        pass
+
+    @abstractmethod
+    def decode(self, data: memoryview, values: list):
+        pass
+
+    @abstractmethod
+    def encode_into(self, payload, buffer, offset: int) -> int:
+        """ Writes the tail of ``payload`` into ``buffer`` at ``offset`` and returns the number of bytes written. """
+        pass
+
+
+class StringTail(Tail):
+    """ A string occupying the rest of the payload. If ``terminated`` is set, a null terminator is appended when
+    encoding and trailing nulls are stripped when decoding. """
+    __slots__ = ('encoding', 'terminated')
+
+    def __init__(self, name: str, encoding: str = 'ascii', terminated: bool = True):
+        super().__init__(name)
+        self.encoding = encoding
+        self.terminated = terminated
+
+    def size(self, payload) -> int:
+        value = getattr(payload, self.name)
+        if self.encoding == 'ascii':
+            length = len(value)
+        else:
+            length = len(value.encode(self.encoding))
+        return length + 1 if self.terminated else length
+
+    def decode(self, data: memoryview, values: list):
+        string = str(data, self.encoding)
+        return string.rstrip('\x00') if self.terminated else string
+
+    def encode_into(self, payload, buffer, offset: int) -> int:
+        encoded = getattr(payload, self.name).encode(self.encoding)
+        end = offset + len(encoded)
+        memoryview(buffer)[offset:end] = encoded
+
+        if self.terminated:
+            buffer[end] = 0
+            end += 1
+
+        return end - offset
+
+
+class BytesTail(Tail):
+    """ Raw bytes occupying the rest of the payload. Decoded as an ``array.array('B')``. """
+    __slots__ = ()
+
+    def size(self, payload) -> int:
+        return len(getattr(payload, self.name))
+
+    def decode(self, data: memoryview, values: list):
+        arr = array.array('B')
+        arr.frombytes(data)
+        return arr
+
+    def encode_into(self, payload, buffer, offset: int) -> int:
+        value = getattr(payload, self.name)
+        length = len(value)
+
+        try:
+            memoryview(buffer)[offset:offset + length] = memoryview(value)
+        except TypeError:  # E.g. a list of ints
+            memoryview(buffer)[offset:offset + length] = bytes(value)
+
+        return length
+
+
+def uuid_field(name: str = 'uuid') -> Field:
+    """ A 96-bit UUID transmitted as three little-endian uint32 words, most significant word first. """
+    return Field(name, '12s', decode=_decode_uuid, encode=_encode_uuid, dtype='(3,)<u4')
+
+
+def _decode_uuid(raw: bytes) -> int:
+    return int.from_bytes(raw[8:12] + raw[4:8] + raw[0:4], byteorder='little')  # Reorder uint32 blocks, to match earlier formatting of UUID
+
+
+def _encode_uuid(uuid: int) -> bytes:
+    uuid_as_bytes = uuid.to_bytes(12, byteorder='little')
+    return uuid_as_bytes[8:12] + uuid_as_bytes[4:8] + uuid_as_bytes[0:4]
+
+
+class StructPayload(Payload):
+    """ Base class for payloads whose layout is described by ``FIELDS`` (and optionally ``TAIL``).
+
+    The following class attributes are set when the class is created:
+
+    * ``SIZE``: Length of the fixed-size part (including the payload ID byte, if any).
+    * ``STRUCT``: The compiled :class:`struct.Struct` for the fixed-size part.
+    """
+    PAYLOAD_TYPE: int = 0
+    PAYLOAD_ID: Optional[int] = None
+    FIELDS: Tuple[Field, ...] = ()
+    TAIL: Optional[Tail] = None
+
+    SIZE: int = 0
+    STRUCT: struct.Struct = struct.Struct('<')
+    _converted_fields: Tuple[Tuple[int, Field], ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile()
+
+    @classmethod
+    def _compile(cls):
+        field_names = [field.name for field in cls.FIELDS]
+        formats = ''.join(field.format for field in cls.FIELDS)
+
+        for field in cls.FIELDS:
+            field.bind(field_names)
+
+        if cls.TAIL is not None:
+            cls.TAIL.bind(field_names)
+
+        if cls.PAYLOAD_ID is not None:
+            formats = 'B' + formats
+
+        cls.STRUCT = struct.Struct('<' + formats)
+        cls.SIZE = cls.STRUCT.size
+        cls._converted_fields = tuple((index, field) for index, field in enumerate(cls.FIELDS) if field.converts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Decode a payload from raw bytes (anything supporting the buffer protocol). """
+        values = cls.STRUCT.unpack_from(data)
+
+        if cls.PAYLOAD_ID is not None:
+            values = values[1:]
+
+        if cls._converted_fields or cls.TAIL is not None:
+            values = list(values)
+
+            for index, field in cls._converted_fields:
+                values[index] = field.decode_value(values[index], values)
+
+            if cls.TAIL is not None:
+                values.append(cls.TAIL.decode(memoryview(data)[cls.SIZE:], values))
+
+        return cls._from_values(*values)
+
+    @classmethod
+    def _from_values(cls, *values):
+        """ Create a payload object from the decoded field values (and tail value, if any). """
+        return cls(*values)
+
+    def _values(self) -> Tuple[Any, ...]:
+        """ Returns the values of the fixed-size fields, in layout order. """
+        return tuple(getattr(self, field.name) for field in self.FIELDS)
+
+    def __len__(self):
+        if self.TAIL is None:
+            return self.SIZE
+
+        return self.SIZE + self.TAIL.size(self)
+
+    def __str__(self):
+        fields = ', '.join(f"{name}: {getattr(self, name)}" for name in self._attribute_names())
+        return f"<{type(self).__name__}> {fields}"
+
+    @property
+    def type(self):
+        return self.PAYLOAD_TYPE
+
+    def to_dict(self):
+        data_dict = {'payload_id': self.PAYLOAD_ID}
+        data_dict.update((name, getattr(self, name)) for name in self._attribute_names())
+        return data_dict
+
+    @classmethod
+    def _attribute_names(cls):
+        names = [field.name for field in cls.FIELDS]
+        if cls.TAIL is not None:
+            names.append(cls.TAIL.name)
+        return names
+
+    def encode_into(self, buffer, offset: int = 0) -> int:
+        """ Write the payload into ``buffer`` (e.g. a ``bytearray``) at ``offset``. Returns the number of bytes written. """
+        values = self._values()
+
+        if self._converted_fields:
+            values = list(values)
+            for index, field in self._converted_fields:
+                values[index] = field.encode_value(values[index], self)
+
+        if self.PAYLOAD_ID is None:
+            self.STRUCT.pack_into(buffer, offset, *values)
+        else:
+            self.STRUCT.pack_into(buffer, offset, self.PAYLOAD_ID, *values)
+
+        if self.TAIL is None:
+            return self.SIZE
+
+        return self.SIZE + self.TAIL.encode_into(self, buffer, offset + self.SIZE)
+
+    def to_bytes(self):
+        buffer = bytearray(len(self))
+        self.encode_into(buffer)
+        data = array.array('B')
+        data.frombytes(buffer)
+        return data
+
+    @classmethod
+    def dtype_descr(cls) -> list:
+        """ NumPy dtype description (list of (name, type) tuples) of the fixed-size part of the layout. Fields without
+        a numeric equivalent are described as raw void fields. """
+        descr = []
+
+        if cls.PAYLOAD_ID is not None:
+            descr.append(('payload_id', 'u1'))
+
+        for field in cls.FIELDS:
+            descr.append((field.name, field.dtype or _STRUCT_TO_DTYPE.get(field.format) or f'V{struct.calcsize("<" + field.format)}'))
+
+        return descr
+
+
+_STRUCT_TO_DTYPE = {
+    '?': '?',
+    'b': 'i1',
+    'B': 'u1',
+    'h': '<i2',
+    'H': '<u2',
+    'i': '<i4',
+    'I': '<u4',
+    'q': '<i8',
+    'Q': '<u8',
+    'f': '<f4',
+    'd': '<f8',
+}
@@ -1,37 +1,77 @@
-import array
 import sys
 import serial
 import serial.tools.list_ports
 import multiprocessing as mp
+import threading
+import queue
 import time
 import hashlib
 import enum
 import atexit
 from typing import List, Optional
 from cobs import cobs
-from .packet import Packet, PacketDestination
-from .common_payload import RequestDeviceIdPayload, ReplyDeviceIdPayload, RequestDeviceNamePayload, ReplyDeviceNamePayload
+from .packet import Packet, Header, CrcValidation, FrameError, check_frame, frame_length, is_control_frame
 from .node import Node
-from .connection import Connection
+from .receive_queue import ReceiveQueue, QueuePolicy, Notifier, DEFAULT_CAPACITY, deliver
+from .connection import (Connection, ConnectionStatistics, IdleStrategy, ReceiveChannels, STOP_SENTINEL,
+                         SPARE_RECEIVE_CHANNELS, REQUEST_DEVICE_ID_TEMPLATE, apply_node_update, discover_nodes,
+                         receive_packet, drain, discard_until_stop, wait_for_sync, release_receive_channels,
+                         DISCOVERY_TIMEOUT)
+
+READ_TIMEOUT = 0.1  # Seconds, bounds blocking reads so the UART process notices a stop request
+TRANSMIT_POLL_INTERVAL = 0.1  # Seconds
+STOP_TIMEOUT = 2  # Seconds to wait for the UART process to send what is enqueued, and to exit
+SERIAL_TIMEOUT = 1  # Seconds, read timeout of the port opened by the main process
+
 
 class UARTConnection(Connection):
     """An implementation of :class:`amfiprot.Connection` used to connect to UART devices."""
     MAX_PAYLOAD_SIZE = 54  # 1 byte needed for CRC
 
-    def __init__(self, port: str, baudrate: int = 115200):
+    def __init__(self, port: str, baudrate: int = 115200, crc_validation: CrcValidation = CrcValidation.FULL,
+                 receive_ring_slots: int = 0, timestamps: bool = False, idle_strategy: IdleStrategy = IdleStrategy.BLOCK,
+                 receive_queue_capacity: int = DEFAULT_CAPACITY, receive_queue_bytes: int = 0,
+                 queue_policy: QueuePolicy = QueuePolicy.DROP_OLDEST):
+        """ Received frames failing ``crc_validation`` are dropped by the UART process and counted in
+        :attr:`statistics`.
+
+        ``receive_ring_slots`` > 0 makes received packets reach the nodes (and the global receive queue) through a
+        :class:`amfiprot.ring.SharedMemoryRing` with that many slots instead of a ``multiprocessing.Queue``.
+
+        With ``timestamps`` set, the receive time of each packet is recorded in :attr:`amfiprot.Packet.timestamp`.
+
+        ``idle_strategy`` selects how the UART process waits for work, see :class:`amfiprot.IdleStrategy`.
+
+        Receive queues (of nodes and subscriptions) hold up to ``receive_queue_capacity`` packets and (if not 0)
+        ``receive_queue_bytes`` bytes, and ``queue_policy`` decides what happens to packets that do not fit. See
+        :class:`amfiprot.receive_queue.ReceiveQueue`, whose settings can also be changed per queue.
+
+        :meth:`find_nodes` can be called while the connection is started. Nodes that were added, removed or re-addressed
+        are passed on to the running UART process, without restarting it. """
         self.port = port
         self.baudrate = baudrate
+        self.crc_validation = crc_validation
+        self.receive_ring_slots = receive_ring_slots
+        self.timestamps = timestamps
+        self.idle_strategy = idle_strategy
+        self.receive_queue_capacity = receive_queue_capacity
+        self.receive_queue_bytes = receive_queue_bytes
+        self.queue_policy = queue_policy
+        self.statistics = ConnectionStatistics()
         self.serial_device = get_matching_device(port, baudrate)
 
         if self.serial_device is None:
             raise ConnectionError("Could not connect to device!")
 
-        self.receive_process: mp.Process = None
-        self.transmit_process: mp.Process = None
         self.uart_task: mp.Process = None
+        self.stop_event: mp.Event = mp.Event()
+        self.transmit_drained: mp.Event = mp.Event()  # Set by the UART process' writer
         self.nodes: List[Node] = []
+        self.receive_channels = ReceiveChannels()
         self.transmit_queue: mp.Queue = mp.Queue()
-        self.global_receive_queue: mp.Queue = mp.Queue()
+        self._global_receive_queue = None  # Created by the first access to global_receive_queue
+        self.notifier = Notifier()  # Signalled by the notifiers of all receive queues, see fileno()
+        self.discovery_queue = self.create_receive_queue()  # Receives every packet while find_nodes() runs
         self.uart_connection_lost: mp.Event = mp.Event()
         self.node_update_queue: mp.Queue = mp.Queue()
         
@@ -58,77 +98,64 @@ class UARTConnection(Connection):
         return device_list
 
     def find_nodes(self) -> List[Node]:
-        payload = RequestDeviceIdPayload()
-        packet = Packet.from_payload(payload, destination_id=PacketDestination.BROADCAST)
+        if self._running():
+            nodes = self._discover_through_process()
+        else:
+            nodes = self._discover_directly()
 
-        bytes_to_transmit: array.array = array.array('B')
-        bytes_to_transmit.extend(packet.to_bytes())
-        cobs_encoded = cobs.encode(bytes(bytes_to_transmit)) + b'\x00'
+        if nodes_changed(nodes, self.nodes):
+            self.nodes = nodes
 
-        self.serial_device.write(cobs_encoded)
+        self._update_or_restart()  # TX IDs may have changed even if the nodes did not
 
-        start_time = time.time()
+        return self.nodes
 
-        rx_packets = []
-        while time.time() - start_time < 1:
-            if self.serial_device.in_waiting > 0:
-                data = self.serial_device.read_until(b'\x00')
-                try:
-                    cobs_decoded = cobs.decode(data[:-1])
-                    arr = array.array('B') 
-                    arr.frombytes(cobs_decoded)
-                    rx_packet = Packet(arr)
-                    if type(rx_packet.payload) == ReplyDeviceIdPayload:
-                        rx_packets.append(rx_packet)
-                except:
-                    pass
-                    #print("UART package error")
-
-        nodes = []
-
-        for packet in rx_packets:
-            if type(packet.payload) == ReplyDeviceIdPayload:
-                uuids = [node.uuid for node in nodes]
-                if packet.payload.uuid not in uuids:
-                    node = Node(tx_id=packet.payload.tx_id, uuid=packet.payload.uuid, connection=self)
-                    nodes.append(node)
-
-        for node in nodes:
-            payload = RequestDeviceNamePayload()
-            packet = Packet.from_payload(payload, destination_id=node.tx_id)
-
-            bytes_to_transmit: array.array = array.array('B')
-            bytes_to_transmit.extend(packet.to_bytes())
-            cobs_encoded = cobs.encode(bytes(bytes_to_transmit)) + b'\x00'
-
-            self.serial_device.write(cobs_encoded)
-
-            start_time = time.time()
-
-            while time.time() - start_time < 1:
-                if self.serial_device.in_waiting > 0:
-                    data = self.serial_device.read_until(b'\x00')
-                    try:
-                        cobs_decoded = cobs.decode(data[:-1])
-                        arr = array.array('B') 
-                        arr.frombytes(cobs_decoded)
-                        rx_packet = Packet(arr)
-                        if type(rx_packet.payload) == ReplyDeviceNamePayload:
-                            node.name = rx_packet.payload.name
-                            break
-                    except:
-                        pass
-                        #print("UART package error")
+    def _discover_directly(self) -> List[Node]:
+        if not self.serial_device.is_open:
+            self.serial_device.open()
 
-        if nodes_changed(nodes, self.nodes):
-            self.nodes = nodes
-            if self.receive_process is not None and self.transmit_process is not None:
-                self.stop()
-                self.start()
+        def send(packet: Packet):
+            self.serial_device.write(encode_frame(packet))
 
-        self.serial_device.close()
+        def receive(timeout: float) -> Optional[Packet]:
+            self.serial_device.timeout = timeout
+            data = self.serial_device.read_until(b'\x00')
 
-        return self.nodes
+            if len(data) == 0 or data[-1] != 0:
+                return None
+
+            try:
+                cobs_decoded = cobs.decode(data[:-1])
+            except cobs.DecodeError:
+                return None
+
+            if len(cobs_decoded) == 0 or check_frame(cobs_decoded, 0, self.crc_validation) != FrameError.NONE:
+                return None
+
+            return Packet(cobs_decoded)
+
+        try:
+            return discover_nodes(self, send, receive, self.nodes)
+        finally:
+            self.serial_device.timeout = SERIAL_TIMEOUT
+            self.serial_device.close()  # Opened by the UART process instead
+
+    def _discover_through_process(self) -> List[Node]:
+        self._update_or_restart()  # Passes on nodes created since the last update
+
+        # The UART process copies every packet to the discovery queue while it is tapped
+        self.receive_channels.taps.append(self.discovery_queue)
+
+        try:
+            # Requests are only sent once the UART process has started copying, so no reply is missed
+            drain(self.discovery_queue)
+            self._update_workers(sync=self.discovery_queue)
+            wait_for_sync(self.discovery_queue, DISCOVERY_TIMEOUT)
+
+            return discover_nodes(self, self.enqueue_packet,
+                                  lambda timeout: receive_packet(self.discovery_queue, timeout), self.nodes)
+        finally:
+            self.receive_channels.taps.remove(self.discovery_queue)
 
     def enqueue_packet(self, packet: Packet):
         self.transmit_queue.put(packet)
@@ -136,27 +163,81 @@ class UARTConnection(Connection):
     def max_payload_size(self) -> int:
         return self.MAX_PAYLOAD_SIZE
 
+    def create_receive_queue(self, capacity: Optional[int] = None, capacity_bytes: Optional[int] = None,
+                             policy: Optional[QueuePolicy] = None) -> ReceiveQueue:
+        """ Create a receive queue, with the capacity and policy of the connection unless given. """
+        channel = None
+        if self._running() and not self._channels_transferable():
+            channel = self.receive_channels.take_spare()  # Already known by the UART process
+
+        if channel is None:
+            channel = self._new_receive_channel()
+
+        channel.capacity = self.receive_queue_capacity if capacity is None else capacity
+        channel.capacity_bytes = self.receive_queue_bytes if capacity_bytes is None else capacity_bytes
+        channel.policy = self.queue_policy if policy is None else policy
+        return channel
+
+    def _new_receive_channel(self) -> ReceiveQueue:
+        if self.receive_ring_slots > 0:
+            from .ring import SharedMemoryRing
+            return ReceiveQueue(SharedMemoryRing(self.receive_ring_slots), evictable=False,
+                                notifier=Notifier(self.notifier))
+
+        return ReceiveQueue(mp.Queue(), notifier=Notifier(self.notifier))
+
+    def _running(self) -> bool:
+        return self.uart_task is not None and self.uart_task.is_alive()
+
     def start(self):
-        atexit.register(connection_exit_handler, self)
+        atexit.register(self.stop)
+
+        spares = []
+        if not self._channels_transferable():
+            spares = [self._new_receive_channel() for _ in range(SPARE_RECEIVE_CHANNELS)]
 
+        drain(self.node_update_queue)  # Updates for a previous UART process
         tx_ids = [node.tx_id for node in self.nodes]
-        rx_queues = [node.receive_queue for node in self.nodes]
+        rx_queues = self.receive_channels.reset(self.nodes, spares, [self.discovery_queue])
+        self.node_update_queue.put(self.receive_channels.update(self.nodes, True))  # Subscriptions
+
+        out_conn, in_conn = mp.Pipe()  # Used by the UART process to signal to main that the port is open
 
-        self.uart_task = mp.Process(target=uart_task, args=(self.port, self.baudrate, tx_ids, rx_queues, self.transmit_queue, self.global_receive_queue, self.node_update_queue))
+        self.stop_event.clear()
+        self.transmit_drained.clear()
+        self.uart_task = mp.Process(target=uart_task, args=(out_conn, self.port, self.baudrate, tx_ids, rx_queues, self.transmit_queue, None, self.node_update_queue, self.crc_validation, self.statistics, self.timestamps, self.stop_event, self.idle_strategy, self.transmit_drained))
         self.uart_task.start()
-        time.sleep(1)  # To allow processes to start up
+        out_conn.close()  # So that recv() fails instead of blocking if the UART process exits without signalling
+
+        try:
+            in_conn.recv()  # Will block until the UART process has opened the port
+        except EOFError:
+            raise ConnectionError("UART process could not open the port.")
 
     def stop(self):
-        if self.uart_task is not None:
+        atexit.unregister(self.stop)
+
+        if self.uart_task is not None and self.uart_task.is_alive():
+            # The writer acknowledges the sentinel once it has sent the packets enqueued before it
+            self.transmit_queue.put(STOP_SENTINEL)
+            acknowledged = self.transmit_drained.wait(STOP_TIMEOUT)
+            self.stop_event.set()
+            self.uart_task.join(STOP_TIMEOUT)
+
             if self.uart_task.is_alive():
-                time.sleep(1)
                 self.uart_task.terminate()
                 self.uart_task.join()
-                self.serial_device.close()
 
-    def refresh(self):
-        tx_ids = [node.tx_id for node in self.nodes]
-        self.node_update_queue.put({'tx_ids': tx_ids})
+            if not acknowledged:
+                discard_until_stop(self.transmit_queue)  # Not sent in time, and not to be sent after a restart either
+
+        self.serial_device.close()
+
+    def refresh(self) -> bool:
+        if not self._running():
+            return True  # The nodes are passed to the UART process when it is started
+
+        return self._update_workers()
 
     def __str__(self):
         return f"UART Connection on port {self.port} at baudrate {self.baudrate}"
@@ -168,85 +249,206 @@ class ConnectionState(enum.IntEnum):
     DISCONNECTED = 2
 
 
-def uart_task(port, baudrate, tx_ids, rx_queues: List[mp.Queue], tx_queue: mp.Queue, global_receive_queue: mp.Queue, node_update_queue: mp.Queue):
+class SerialPortHandle:
+    """ The serial port shared by the UART read loop and write thread. The read loop reopens the port when it is lost. """
     RETRY_LIMIT = 10
-    retry_count = 0
-    dev = None
 
-    while dev is None:
-        try:
-            dev = serial.Serial(port, baudrate, timeout=1)
-            state = ConnectionState.CONNECTED
-        except serial.SerialException:
+    def __init__(self, port: str, baudrate: int, timeout: Optional[float]):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.device: Optional[serial.Serial] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> ConnectionState:
+        return ConnectionState.DISCONNECTED if self.device is None else ConnectionState.CONNECTED
+
+    def open(self):
+        """ Open the port, raising a ConnectionError if it cannot be opened after RETRY_LIMIT attempts. """
+        retry_count = 0
+
+        while self.reconnect() is None:
             retry_count += 1
-            if retry_count > RETRY_LIMIT:
+            if retry_count > self.RETRY_LIMIT:
                 raise ConnectionError("Subprocess could not find device.")
             time.sleep(1)
 
-    tx_ids_local = tx_ids
-    rx_queues_local = rx_queues
-
-    while True:
-        if state == ConnectionState.CONNECTED:
-            while not tx_queue.empty():
-                tx_packet = tx_queue.get_nowait()
-                byte_data = array.array('B')
-                byte_data.extend(tx_packet.to_bytes())
-                cobs_encoded = cobs.encode(bytes(byte_data)) + b'\x00'
+    def reconnect(self) -> Optional[serial.Serial]:
+        with self._lock:
+            if self.device is None:
                 try:
-                    dev.write(cobs_encoded)
-                except serial.SerialException as e:
-                    print(f"Could not send packet ({e})")
-                    continue
+                    self.device = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+                except serial.SerialException:
+                    pass
 
-            if not node_update_queue.empty():
-                update = node_update_queue.get()
-                tx_ids_local = update['tx_ids']
+            return self.device
 
-            try:
-                if dev.in_waiting > 0:
-                    data = dev.read_until(b'\x00')
-                    try:
-                        cobs_decoded = cobs.decode(data[:-1])
-                        arr = array.array('B') 
-                        arr.frombytes(cobs_decoded)
-                        rx_packet = Packet(arr)
-                    
-                        if global_receive_queue.full():
-                            print("Global receive queue full! Packet discarded.")
-                        else:
-                            global_receive_queue.put_nowait(rx_packet)
-
-                        index = tx_ids_local.index(rx_packet.source_id)
-                        if rx_queues_local[index].full():
-                            print(f"RX queue [TxID {tx_ids_local[index]}] full! Packet discarded.")
-                        else:
-                            rx_queues_local[index].put_nowait(rx_packet)
-
-                    except:
-                        pass
-                        #print("UART package error")
-
-            except serial.SerialException as e:
-                print("UART connection lost.")
-                dev.close()
-                state = ConnectionState.DISCONNECTED
-                continue
+    def lost(self, device: serial.Serial):
+        """ Called by a loop when an operation on ``device`` failed because the port is gone. """
+        with self._lock:
+            if self.device is device:
+                device.close()
+                self.device = None
+
+    def close(self):
+        with self._lock:
+            if self.device is not None:
+                self.device.close()
+                self.device = None
+
+
+def uart_task(conn, port, baudrate, tx_ids, rx_queues: List[mp.Queue], tx_queue: mp.Queue, global_receive_queue: mp.Queue, node_update_queue: mp.Queue,
+              crc_validation: CrcValidation = CrcValidation.FULL, statistics: Optional[ConnectionStatistics] = None,
+              timestamps: bool = False, stop_event=None, idle_strategy: IdleStrategy = IdleStrategy.BLOCK, drained=None):
+    """ Receive in this process' main thread and transmit in a second thread, until ``stop_event`` is set. """
+    port_handle = SerialPortHandle(port, baudrate, READ_TIMEOUT if idle_strategy == IdleStrategy.BLOCK else 0)
+    port_handle.open()
+
+    writer = threading.Thread(target=uart_write_loop, args=(port_handle, tx_queue, idle_strategy, drained, statistics),
+                              daemon=True)
+    writer.start()
+
+    conn.send(0)  # Notify main process that the port is open
+
+    uart_read_loop(port_handle, tx_ids, rx_queues, global_receive_queue, node_update_queue, crc_validation, statistics,
+                   stop_event, timestamps, idle_strategy)
 
-        elif state == ConnectionState.DISCONNECTED:
+    writer.join(STOP_TIMEOUT)  # Sends what was enqueued before the stop sentinel
+    port_handle.close()
+    release_receive_channels([global_receive_queue] + list(rx_queues))
+
+
+def uart_read_loop(port: SerialPortHandle, tx_ids, rx_queues, global_receive_queue, node_update_queue,
+                   crc_validation: CrcValidation = CrcValidation.FULL, statistics: Optional[ConnectionStatistics] = None,
+                   stop_event=None, timestamps: bool = False, idle_strategy: IdleStrategy = IdleStrategy.BLOCK):
+    """ Receive COBS frames and route the packets to the node queues, until ``stop_event`` is set (if given). Reads
+    block for up to the port's timeout, which is 0 (polling) unless ``idle_strategy`` is ``IdleStrategy.BLOCK``.
+
+    Packets from ``tx_ids[i]`` go to ``rx_queues[i]``, and every packet to ``global_receive_queue`` (unless None).
+    ``rx_queues`` may contain more queues than ``tx_ids``, for nodes and subscriptions added later through
+    ``node_update_queue`` (see :func:`amfiprot.connection.apply_node_update`), which also gives each node a control
+    lane for acks, replies and status packets. """
+    SOURCE_TX_ID_INDEX = Header.HeaderIndex.SOURCE_TX_ID
+
+    channels = list(rx_queues)
+    routes = dict(zip(tx_ids, channels))  # Source TX ID to node queue
+    control_routes = routes  # Source TX ID to node control lane, see is_control_frame()
+    taps = []  # Queues receiving every packet
+    received = bytearray()  # Bytes read after the last frame delimiter
+
+    while stop_event is None or not stop_event.is_set():
+        dev = port.device
+
+        if dev is None:
             print("Reconnecting...")
-            try:
-                dev = serial.Serial(port, baudrate, timeout=1)
-                state = ConnectionState.CONNECTED
-            except serial.SerialException:
+            received.clear()
+
+            if port.reconnect() is None:
                 time.sleep(1)
-        else:
-            raise ValueError("Invalid state in UART task.")
+            continue
+
+        while not node_update_queue.empty():
+            routes, control_routes, taps = apply_node_update(node_update_queue.get(), channels)
+
+        try:
+            data = dev.read(max(1, dev.in_waiting))  # Waits for the first byte, then takes everything buffered
+        except serial.SerialException as e:
+            print("UART connection lost.")
+            port.lost(dev)
+            continue
+
+        if len(data) == 0:
+            if idle_strategy == IdleStrategy.YIELD:
+                time.sleep(0)
+            continue
+
+        received += data
+        frame_start = 0
+        frame_end = received.find(0, frame_start)
+
+        while frame_end >= 0:
+            try:
+                cobs_decoded = cobs.decode(received[frame_start:frame_end])
+            except cobs.DecodeError:
+                cobs_decoded = b''  # Counted as malformed below
+
+            frame_start = frame_end + 1
+            frame_end = received.find(0, frame_start)
+
+            # Drop corrupt frames before they are passed to other processes
+            error = check_frame(cobs_decoded, 0, crc_validation) if len(cobs_decoded) > 0 else FrameError.MALFORMED
+
+            if statistics is not None:
+                statistics.count(error)
+
+            if error != FrameError.NONE:
+                continue
+
+            # Forward only the packet bytes, the Packet is created by the consumer
+            frame = cobs_decoded[:frame_length(cobs_decoded)]
+            if timestamps:
+                frame = (time.time(), frame)
+
+            # Frames that do not fit are handled by the queue's policy, and only counted here
+            dropped = 0 if global_receive_queue is None else deliver(global_receive_queue, frame)
+
+            for tap in taps:
+                dropped += deliver(tap, frame)
+
+            lanes = control_routes if is_control_frame(cobs_decoded) else routes
+            rx_queue = lanes.get(cobs_decoded[SOURCE_TX_ID_INDEX])
+
+            if rx_queue is not None:
+                dropped += deliver(rx_queue, frame)
+
+            if dropped > 0 and statistics is not None:
+                statistics.count_queue_drops(dropped)
+
+        del received[:frame_start]
+
+
+def uart_write_loop(port: SerialPortHandle, tx_queue, idle_strategy: IdleStrategy = IdleStrategy.BLOCK, drained=None,
+                    statistics: Optional[ConnectionStatistics] = None):
+    """ Send enqueued packets until :data:`amfiprot.connection.STOP_SENTINEL` is dequeued. The event ``drained`` (if
+    given) is set then, i.e. once everything enqueued before the sentinel has been sent. Packets that cannot be sent
+    are counted in ``statistics`` (if given). """
+    while True:
+        try:
+            if idle_strategy == IdleStrategy.BLOCK:
+                tx_packet = tx_queue.get(timeout=TRANSMIT_POLL_INTERVAL)
+            else:
+                tx_packet = tx_queue.get_nowait()
+        except queue.Empty:
+            if idle_strategy == IdleStrategy.YIELD:
+                time.sleep(0)
+            continue
+
+        if tx_packet is STOP_SENTINEL:
+            if drained is not None:
+                drained.set()
+            break
+
+        dev = port.device
+        try:
+            if dev is None:
+                raise serial.SerialException("Not connected")
+
+            dev.write(encode_frame(tx_packet))
+        except serial.SerialException:
+            if statistics is not None:
+                statistics.count_transmit_drop()
+
+
+def encode_frame(packet: Packet) -> bytes:
+    """ COBS-encode a packet and append the frame delimiter. The packet buffer is encoded directly, without copying
+    it first. """
+    return cobs.encode(packet.to_bytes()) + b'\x00'
 
 
 def get_matching_device(port, baudrate):
     try:
-        dev = serial.Serial(port, baudrate, timeout=1)
+        dev = serial.Serial(port, baudrate, timeout=SERIAL_TIMEOUT)
         return dev
     except serial.SerialException:
         return None
@@ -264,7 +466,3 @@ def nodes_changed(list1: List[Node], list2):
             return True
 
     return False
-
-
-def connection_exit_handler(connection):
-    connection.stop()
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+Reading a USB interrupt IN endpoint through libusb's asynchronous API, with several transfers queued at all times.
+
+A synchronous ``usb.core.Device.read`` only has a transfer queued while the call is in progress, so reports that the
+device sends while Python is busy elsewhere (a garbage collection, a full queue, the GIL held by another thread) are
+missed. :class:`AsyncReader` keeps ``transfers`` transfers submitted and resubmits each one as soon as it completes,
+so the host controller keeps polling the device and buffers up to ``transfers`` reports until they are read.
+
+Only the libusb1 backend of pyusb is supported. The libusb library, context and device handle are passed in
+explicitly, so the reader can also be driven by a stand-in library (see ``tests/test_usb_async.py`` and
+``benchmarks/bench_async_read.py``).
+"""
+import array
+import collections
+import ctypes
+import time
+from typing import Optional
+
+import usb.core
+from usb.backend.libusb1 import (LIBUSB_TRANSFER_COMPLETED, LIBUSB_TRANSFER_ERROR, LIBUSB_TRANSFER_TIMED_OUT,
+                                 LIBUSB_TRANSFER_CANCELLED, _libusb_transfer, _libusb_transfer_cb_fn_p)
+
+LIBUSB_TRANSFER_TYPE_INTERRUPT = 3
+CLOSE_TIMEOUT = 1.0  # Seconds to wait for cancelled transfers to be returned by libusb
+
+
+class _Timeval(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_usec', ctypes.c_long)]
+
+
+def _setup_prototypes(lib):
+    """ Declare the functions that pyusb's libusb1 backend does not declare itself. """
+    lib.libusb_handle_events_timeout.argtypes = [ctypes.c_void_p, ctypes.POINTER(_Timeval)]
+    lib.libusb_handle_events_timeout.restype = ctypes.c_int
+    lib.libusb_cancel_transfer.argtypes = [ctypes.POINTER(_libusb_transfer)]
+    lib.libusb_cancel_transfer.restype = ctypes.c_int
+
+
+class AsyncReader:
+    """ Reads reports from an interrupt IN endpoint with ``transfers`` libusb transfers of ``length`` bytes queued.
+
+    :meth:`read` has the signature of ``usb.core.Device.read`` and returns the oldest completed report as an
+    ``array.array('B')``, so the reader can stand in for the device in :func:`amfiprot.usb_connection.usb_read_loop`.
+    Completed transfers are resubmitted from libusb's event handling, before the report is returned by :meth:`read`.
+
+    ``lib`` is the libusb library (``ctypes.CDLL``), ``context`` the libusb context and ``handle`` an open device handle
+    whose interface has been claimed. Use :meth:`from_device` to take all three from a pyusb device. """
+
+    def __init__(self, lib, context, handle, endpoint: int = 0x81, transfers: int = 4, length: int = 64):
+        if isinstance(lib, ctypes.CDLL):
+            _setup_prototypes(lib)
+
+        self.lib = lib
+        self.context = context
+        self.endpoint = endpoint
+        self.completed = collections.deque()  # Reports not yet returned by read()
+        self.error: Optional[int] = None  # Status of the transfer that failed, if any
+        self._pending = 0  # Transfers owned by libusb
+        self._closing = False
+        self._callback = _libusb_transfer_cb_fn_p(self._on_transfer_complete)  # Must outlive every transfer
+        self._buffers = []
+        self._transfers = []
+
+        for _ in range(transfers):
+            transfer = lib.libusb_alloc_transfer(0)
+            if not transfer:
+                raise MemoryError("Could not allocate libusb transfer")
+
+            buffer = (ctypes.c_ubyte * length)()
+            contents = transfer.contents
+            contents.dev_handle = handle
+            contents.flags = 0
+            contents.endpoint = endpoint
+            contents.type = LIBUSB_TRANSFER_TYPE_INTERRUPT
+            contents.timeout = 0  # Stay queued until the device sends a report
+            contents.buffer = ctypes.cast(buffer, ctypes.c_void_p)
+            contents.length = length
+            contents.callback = self._callback
+
+            self._buffers.append(buffer)
+            self._transfers.append(transfer)
+
+        try:
+            for transfer in self._transfers:
+                self._submit(transfer)
+        except usb.core.USBError:
+            self.close()
+            raise
+
+    @classmethod
+    def from_device(cls, device: usb.core.Device, endpoint: int = 0x81, transfers: int = 4, length: int = 64) -> 'AsyncReader':
+        """ Create a reader for ``endpoint`` of an opened pyusb device. The device must use the libusb1 backend. """
+        device._ctx.setup_request(device, endpoint)  # Opens the device and claims the interface, as read() would
+        backend = device._ctx.backend
+
+        if not hasattr(backend, 'lib') or not hasattr(backend, 'ctx'):
+            raise NotImplementedError("Asynchronous reads require the libusb1 backend")
+
+        return cls(backend.lib, backend.ctx, device._ctx.handle.handle, endpoint, transfers, length)
+
+    @property
+    def pending(self) -> int:
+        """ Number of transfers currently queued on the device. """
+        return self._pending
+
+    def read(self, endpoint: int = None, size_or_buffer: int = None, timeout: Optional[int] = None) -> array.array:
+        """ Return the oldest received report, waiting for up to ``timeout`` milliseconds (forever if 0 or None).
+
+        Raises usb.core.USBTimeoutError if no report was received in time, and usb.core.USBError once a transfer has
+        failed (e.g. because the device was disconnected). ``endpoint`` and ``size_or_buffer`` are ignored, they are
+        given when the reader was created. """
+        deadline = None if not timeout else time.monotonic() + timeout / 1000
+
+        while len(self.completed) == 0:
+            if self.error is not None or self._pending == 0:
+                status = LIBUSB_TRANSFER_ERROR if self.error is None else self.error
+                raise usb.core.USBError(f"Asynchronous read failed (transfer status {status})", status)
+
+            if deadline is None:
+                wait = 1.0
+            else:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    raise usb.core.USBTimeoutError("Operation timed out", None, None)
+
+            self._handle_events(wait)
+
+        return self.completed.popleft()
+
+    def close(self):
+        """ Cancel the queued transfers and free them once libusb has returned them. """
+        self._closing = True
+
+        for transfer in self._transfers:
+            self.lib.libusb_cancel_transfer(transfer)  # Fails harmlessly for transfers that are not queued
+
+        deadline = time.monotonic() + CLOSE_TIMEOUT
+        while self._pending > 0 and time.monotonic() < deadline:
+            self._handle_events(0.1)
+
+        if self._pending == 0:
+            for transfer in self._transfers:
+                self.lib.libusb_free_transfer(transfer)
+        # Otherwise libusb still owns some transfers, and leaking them is safer than freeing them
+
+        self._transfers = []
+
+    def _submit(self, transfer):
+        result = self.lib.libusb_submit_transfer(transfer)
+        if result < 0:
+            raise usb.core.USBError(f"Could not submit transfer (error {result})", result)
+
+        self._pending += 1
+
+    def _handle_events(self, seconds: float):
+        timeout = _Timeval(int(seconds), int((seconds % 1) * 1e6))
+        result = self.lib.libusb_handle_events_timeout(self.context, ctypes.byref(timeout))
+        if result < 0:
+            raise usb.core.USBError(f"Could not handle libusb events (error {result})", result)
+
+    def _on_transfer_complete(self, transfer_p):
+        # Called by libusb from _handle_events() (or from another thread handling events on the same context). Exceptions
+        # cannot propagate through libusb, so this only records the outcome.
+        self._pending -= 1
+        transfer = transfer_p.contents
+        status = transfer.status
+
+        if status == LIBUSB_TRANSFER_COMPLETED:
+            self.completed.append(array.array('B', ctypes.string_at(transfer.buffer, transfer.actual_length)))
+        elif status == LIBUSB_TRANSFER_CANCELLED:
+            return
+        elif status != LIBUSB_TRANSFER_TIMED_OUT:
+            self.error = status  # Device gone, stalled or overflowed
+            return
+
+        if self._closing:
+            return
+
+        if self.lib.libusb_submit_transfer(transfer_p) < 0:
+            self.error = LIBUSB_TRANSFER_ERROR
+        else:
+            self._pending += 1
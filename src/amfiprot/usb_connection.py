@@ -5,43 +5,108 @@ import usb.util
 import usb.backend.libusb1
 import libusb_package
 import multiprocessing as mp    # For reading and writing from/to USB devices
+import threading
+import queue
 import time
 import hashlib
 import enum
 import atexit
 from typing import List, Optional
-from .packet import Packet, PacketDestination
-from .common_payload import RequestDeviceIdPayload, ReplyDeviceIdPayload, RequestDeviceNamePayload, ReplyDeviceNamePayload
+from .packet import Packet, Header, CrcValidation, FrameError, check_frame, frame_length, is_control_frame
 from .node import Node
-from .connection import Connection
+from .receive_queue import ReceiveQueue, QueuePolicy, Notifier, DEFAULT_CAPACITY, deliver
+from .connection import (Connection, ConnectionStatistics, TransportMode, IdleStrategy, ReceiveChannels, STOP_SENTINEL,
+                         SPARE_RECEIVE_CHANNELS, REQUEST_DEVICE_ID_TEMPLATE, apply_node_update, discover_nodes,
+                         receive_packet, drain, discard_until_stop, wait_for_sync, release_receive_channels,
+                         DISCOVERY_TIMEOUT)
+from .usb_async import AsyncReader
+from .usb_identity import DeviceIdentity, HotplugMonitor, find_device
 
 USB_HID_REPORT_LENGTH = 64
+USB_OUTPUT_REPORT_ID = 1  # Packet length is only required on IN reports
+REPORT_HEADER_LENGTH = 2  # Report ID and packet length precede the packet in IN reports
+
+READ_TIMEOUT_MS = 100  # Bounds blocking reads, so the reader notices a stop request
+POLL_READ_TIMEOUT_MS = 1  # Shortest read timeout libusb accepts (0 blocks forever), used when not blocking
+TRANSMIT_POLL_INTERVAL = 0.1  # Seconds
+STOP_TIMEOUT = 2  # Seconds to wait for the writer to send what is enqueued, and for the workers to exit
+RECONNECT_INTERVAL = 1  # Seconds between attempts to find a lost device (if hotplug events are not available)
+
+_ZERO_REPORT = memoryview(bytes(USB_HID_REPORT_LENGTH))
 
 
 class USBConnection(Connection):
     """An implementation of :class:`amfiprot.Connection` used to connect to USB HID devices."""
     MAX_PAYLOAD_SIZE = 54  # 1 byte needed for CRC
 
-    def __init__(self, vendor_id: int, product_id: int, serial_number: str = None):
-        """ If no serial number is given, the first device that matches vendor_id and product_id is used. """
+    def __init__(self, vendor_id: int, product_id: int, serial_number: str = None,
+                 crc_validation: CrcValidation = CrcValidation.HEADER, mode: TransportMode = TransportMode.PROCESS,
+                 receive_ring_slots: int = 0, timestamps: bool = False, idle_strategy: IdleStrategy = IdleStrategy.BLOCK,
+                 in_transfers: int = 0, receive_queue_capacity: int = DEFAULT_CAPACITY, receive_queue_bytes: int = 0,
+                 queue_policy: QueuePolicy = QueuePolicy.DROP_OLDEST):
+        """ If no serial number is given, the first device that matches vendor_id and product_id is used.
+
+        Received frames failing ``crc_validation`` are dropped by the receive process and counted in
+        :attr:`statistics`. USB already protects each transfer with its own CRC, so by default only the Amfiprot
+        header is checked.
+
+        With ``mode=TransportMode.THREAD``, reading and writing is done by two threads in the calling process that share
+        the already opened device, instead of by two processes.
+
+        In process mode, ``receive_ring_slots`` > 0 makes received packets reach the nodes (and the global receive
+        queue) through a :class:`amfiprot.ring.SharedMemoryRing` with that many slots instead of a
+        ``multiprocessing.Queue``.
+
+        With ``timestamps`` set, the receive time of each packet is recorded in :attr:`amfiprot.Packet.timestamp`.
+
+        ``idle_strategy`` selects how the read and write workers wait for work, see :class:`amfiprot.IdleStrategy`.
+
+        With ``in_transfers`` > 0, the reader keeps that many interrupt IN transfers queued through libusb's
+        asynchronous API (see :class:`amfiprot.usb_async.AsyncReader`), so reports are not missed while Python is busy.
+        By default, one synchronous read is done at a time.
+
+        Receive queues (of nodes and subscriptions) hold up to ``receive_queue_capacity`` packets and (if not 0)
+        ``receive_queue_bytes`` bytes, and ``queue_policy`` decides what happens to packets that do not fit. See
+        :class:`amfiprot.receive_queue.ReceiveQueue`, whose settings can also be changed per queue.
+
+        :meth:`find_nodes` can be called while the connection is started. Nodes that were added, removed or re-addressed
+        are passed on to the running reader, without restarting it. """
         self.vendor_id = vendor_id
         self.product_id = product_id
         self.usb_serial_number = serial_number
+        self.crc_validation = crc_validation
+        self.mode = mode
+        self.receive_ring_slots = receive_ring_slots
+        self.timestamps = timestamps
+        self.idle_strategy = idle_strategy
+        self.in_transfers = in_transfers
+        self.receive_queue_capacity = receive_queue_capacity
+        self.receive_queue_bytes = receive_queue_bytes
+        self.queue_policy = queue_policy
+        self.statistics = ConnectionStatistics()
+        self._device_handle: Optional[UsbDeviceHandle] = None  # Shared by the threads in thread mode
 
         self.usb_device = get_matching_device(vendor_id, product_id, serial_number)
 
         if self.usb_device is None:
             raise ConnectionError("Could not connect to device!")
 
-        self.receive_process: mp.Process = None
-        self.transmit_process: mp.Process = None
+        self.device_identity = DeviceIdentity.from_device(self.usb_device)  # For finding the device again
+
         self.usb_task_read: mp.Process = None
         self.usb_task_write: mp.Process = None
+        self.usb_thread_read: threading.Thread = None
+        self.usb_thread_write: threading.Thread = None
+        self.stop_event = threading.Event() if mode == TransportMode.THREAD else mp.Event()
+        self.transmit_drained = threading.Event() if mode == TransportMode.THREAD else mp.Event()  # Set by the writer
         self.nodes: List[Node] = []
-        self.transmit_queue: mp.Queue = mp.Queue()
-        self.global_receive_queue: mp.Queue = mp.Queue()
+        self.receive_channels = ReceiveChannels()
+        self.transmit_queue: mp.Queue = self._create_queue()
+        self._global_receive_queue = None  # Created by the first access to global_receive_queue
+        self.notifier = Notifier()  # Signalled by the notifiers of all receive queues, see fileno()
+        self.discovery_queue = self.create_receive_queue()  # Receives every packet while find_nodes() runs
         self.usb_connection_lost: mp.Event = mp.Event()
-        self.node_update_queue: mp.Queue = mp.Queue()
+        self.node_update_queue: mp.Queue = self._create_queue()
 
     def __del__(self):
         try:
@@ -73,119 +138,156 @@ class USBConnection(Connection):
         return device_list
     
     def find_nodes(self) -> List[Node]:
-        # TODO: Clean this method. Implement helper functions for blocking send/receive
-
-        # Create 'request device id' packet
-        payload = RequestDeviceIdPayload()
-        packet = Packet.from_payload(payload, destination_id=PacketDestination.BROADCAST)
+        if self._workers_running():
+            nodes = self._discover_through_workers()
+        else:
+            nodes = self._discover_directly()
 
-        # Send packet via USB
-        bytes_to_transmit: array.array = array.array('B', [1])  # USB header Report ID, packet length only required on IN packets (???)
-        bytes_to_transmit.extend(packet.to_bytes())
+        if nodes_changed(nodes, self.nodes):
+            self.nodes = nodes
 
-        while len(bytes_to_transmit) < 64:
-            bytes_to_transmit.append(0)
+        self._update_or_restart()  # TX IDs may have changed even if the nodes did not
 
-        self.usb_device.write(0x1, bytes_to_transmit, 1000)
+        return self.nodes
 
-        start_time = time.time()
+    def _discover_directly(self) -> List[Node]:
+        device = self._open_device()
+        report = create_output_report()
 
-        rx_packets = []
-        while time.time() - start_time < 1:
-            data = None
+        def send(packet: Packet):
+            encode_output_report(packet, report)
+            device.write(0x1, report, 1000)
 
+        def receive(timeout: float) -> Optional[Packet]:
             try:
-                data = self.usb_device.read(0x81, 64)
+                data = device.read(0x81, USB_HID_REPORT_LENGTH, max(1, int(timeout * 1000)))
             except usb.core.USBTimeoutError:
-                #print("USB timed out while waiting for Device ID reply packets.")
-                continue
-
-            if len(data) == 0:  # Extra safe guard for Linux (or previous libusb version??)
-                continue
-
-            rx_packet = Packet(data[2:])
-            #print(rx_packet)
+                return None
 
-            if type(rx_packet.payload) == ReplyDeviceIdPayload:
-                rx_packets.append(rx_packet)
+            if len(data) == 0 or check_frame(data, REPORT_HEADER_LENGTH, self.crc_validation) != FrameError.NONE:
+                return None
 
-        nodes = []
+            return Packet(data, REPORT_HEADER_LENGTH)
 
-        for packet in rx_packets:
-            if type(packet.payload) == ReplyDeviceIdPayload:
-                uuids = [node.uuid for node in nodes]
-                if packet.payload.uuid not in uuids:
-                    node = Node(tx_id=packet.payload.tx_id, uuid=packet.payload.uuid, connection=self)
-                    nodes.append(node)
+        return discover_nodes(self, send, receive, self.nodes)
 
-        # Request device name for all found nodes
-        for node in nodes:
-            payload = RequestDeviceNamePayload()
-            packet = Packet.from_payload(payload, destination_id=node.tx_id)
+    def _discover_through_workers(self) -> List[Node]:
+        self._update_or_restart()  # Passes on nodes created since the last update
 
-            # Send packet via USB
-            bytes_to_transmit: array.array = array.array('B', [1])  # USB header Report ID, packet length only required on IN packets (???)
-            bytes_to_transmit.extend(packet.to_bytes())
+        # The reader copies every packet to the discovery queue while it is tapped
+        self.receive_channels.taps.append(self.discovery_queue)
 
-            while len(bytes_to_transmit) < 64:
-                bytes_to_transmit.append(0)
-
-            self.usb_device.write(0x1, bytes_to_transmit, 1000)
-
-            start_time = time.time()
-
-            while time.time() - start_time < 1:
-                data = None
+        try:
+            # Requests are only sent once the reader has started copying, so no reply is missed
+            drain(self.discovery_queue)
+            self._update_workers(sync=self.discovery_queue)
+            wait_for_sync(self.discovery_queue, DISCOVERY_TIMEOUT)
 
-                try:
-                    data = self.usb_device.read(0x81, 64)
-                except usb.core.USBTimeoutError:
-                    # print("USB timed out while waiting for Device ID reply packets.")
-                    continue
+            return discover_nodes(self, self.enqueue_packet,
+                                  lambda timeout: receive_packet(self.discovery_queue, timeout), self.nodes)
+        finally:
+            self.receive_channels.taps.remove(self.discovery_queue)
 
-                rx_packet = Packet(data[2:])
-                # print(rx_packet)
+    def enqueue_packet(self, packet: Packet):
+        self.transmit_queue.put(packet)
 
-                if type(rx_packet.payload) == ReplyDeviceNamePayload:
-                    node.name = rx_packet.payload.name
-                    break
+    def max_payload_size(self) -> int:
+        return self.MAX_PAYLOAD_SIZE
 
+    def create_receive_queue(self, capacity: Optional[int] = None, capacity_bytes: Optional[int] = None,
+                             policy: Optional[QueuePolicy] = None) -> ReceiveQueue:
+        """ Create a receive queue, with the capacity and policy of the connection unless given. """
+        channel = None
+        if self._workers_running() and not self._channels_transferable():
+            channel = self.receive_channels.take_spare()  # Already known by the reader process
+
+        if channel is None:
+            channel = self._new_receive_channel()
+
+        channel.capacity = self.receive_queue_capacity if capacity is None else capacity
+        channel.capacity_bytes = self.receive_queue_bytes if capacity_bytes is None else capacity_bytes
+        channel.policy = self.queue_policy if policy is None else policy
+        return channel
+
+    def _new_receive_channel(self) -> ReceiveQueue:
+        if self.mode == TransportMode.PROCESS and self.receive_ring_slots > 0:
+            from .ring import SharedMemoryRing
+            return ReceiveQueue(SharedMemoryRing(self.receive_ring_slots), evictable=False,
+                                notifier=Notifier(self.notifier))
+
+        return ReceiveQueue(self._create_queue(), notifier=Notifier(self.notifier))
+
+    def _channels_transferable(self) -> bool:
+        """ True if receive channels can be sent to the running reader through the node update queue, i.e. if it is a
+        thread (the shared state of a ReceiveQueue can only be passed to a process when it is started). """
+        return self.mode == TransportMode.THREAD
+
+    def _receive_channels_for_start(self) -> list:
+        spares = []
+        if not self._channels_transferable():
+            spares = [self._new_receive_channel() for _ in range(SPARE_RECEIVE_CHANNELS)]
+
+        drain(self.node_update_queue)  # Updates for a previous reader
+        rx_queues = self.receive_channels.reset(self.nodes, spares, [self.discovery_queue])
+        self.node_update_queue.put(self.receive_channels.update(self.nodes, True))  # Subscriptions
+        return rx_queues
+
+    def _workers_running(self) -> bool:
+        return _is_running(self.usb_thread_read) or _is_running(self.usb_task_read)
+
+    @property
+    def usb_device(self) -> Optional[usb.core.Device]:
+        """ The opened device. While the threads of thread mode are started, the device they use, which is replaced
+        when it is reconnected (and None while it is disconnected). None while the processes of process mode are
+        started, which open the device themselves. """
+        if self._device_handle is not None:
+            return self._device_handle.device
+
+        return self._usb_device
+
+    @usb_device.setter
+    def usb_device(self, device: Optional[usb.core.Device]):
+        self._usb_device = device
+
+    def _open_device(self) -> usb.core.Device:
+        """ The device, found again by identity if it was released to the I/O processes. """
+        if self.usb_device is None:
+            self.usb_device = find_device(self.device_identity)
 
-        # Restart connection if nodes list changed
-        if nodes_changed(nodes, self.nodes):
-            self.nodes = nodes
-            # Send updated node list to RX/TX processes (if started)
-            if self.receive_process is not None and self.transmit_process is not None:
-                # HACK: just restart connection using new self.nodes list
-                self.stop()
-                self.start()
-            # print("New node detected!")
+            if self.usb_device is None:
+                raise ConnectionError("Could not connect to device!")
 
-        return self.nodes
+        return self.usb_device
 
-    def enqueue_packet(self, packet: Packet):
-        self.transmit_queue.put(packet)
+    def _create_queue(self):
+        if self.mode == TransportMode.THREAD:
+            return queue.Queue()
 
-    def max_payload_size(self) -> int:
-        return self.MAX_PAYLOAD_SIZE
+        return mp.Queue()
 
     def start(self):
-        usb_device_hash = generate_device_hash(self.usb_device)
-        self.usb_device.reset()
-        usb.util.dispose_resources(self.usb_device)
-        del self.usb_device
+        if self.mode == TransportMode.THREAD:
+            self._start_threads()
+            return
+
+        device = self._open_device()
+        device.reset()
+        usb.util.dispose_resources(device)
+        self.usb_device = None  # Opened by the processes instead
 
-        atexit.register(connection_exit_handler, self)
+        atexit.register(self.stop)
 
         # Create read and write processes
         tx_ids = [node.tx_id for node in self.nodes]
-        rx_queues = [node.receive_queue for node in self.nodes]
+        rx_queues = self._receive_channels_for_start()
 
         out_conn_write, in_conn_write = mp.Pipe()   # Used by sub task to signal to main that it is ready 
         out_conn_read, in_conn_read = mp.Pipe()     # Used by sub task to signal to main that it is ready 
 
-        self.usb_task_write = mp.Process(target=usb_task_write, args=(out_conn_write, usb_device_hash, self.transmit_queue))
-        self.usb_task_read = mp.Process(target=usb_task_read, args=(out_conn_read, usb_device_hash, tx_ids, rx_queues, self.global_receive_queue, self.node_update_queue))
+        self.stop_event.clear()
+        self.transmit_drained.clear()
+        self.usb_task_write = mp.Process(target=usb_task_write, args=(out_conn_write, self.device_identity, self.transmit_queue, self.stop_event, self.idle_strategy, self.transmit_drained, self.statistics))
+        self.usb_task_read = mp.Process(target=usb_task_read, args=(out_conn_read, self.device_identity, tx_ids, rx_queues, None, self.node_update_queue, self.crc_validation, self.statistics, self.timestamps, self.stop_event, self.idle_strategy, self.in_transfers))
 
         self.usb_task_write.start()
         self.usb_task_read.start()
@@ -193,25 +295,51 @@ class USBConnection(Connection):
         in_conn_read.recv()  # Will block until something is received from usb_task_read
         in_conn_write.recv()  # Will block until something is received from usb_task_write
 
-    def stop(self):
-        # TODO: Send stop request to task and wait for acknowledge (allows outbound packets to be sent before stopping)
-
-        if self.usb_task_read is not None:
-            if self.usb_task_read.is_alive():
-                time.sleep(1)  # To allow pending tx packets to be sent
-                self.usb_task_read.terminate()
-                self.usb_task_read.join()
-
-        if self.usb_task_write is not None:
-            if self.usb_task_write.is_alive():
-                time.sleep(1)  # To allow pending tx packets to be sent
-                self.usb_task_write.terminate()
-                self.usb_task_write.join()
-
-    def refresh(self):
-        #rx_queues = [node.receive_queue for node in self.nodes]  # Cannot send queues in a queue to other process
+    def _start_threads(self):
+        atexit.register(self.stop)
+
+        # The device is already open, so both threads use it directly instead of enumerating the bus again
+        device = UsbDeviceHandle(self.device_identity, self._open_device())
+        self._device_handle = device
         tx_ids = [node.tx_id for node in self.nodes]
-        self.node_update_queue.put({'tx_ids': tx_ids})
+        rx_queues = self._receive_channels_for_start()
+
+        self.stop_event.clear()
+        self.transmit_drained.clear()
+        self.usb_thread_write = threading.Thread(target=usb_write_loop, args=(device, self.transmit_queue, self.stop_event), kwargs={'idle_strategy': self.idle_strategy, 'drained': self.transmit_drained, 'statistics': self.statistics}, daemon=True)
+        self.usb_thread_read = threading.Thread(target=usb_read_loop, args=(device, tx_ids, rx_queues, None, self.node_update_queue, self.crc_validation, self.statistics, self.stop_event), kwargs={'timestamps': self.timestamps, 'idle_strategy': self.idle_strategy, 'in_transfers': self.in_transfers}, daemon=True)
+
+        self.usb_thread_write.start()
+        self.usb_thread_read.start()
+
+    def stop(self):
+        atexit.unregister(self.stop)
+
+        writers = [self.usb_thread_write, self.usb_task_write]
+        readers = [self.usb_thread_read, self.usb_task_read]
+
+        # The writer acknowledges the sentinel once it has sent the packets enqueued before it, and then exits
+        acknowledged = True
+        if any(_is_running(writer) for writer in writers):
+            self.transmit_queue.put(STOP_SENTINEL)
+            acknowledged = self.transmit_drained.wait(STOP_TIMEOUT)
+
+        # The reader notices the event within READ_TIMEOUT_MS (replies to the last packets are still received until then)
+        self.stop_event.set()
+        _join_workers(writers + readers)
+
+        if not acknowledged:
+            discard_until_stop(self.transmit_queue)  # Not sent in time, and not to be sent after a restart either
+
+        if self._device_handle is not None:
+            self.usb_device = self._device_handle.device  # As reconnected by the threads, None if it is gone
+            self._device_handle = None
+
+    def refresh(self) -> bool:
+        if not self._workers_running():
+            return True  # The nodes are passed to the workers when they are started
+
+        return self._update_workers()
 
     def __str__(self):
         bus = self.usb_device.bus
@@ -237,131 +365,274 @@ class ConnectionState(enum.IntEnum):
     CONNECTED = 1
     DISCONNECTED = 2
 
-def usb_task_read(conn, usb_device_hash, tx_ids, rx_queues: List[mp.Queue], global_receive_queue: mp.Queue, node_update_queue: mp.Queue):
-    IN_ENDPOINT = 0x81
-    OUT_ENDPOINT = 0x01
+
+class UsbDeviceHandle:
+    """ The USB device used by the read and write loops. In thread mode, a single handle is shared by both threads, and
+    whichever loop notices that the device is gone re-acquires it (by identity) for both. """
     RETRY_LIMIT = 10
 
-    retry_count = 0
-    dev = None
+    def __init__(self, identity: Optional[DeviceIdentity], device: Optional[usb.core.Device] = None):
+        self.identity = identity
+        self.device = device
+        self._lock = threading.Lock()
+        self._monitor: Optional[HotplugMonitor] = None  # Created when the device is lost
+
+    @property
+    def state(self) -> ConnectionState:
+        return ConnectionState.DISCONNECTED if self.device is None else ConnectionState.CONNECTED
 
-    while dev is None:
-        dev = get_usb_device_by_hash(usb_device_hash)
-        state = ConnectionState.CONNECTED
+    def open(self):
+        """ Find the device by hash, raising a ConnectionError if it is not found after RETRY_LIMIT attempts. """
+        retry_count = 0
 
-        retry_count = retry_count + 1
-        if retry_count > RETRY_LIMIT and dev is None:
-            raise ConnectionError("Subprocess could not find device.")
+        while self.reconnect() is None:
+            retry_count = retry_count + 1
+            if retry_count > self.RETRY_LIMIT:
+                raise ConnectionError("Subprocess could not find device.")
 
-    tx_ids_local = tx_ids
-    rx_queues_local = rx_queues
+    def reconnect(self) -> Optional[usb.core.Device]:
+        with self._lock:
+            if self.device is None and self.identity is not None:
+                self.device = find_device(self.identity)
+
+            if self.device is not None:
+                self._close_monitor()  # Found again, so arrivals are no longer of interest
+
+            return self.device
+
+    def close(self):
+        """ Release what was acquired for reconnecting. Called by each loop when it exits. """
+        with self._lock:
+            self._close_monitor()
+
+    def _close_monitor(self):
+        # With the lock held
+        if self._monitor is not None:
+            self._monitor.close()
+            self._monitor = None
+
+    def wait_for_device(self, timeout: float = RECONNECT_INTERVAL) -> Optional[usb.core.Device]:
+        """ Reconnect, waiting for up to ``timeout`` seconds for the device to be attached if it is not there. Returns
+        as soon as the device is attached where libusb reports hotplug events. """
+        if self.reconnect() is not None:
+            return self.device
+
+        monitor = self._monitor  # May be closed meanwhile by the other loop, and then only waits for the timeout
+
+        if monitor is not None:
+            monitor.wait(timeout)
+        else:
+            time.sleep(timeout)
+
+        return self.reconnect()
+
+    def lost(self, device: usb.core.Device):
+        """ Called by a loop when an operation on ``device`` failed because the device is gone. """
+        with self._lock:
+            if self.device is device:
+                usb.util.dispose_resources(device)
+                self.device = None
+
+                # Registered before the next search, so an arrival in between is not missed
+                if self._monitor is None and self.identity is not None:
+                    self._monitor = HotplugMonitor(self.identity.vendor_id, self.identity.product_id)
+
+
+def usb_task_read(conn, device_identity: DeviceIdentity, tx_ids, rx_queues: List[mp.Queue], global_receive_queue: mp.Queue, node_update_queue: mp.Queue,
+                  crc_validation: CrcValidation = CrcValidation.HEADER, statistics: Optional[ConnectionStatistics] = None,
+                  timestamps: bool = False, stop_event=None, idle_strategy: IdleStrategy = IdleStrategy.BLOCK,
+                  in_transfers: int = 0):
+    device = UsbDeviceHandle(device_identity)
+    device.open()
 
     conn.send(0)    # Notify main process that usb_task_read is started
 
-    while True:
-        if state == ConnectionState.CONNECTED:
+    usb_read_loop(device, tx_ids, rx_queues, global_receive_queue, node_update_queue, crc_validation, statistics, stop_event,
+                  timestamps=timestamps, idle_strategy=idle_strategy, in_transfers=in_transfers)
+
+    release_receive_channels([global_receive_queue] + list(rx_queues))
+
+
+def usb_task_write(conn, device_identity: DeviceIdentity, tx_queue: mp.Queue, stop_event=None,
+                   idle_strategy: IdleStrategy = IdleStrategy.BLOCK, drained=None,
+                   statistics: Optional[ConnectionStatistics] = None):
+    device = UsbDeviceHandle(device_identity)
+    device.open()
+
+    conn.send(0)    # Notify main process that usb_task_write is started
+
+    usb_write_loop(device, tx_queue, stop_event, idle_strategy=idle_strategy, drained=drained, statistics=statistics)
+
+
+def usb_read_loop(device: UsbDeviceHandle, tx_ids, rx_queues, global_receive_queue, node_update_queue,
+                  crc_validation: CrcValidation = CrcValidation.HEADER, statistics: Optional[ConnectionStatistics] = None,
+                  stop_event=None, timeout_ms: int = READ_TIMEOUT_MS, timestamps: bool = False,
+                  idle_strategy: IdleStrategy = IdleStrategy.BLOCK, in_transfers: int = 0):
+    """ Receive packets and route them to the node queues, until ``stop_event`` is set (if given). With
+    ``IdleStrategy.BLOCK``, each read blocks for up to ``timeout_ms``, otherwise the device is polled.
+
+    Packets from ``tx_ids[i]`` go to ``rx_queues[i]``, and every packet to ``global_receive_queue`` (unless None).
+    ``rx_queues`` may contain more queues than ``tx_ids``, for nodes and subscriptions added later through
+    ``node_update_queue`` (see :func:`amfiprot.connection.apply_node_update`), which also gives each node a control
+    lane for acks, replies and status packets.
+
+    With ``in_transfers`` > 0, reports are read through an :class:`amfiprot.usb_async.AsyncReader` that keeps that many
+    transfers queued, instead of with one synchronous read at a time.
+
+    Packets are forwarded as their raw bytes (or as ``(timestamp, bytes)`` tuples if ``timestamps`` is set), see
+    :func:`amfiprot.packet.packet_from_frame`. """
+    IN_ENDPOINT = 0x81
+    SOURCE_TX_ID_INDEX = REPORT_HEADER_LENGTH + Header.HeaderIndex.SOURCE_TX_ID
+
+    channels = list(rx_queues)
+    routes = dict(zip(tx_ids, channels))  # Source TX ID to node queue
+    control_routes = routes  # Source TX ID to node control lane, see is_control_frame()
+    taps = []  # Queues receiving every packet
+    reader = None  # AsyncReader for reader_device, if in_transfers > 0
+    reader_device = None
+
+    if idle_strategy != IdleStrategy.BLOCK:
+        timeout_ms = POLL_READ_TIMEOUT_MS
+
+    while stop_event is None or not stop_event.is_set():
+        dev = device.device
 
-            # Check for tx_id change before receiving
-            if not node_update_queue.empty():
-                update = node_update_queue.get()
-                tx_ids_local = update['tx_ids']
+        if dev is not None:
+
+            # Check for node changes before receiving
+            while not node_update_queue.empty():
+                routes, control_routes, taps = apply_node_update(node_update_queue.get(), channels)
 
             # Try to receive
             try:
-                rx_data = dev.read(IN_ENDPOINT, USB_HID_REPORT_LENGTH, timeout=0)
+                if in_transfers > 0:
+                    if reader_device is not dev:  # First read, or reconnected
+                        reader = AsyncReader.from_device(dev, IN_ENDPOINT, in_transfers, USB_HID_REPORT_LENGTH)
+                        reader_device = dev
+
+                    rx_data = reader.read(IN_ENDPOINT, USB_HID_REPORT_LENGTH, timeout=timeout_ms)
+                else:
+                    rx_data = dev.read(IN_ENDPOINT, USB_HID_REPORT_LENGTH, timeout=timeout_ms)
             except usb.core.USBTimeoutError as e:
                 # print(e)
+                if idle_strategy == IdleStrategy.YIELD:
+                    time.sleep(0)
                 continue
             except usb.core.USBError as e:
                 print("USB connection lost.")
-                usb.util.dispose_resources(dev)
-                del dev
-                state = ConnectionState.DISCONNECTED
+                if reader is not None:
+                    reader.close()
+                    reader, reader_device = None, None
+                device.lost(dev)
                 continue
 
             if len(rx_data) == 0:
                 continue
 
-            rx_packet = Packet(rx_data[2:])
+            # Drop corrupt frames before they are passed to other processes
+            error = check_frame(rx_data, REPORT_HEADER_LENGTH, crc_validation)
 
-            if global_receive_queue.full():
-                print("Global receive queue full! Packet discarded.")
-            else:
-                global_receive_queue.put_nowait(
-                    rx_packet)  # TODO: What if queue is full? Should probably only keep newest packets
+            if statistics is not None:
+                statistics.count(error)
 
-            # Push packet to correct rx_queue
-            try:
-                index = tx_ids_local.index(rx_packet.source_id)  # .index returns ValueError if value not found in list
-                if rx_queues_local[index].full():
-                    print(f"RX queue [TxID {tx_ids_local[index]}] full! Packet discarded.")
-                else:
-                    rx_queues_local[index].put_nowait(rx_packet)
+            if error != FrameError.NONE:
+                continue
 
-            except ValueError:
-                # print(f"Packet TxID {rx_packet.source_id} does not match any nodes.")
-                pass
+            # Forward only the packet bytes, the Packet is created by the consumer
+            frame = rx_data[REPORT_HEADER_LENGTH:REPORT_HEADER_LENGTH + frame_length(rx_data, REPORT_HEADER_LENGTH)].tobytes()
+            if timestamps:
+                frame = (time.time(), frame)
 
-        elif state == ConnectionState.DISCONNECTED:
-            print("Reconnecting...")
+            # Frames that do not fit are handled by the queue's policy, and only counted here
+            dropped = 0 if global_receive_queue is None else deliver(global_receive_queue, frame)
 
-            dev = get_usb_device_by_hash(usb_device_hash)
+            for tap in taps:
+                dropped += deliver(tap, frame)
+
+            # Push packet to correct rx_queue, control packets to the node's control lane
+            lanes = control_routes if is_control_frame(rx_data, REPORT_HEADER_LENGTH) else routes
+            rx_queue = lanes.get(rx_data[SOURCE_TX_ID_INDEX])
+
+            if rx_queue is not None:
+                dropped += deliver(rx_queue, frame)
+
+            if dropped > 0 and statistics is not None:
+                statistics.count_queue_drops(dropped)
 
-            if dev is not None:
-                print("Connection re-established!")
-                state = ConnectionState.CONNECTED
-            else:
-                time.sleep(1)
         else:
-            raise ValueError("Invalid state in USB task.")
+            print("Reconnecting...")
 
+            if device.wait_for_device() is not None:
+                print("Connection re-established!")
 
-def usb_task_write(conn, usb_device_hash, tx_queue: mp.Queue):
-    IN_ENDPOINT = 0x81
+    if reader is not None:
+        reader.close()
+
+    device.close()
+
+
+def usb_write_loop(device: UsbDeviceHandle, tx_queue, stop_event=None, timeout_ms: int = 1000,
+                   idle_strategy: IdleStrategy = IdleStrategy.BLOCK, drained=None,
+                   statistics: Optional[ConnectionStatistics] = None):
+    """ Send enqueued packets until :data:`amfiprot.connection.STOP_SENTINEL` is dequeued or ``stop_event`` is set
+    (if given). The event ``drained`` (if given) is set when the sentinel is dequeued, i.e. once everything enqueued
+    before it has been sent. Packets that cannot be sent are counted in ``statistics`` (if given). """
     OUT_ENDPOINT = 0x01
-    RETRY_LIMIT = 10
 
-    retry_count = 0
-    dev = None
+    report = create_output_report()  # Reused for every packet
 
-    while dev is None:
-        dev = get_usb_device_by_hash(usb_device_hash)
-        state = ConnectionState.CONNECTED
+    while stop_event is None or not stop_event.is_set():
+        dev = device.device
 
-        retry_count = retry_count + 1
-        if retry_count > RETRY_LIMIT and dev is None:
-            raise ConnectionError("Subprocess could not find device.")
+        if dev is not None:
 
-    conn.send(0)    # Notify main process that usb_task_write is started
+            # Wait for the next packet (with a timeout, so stop_event is noticed)
+            try:
+                if idle_strategy == IdleStrategy.BLOCK:
+                    tx_packet = tx_queue.get(timeout=TRANSMIT_POLL_INTERVAL)
+                else:
+                    tx_packet = tx_queue.get_nowait()
+            except queue.Empty:
+                if idle_strategy == IdleStrategy.YIELD:
+                    time.sleep(0)
+                continue
 
-    while True:
-        if state == ConnectionState.CONNECTED:
+            if tx_packet is STOP_SENTINEL:
+                if drained is not None:
+                    drained.set()
+                break
 
-            # Send all pending packets
-            if not tx_queue.empty():
-                tx_packet = tx_queue.get_nowait()
+            encode_output_report(tx_packet, report)
+            try:
+                bytes_written = dev.write(OUT_ENDPOINT, report, timeout=timeout_ms)
+            except usb.core.USBError as e:  # TODO: Check disconnect in some other way before getting from tx_queue, because this drops packets!
+                if statistics is not None:
+                    statistics.count_transmit_drop()
 
-                byte_data = array.array('B', [1])
-                byte_data.extend(tx_packet.to_bytes())
-                byte_data.extend([0] * (64 - len(byte_data)))
-                try:
-                    bytes_written = dev.write(OUT_ENDPOINT, byte_data, timeout=1000)
-                except usb.core.USBError as e:  # TODO: Check disconnect in some other way before getting from tx_queue, because this drops packets!
-                    print(f"Could not send packet ({e})")
-                    continue
+                if not isinstance(e, usb.core.USBTimeoutError):
+                    device.lost(dev)
 
-        elif state == ConnectionState.DISCONNECTED:
+        else:
             print("Reconnecting...")
 
-            dev = get_usb_device_by_hash(usb_device_hash)
-
-            if dev is not None:
+            if device.wait_for_device() is not None:
                 print("Connection re-established!")
-                state = ConnectionState.CONNECTED
-            else:
-                time.sleep(1)
-        else:
-            raise ValueError("Invalid state in USB task.")
+
+    device.close()
+
+
+def create_output_report() -> array.array:
+    """ Allocate an output report buffer to be reused with :func:`encode_output_report`. An array.array('B') is used
+    since pyusb passes it on to libusb without converting it. """
+    report = array.array('B', bytes(USB_HID_REPORT_LENGTH))
+    report[0] = USB_OUTPUT_REPORT_ID
+    return report
+
+
+def encode_output_report(packet: Packet, report: array.array):
+    """ Write ``packet`` into ``report`` after the report ID and zero the rest of the report. """
+    end = 1 + packet.encode_into(report, 1)
+    memoryview(report)[end:] = _ZERO_REPORT[end:]
 
 
 def connect_usb(vendor_id, product_id, serial_number=None):
@@ -487,5 +758,18 @@ def linux_usb_workaround(device):
                 device.detach_kernel_driver(i)
 
 
-def connection_exit_handler(connection):
-    connection.stop()
+def _is_running(worker) -> bool:
+    return worker is not None and worker.is_alive() and worker is not threading.current_thread()
+
+
+def _join_workers(workers):
+    """ Wait up to STOP_TIMEOUT for each thread or process to exit, and terminate processes that do not. """
+    for worker in workers:
+        if not _is_running(worker):
+            continue
+
+        worker.join(STOP_TIMEOUT)
+
+        if isinstance(worker, mp.Process) and worker.is_alive():
+            worker.terminate()
+            worker.join()
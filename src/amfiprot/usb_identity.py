@@ -0,0 +1,175 @@
+"""
+Finding a USB device again after it was disconnected.
+
+:class:`DeviceIdentity` is read from the device once, when the connection is created. To find the device again, only
+devices with the same vendor and product ID (which pyusb knows from enumeration, without any I/O) are considered,
+the one at the same bus and port path is tried first, and string descriptors (one control transfer each) are only read
+from those candidates, serial number first.
+
+:class:`HotplugMonitor` reports when a matching device is attached, through libusb's hotplug callbacks, so the
+connection can reconnect as soon as the device is back instead of polling the bus. Where libusb does not support
+hotplug (e.g. on Windows), it falls back to waiting for a fixed interval.
+"""
+import ctypes
+import threading
+import time
+from typing import Optional, Tuple
+
+import usb.core
+import usb.util
+import usb.backend.libusb1
+import libusb_package
+from .usb_async import _Timeval
+
+LIBUSB_CAP_HAS_HOTPLUG = 0x0001
+LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED = 0x01
+LIBUSB_HOTPLUG_MATCH_ANY = -1
+
+_hotplug_callback_fn = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+
+
+class DeviceIdentity:
+    """ Identifies a USB device across reconnects by vendor ID, product ID, manufacturer, product and serial number.
+    ``bus`` and ``port_numbers`` are where the device was last seen, and are only used to decide which candidate to
+    check first. Can be pickled, so it can be passed to the connection's I/O processes. """
+    __slots__ = ('vendor_id', 'product_id', 'manufacturer', 'product', 'serial_number', 'bus', 'port_numbers')
+
+    def __init__(self, vendor_id: int, product_id: int, manufacturer: Optional[str] = None, product: Optional[str] = None,
+                 serial_number: Optional[str] = None, bus: Optional[int] = None, port_numbers: Optional[Tuple[int, ...]] = None):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.manufacturer = manufacturer
+        self.product = product
+        self.serial_number = serial_number
+        self.bus = bus
+        self.port_numbers = port_numbers
+
+    @classmethod
+    def from_device(cls, device: usb.core.Device) -> 'DeviceIdentity':
+        """ Read the identity of ``device``, including its string descriptors. """
+        return cls(device.idVendor, device.idProduct, device.manufacturer, device.product, device.serial_number,
+                   device.bus, _port_numbers(device))
+
+    def matches(self, device: usb.core.Device) -> bool:
+        """ Compare with ``device``, reading string descriptors only if vendor and product ID match. """
+        if device.idVendor != self.vendor_id or device.idProduct != self.product_id:
+            return False
+
+        return (device.serial_number == self.serial_number and device.product == self.product
+                and device.manufacturer == self.manufacturer)
+
+    def at_same_port(self, device: usb.core.Device) -> bool:
+        return device.bus == self.bus and _port_numbers(device) == self.port_numbers
+
+    def __eq__(self, other):
+        return isinstance(other, DeviceIdentity) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        return self.vendor_id, self.product_id, self.manufacturer, self.product, self.serial_number
+
+    def __str__(self):
+        return f"{self.product} ({self.manufacturer}) VID=0x{self.vendor_id:04X}, PID=0x{self.product_id:04X}, "\
+               f"SN={self.serial_number}"
+
+
+def find_device(identity: DeviceIdentity, backend=None) -> Optional[usb.core.Device]:
+    """ Find the device with ``identity`` on the bus, or return None. """
+    if backend is None:
+        backend = usb.backend.libusb1.get_backend(find_library=libusb_package.find_library)
+
+    candidates = list(usb.core.find(find_all=True, idVendor=identity.vendor_id, idProduct=identity.product_id, backend=backend))
+    candidates.sort(key=lambda device: not identity.at_same_port(device))
+
+    for device in candidates:
+        try:
+            if identity.matches(device):
+                return device
+        except (ValueError, NotImplementedError, usb.core.USBError):
+            pass  # Strings could not be read, e.g. because the device is still being set up
+
+        usb.util.dispose_resources(device)  # Opened for reading the strings
+
+    return None
+
+
+def _port_numbers(device: usb.core.Device) -> Optional[Tuple[int, ...]]:
+    try:
+        return device.port_numbers
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+class HotplugMonitor:
+    """ Waits for a device with ``vendor_id`` and ``product_id`` to be attached.
+
+    ``lib`` and ``context`` are the libusb library (``ctypes.CDLL``) and context that are used for finding the device,
+    by default those of pyusb's libusb1 backend. libusb delivers hotplug events while events are handled on the
+    context, which :meth:`wait` does. """
+    def __init__(self, vendor_id: int, product_id: int, lib=None, context=None):
+        if lib is None:
+            backend = usb.backend.libusb1.get_backend(find_library=libusb_package.find_library)
+            lib, context = backend.lib, backend.ctx
+
+        self.lib = lib
+        self.context = context
+        self.arrived = threading.Event()
+        self._callback = _hotplug_callback_fn(self._on_hotplug)  # Must outlive the registration
+        self._handle = None
+
+        if self._hotplug_supported():
+            handle = ctypes.c_int()
+            result = lib.libusb_hotplug_register_callback(context, LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED, 0, vendor_id,
+                                                          product_id, LIBUSB_HOTPLUG_MATCH_ANY, self._callback, None,
+                                                          ctypes.byref(handle))
+            if result == 0:
+                self._handle = handle
+
+    @property
+    def supported(self) -> bool:
+        """ True if arrivals are reported by libusb, False if :meth:`wait` only waits for the timeout. """
+        return self._handle is not None
+
+    def wait(self, timeout: float) -> bool:
+        """ Wait for up to ``timeout`` seconds for a matching device to be attached. Returns True if one was attached
+        since the previous call (or if hotplug is not supported, after waiting for the full timeout). """
+        if not self.supported:
+            time.sleep(timeout)
+            return True
+
+        deadline = time.monotonic() + timeout
+        remaining = timeout
+
+        while not self.arrived.is_set() and remaining > 0:
+            interval = min(remaining, 0.1)
+            self.lib.libusb_handle_events_timeout(self.context, ctypes.byref(_Timeval(0, int(interval * 1e6))))
+            remaining = deadline - time.monotonic()
+
+        arrived = self.arrived.is_set()
+        self.arrived.clear()
+        return arrived
+
+    def close(self):
+        if self._handle is not None:
+            self.lib.libusb_hotplug_deregister_callback(self.context, self._handle)
+            self._handle = None
+
+    def _hotplug_supported(self) -> bool:
+        try:
+            self.lib.libusb_has_capability.argtypes = [ctypes.c_uint32]
+            self.lib.libusb_hotplug_register_callback.argtypes = [
+                ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                _hotplug_callback_fn, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+            self.lib.libusb_hotplug_deregister_callback.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            self.lib.libusb_handle_events_timeout.argtypes = [ctypes.c_void_p, ctypes.POINTER(_Timeval)]
+        except AttributeError:
+            return False  # libusb older than 1.0.16
+
+        return bool(self.lib.libusb_has_capability(LIBUSB_CAP_HAS_HOTPLUG))
+
+    def _on_hotplug(self, context, device, event, user_data) -> int:
+        # Called by libusb while handling events. No I/O on the device is allowed here.
+        self.arrived.set()
+        return 0  # Stay registered
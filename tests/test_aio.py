@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from amfiprot import aio, AsyncDevice
+
+from .test_node import create_node, data_frame, control_frame, value_of
+
+TIMEOUT = 2  # Seconds to wait for a coroutine that should be woken
+
+
+def offer_later(lane, *frames, delay: float = 0.02) -> threading.Thread:
+    """ Offer ``frames`` to ``lane`` from another thread after ``delay`` seconds. """
+    def offer():
+        time.sleep(delay)
+        for frame in frames:
+            lane.offer(frame)
+
+    producer = threading.Thread(target=offer)
+    producer.start()
+    return producer
+
+
+class TestAsyncDevice(unittest.TestCase):
+    def test_woken_by_other_thread(self):
+        async def main(notifiers: bool):
+            device = AsyncDevice(create_node(notifiers))
+            producer = offer_later(device.node.receive_queue, data_frame(7))
+
+            packet = await asyncio.wait_for(device.get_packet(), TIMEOUT)
+            producer.join()
+            return packet
+
+        for notifiers in (True, False):
+            with self.subTest(notifiers=notifiers):
+                self.assertEqual(value_of(asyncio.run(main(notifiers))), 7)
+
+    def test_waits_on_descriptor(self):
+        async def main():
+            device = AsyncDevice(create_node())
+            waiting = asyncio.ensure_future(device.get_packet())
+            await asyncio.sleep(0.01)
+
+            self.assertEqual(list(aio._waiters[asyncio.get_running_loop()]), [device.node.fileno()])
+
+            device.node.control_queue.offer(control_frame(8))
+            packet = await asyncio.wait_for(waiting, TIMEOUT)
+
+            self.assertEqual(aio._waiters[asyncio.get_running_loop()], {})
+            return packet
+
+        self.assertEqual(value_of(asyncio.run(main())), 8)
+
+    def test_every_waiter_woken(self):
+        async def main():
+            device = AsyncDevice(create_node())
+            producer = offer_later(device.node.receive_queue, data_frame(1), data_frame(2))
+
+            packets = await asyncio.wait_for(asyncio.gather(device.get_packet(), device.get_packet()), TIMEOUT)
+            producer.join()
+            return packets
+
+        self.assertEqual(sorted(value_of(packet) for packet in asyncio.run(main())), [1, 2])
+
+    def test_timeout(self):
+        async def main():
+            device = AsyncDevice(create_node())
+
+            start = time.monotonic()
+            self.assertIsNone(await device.get_packet(timeout_ms=30))
+            self.assertGreaterEqual(time.monotonic() - start, 0.03)
+
+            self.assertEqual(aio._waiters[asyncio.get_running_loop()], {})
+
+        asyncio.run(main())
+
+    def test_stream(self):
+        async def main():
+            device = AsyncDevice(create_node())
+            producer = offer_later(device.node.receive_queue, *(data_frame(value) for value in range(5)))
+            values = []
+
+            async def consume():
+                async for packet in device.stream(max_packets=2):
+                    values.append(value_of(packet))
+                    if len(values) == 5:
+                        return
+
+            await asyncio.wait_for(consume(), TIMEOUT)
+            producer.join()
+            return values
+
+        self.assertEqual(asyncio.run(main()), [0, 1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+
+from amfiprot import payload_registry
+from amfiprot.common_payload import *
+from amfiprot.payload import PayloadType, UndefinedPayload
+
+UUID = 0x0102030405060708090A0B0C
+
+# (payload, encoding) as written by the encoders of the 0.1.10 release, except where noted
+GOLDEN = [
+    (RequestDeviceIdPayload(), '00'),
+    (ReplyDeviceIdPayload(5, UUID), '01 05 04030201 08070605 0c0b0a09'),
+    (SetTxIdPayload(6, UUID), '02 06 04030201 08070605 0c0b0a09'),
+    (RequestFirmwareVersionPayload(), '03'),
+    (ReplyFirmwareVersionPayload(1, 2, 3, 4), '04 01000000 02000000 03000000 04000000'),
+    (RequestFirmwareVersionPerIdPayload(2), '1c 02'),
+    # 0.1.10 wrote the ID of REPLY_FIRMWARE_VERSION (0x04)
+    (ReplyFirmwareVersionPerIdPayload(1, 2, 3, 4, 2), '1d 01000000 02000000 03000000 04000000 02'),
+    (DebugOutputPayload('hello'), '20 68656c6c6f00'),
+    (RequestDeviceNamePayload(), '08'),
+    (ReplyDeviceNamePayload('Sensor'), '09 53656e736f7200'),
+    (RebootPayload(), '21'),
+    (ResetParameterPayload(3), '24 03'),
+    (RequestCategoryCountPayload(), '1a'),
+    # 0.1.10 wrote a 2 byte count, but decoded (and reported the length of) a 1 byte count
+    (ReplyCategoryCountPayload(7), '1b 07'),
+    (RequestConfigurationCategoryPayload(4), '16 04'),
+    (ReplyConfigurationCategory(4, 'General'), '17 04 47656e6572616c00'),
+    (RequestConfigurationNameUidPayload(1, 0x0203), '11 01 0302'),
+    # 0.1.10 wrote a 2 byte UID, but decoded (and reported the length of) a 4 byte UID
+    (ReplyConfigurationNameUidPayload('Gain', 0x1234, 0x0203, 1), '12 0302 01 34120000 4761696e00'),
+    (RequestConfigurationValueCountPayload(1), '18 01'),
+    (ReplyConfigurationValueCountPayload(1, 0x0102), '19 01 0201'),
+    (RequestConfigurationValueUidPayload(0x01020304), '13 04030201'),
+    # 0.1.10 failed to encode this, the layout is the one it decoded
+    (ReplyConfigurationValueUidPayload(0x01020304, 1000, ConfigValueType.UINT16), '14 04030201 06 e803'),
+    (LoadDefaultConfigurationPayload(), '0f'),
+    (SaveAsDefaultConfigurationPayload(UUID), '10 04030201 08070605 0c0b0a09'),
+    (FirmwareStartPayload(1), '05 01'),
+    (FirmwareDataPayload([1, 2, 3, 4], 1), '06 01 01020304'),
+    (FirmwareEndPayload(1), '07 01'),
+    (SetConfigurationValueUidPayload(0x01020304, -5, ConfigValueType.INT32), '15 04030201 08 fbffffff'),
+    (RequestProcedureSpec(3, 0x01020304), '30 0300 04030201'),
+    (ReplyProcedureSpec(3, 0x01020304, ConfigValueType.UINT8, ConfigValueType.INT32, 0, 0, 0, 0, 'run'),
+     '31 0300 04030201 03 08 00 00 00 00 72756e'),
+    (RequestProcedureCall(0x01020304, ConfigValueType.UINT32, 7, ConfigValueType.INT8, 2),
+     '32 04030201 0a 0700000000000000 02 0200000000000000' + '00' * 27),
+    (ReplyProcedureCall(0x01020304, ConfigValueType.UINT32, 9), '33 04030201 0a 0900000000000000'),
+]
+
+
+def golden_bytes(encoding: str) -> bytes:
+    return bytes.fromhex(encoding.replace(' ', ''))
+
+
+class TestGoldenBytes(unittest.TestCase):
+    def test_encode(self):
+        for payload, encoding in GOLDEN:
+            with self.subTest(payload=type(payload).__name__):
+                self.assertEqual(bytes(payload.to_bytes()), golden_bytes(encoding))
+                self.assertEqual(len(payload), len(golden_bytes(encoding)))
+
+    def test_decode(self):
+        for payload, encoding in GOLDEN:
+            with self.subTest(payload=type(payload).__name__):
+                decoded = payload_registry.create(PayloadType.COMMON, golden_bytes(encoding))
+
+                self.assertIs(type(decoded), type(payload))
+                self.assertEqual(decoded.to_dict(), payload.to_dict())
+                self.assertEqual(bytes(decoded.to_bytes()), golden_bytes(encoding))
+
+    def test_payload_ids(self):
+        for payload, encoding in GOLDEN:
+            with self.subTest(payload=type(payload).__name__):
+                self.assertEqual(payload.PAYLOAD_ID, golden_bytes(encoding)[0])
+                self.assertIs(payload_ids[payload.PAYLOAD_ID], type(payload))
+
+    def test_to_dict_payload_id(self):
+        for payload in (RequestDeviceIdPayload(), RequestDeviceNamePayload(), RebootPayload(),
+                        RequestCategoryCountPayload()):
+            with self.subTest(payload=type(payload).__name__):
+                self.assertIs(type(payload.to_dict()['payload_id']), int)
+
+
+class TestConfigValues(unittest.TestCase):
+    def test_round_trip(self):
+        for data_type, value in [(ConfigValueType.BOOL, True), (ConfigValueType.INT8, -2),
+                                 (ConfigValueType.UINT16, 1000), (ConfigValueType.INT64, -(1 << 40)),
+                                 (ConfigValueType.DOUBLE, 0.5), (ConfigValueType.CHAR, 'abc')]:
+            with self.subTest(data_type=data_type):
+                self.assertEqual(decode_config_value(data_type, encode_config_value(value, data_type)), value)
+
+    def test_char_value_not_str_or_bytes(self):
+        with self.assertRaises(TypeError):
+            encode_config_value(3, ConfigValueType.CHAR)
+
+        with self.assertRaises(TypeError):
+            ReplyConfigurationValueUidPayload(0x01020304, 3, ConfigValueType.CHAR).to_bytes()
+
+    def test_unknown_type(self):
+        with self.assertRaisesRegex(ValueError, '99'):
+            encode_config_value(1, 99)
+
+        for payload in (SetConfigurationValueUidPayload(0x01020304, 1, 99),
+                        ReplyConfigurationValueUidPayload(0x01020304, 1, 99),
+                        RequestProcedureCall(0x01020304, 99, 1)):
+            with self.subTest(payload=type(payload).__name__):
+                with self.assertRaisesRegex(ValueError, '99'):
+                    payload.to_bytes()
+
+
+class TestUnknownPayloadId(unittest.TestCase):
+    def test_undefined_payload(self):
+        payload = payload_registry.create(PayloadType.COMMON, b'\x7f\x01\x02')
+
+        self.assertIsInstance(payload, UndefinedPayload)
+        self.assertEqual(payload.type, PayloadType.COMMON)
+        self.assertEqual(bytes(payload.to_bytes()), b'\x7f\x01\x02')
+
+    def test_create_common_payload_raises(self):
+        with self.assertRaises(ValueError):
+            create_common_payload(b'\x7f\x01\x02')
+
+
+if __name__ == '__main__':
+    unittest.main()
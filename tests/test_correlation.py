@@ -0,0 +1,123 @@
+import queue
+import unittest
+
+from amfiprot import Packet, StructPayload, Field
+from amfiprot.common_payload import (RequestFirmwareVersionPerIdPayload, ReplyFirmwareVersionPerIdPayload,
+                                     RequestProcedureSpec, ReplyProcedureSpec)
+from amfiprot.correlation import Correlator
+from amfiprot.packet import PacketType
+
+TIMEOUT = 1  # Seconds to wait for a future that should be resolved
+
+
+class SamplePayload(StructPayload):
+    PAYLOAD_TYPE = 0x42
+    PAYLOAD_ID = 0x01
+    FIELDS = (Field('value', 'B'),)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def frame(payload, packet_type: PacketType = PacketType.REPLY, packet_number: int = 0) -> bytes:
+    return Packet.from_payload(payload, source_id=3, packet_type=packet_type, packet_number=packet_number).to_bytes()
+
+
+def procedure_spec(index: int, uid: int) -> ReplyProcedureSpec:
+    return ReplyProcedureSpec(index, uid, 0, 0, 0, 0, 0, 0, f"procedure {index}")
+
+
+class TestCorrelator(unittest.TestCase):
+    def setUp(self):
+        self.control_queue = queue.Queue()
+        self.correlator = Correlator(self.control_queue)
+
+    def test_replies_matched_by_key(self):
+        first = self.correlator.expect(RequestFirmwareVersionPerIdPayload(1), 0)
+        second = self.correlator.expect(RequestFirmwareVersionPerIdPayload(2), 1)
+
+        self.control_queue.put(frame(ReplyFirmwareVersionPerIdPayload(2, 0, 0, 0, 2)))
+        self.control_queue.put(frame(ReplyFirmwareVersionPerIdPayload(1, 0, 0, 0, 1)))
+
+        self.assertEqual(first.result(TIMEOUT).payload.fw_version['major'], 1)
+        self.assertEqual(second.result(TIMEOUT).payload.fw_version['major'], 2)
+        self.assertEqual(self.correlator.outstanding(), 0)
+
+    def test_procedure_spec_matched_by_index_without_uid(self):
+        first = self.correlator.expect(RequestProcedureSpec(1), 0)
+        second = self.correlator.expect(RequestProcedureSpec(2), 1)
+
+        self.control_queue.put(frame(procedure_spec(2, 0x200)))
+        self.control_queue.put(frame(procedure_spec(1, 0x100)))
+
+        self.assertEqual(first.result(TIMEOUT).payload.RPC_UID, 0x100)
+        self.assertEqual(second.result(TIMEOUT).payload.RPC_UID, 0x200)
+
+    def test_procedure_spec_matched_by_uid(self):
+        future = self.correlator.expect(RequestProcedureSpec(0, 0x200), 0)
+
+        self.control_queue.put(frame(procedure_spec(1, 0x100)))
+        self.control_queue.put(frame(procedure_spec(2, 0x200)))
+
+        self.assertEqual(future.result(TIMEOUT).payload.RPC_Index, 2)
+        self.assertEqual(self.correlator.get(timeout_ms=1000).payload.RPC_UID, 0x100)
+
+    def test_ack_matched_by_packet_number(self):
+        future = self.correlator.expect(SamplePayload(1), 7, PacketType.REQUEST_ACK)
+
+        self.control_queue.put(frame(SamplePayload(1), PacketType.ACK, packet_number=6))
+        self.control_queue.put(frame(SamplePayload(1), PacketType.ACK, packet_number=7))
+
+        self.assertEqual(future.result(TIMEOUT).header.packet_number, 7)
+        self.assertEqual(self.correlator.get(timeout_ms=1000).header.packet_number, 6)
+
+    def test_unknown_reply_raises(self):
+        with self.assertRaises(ValueError):
+            self.correlator.expect(SamplePayload(1), 0)
+
+    def test_timeout(self):
+        future = self.correlator.expect(RequestFirmwareVersionPerIdPayload(1), 0, timeout_ms=20)
+
+        with self.assertRaises(TimeoutError):
+            future.result(TIMEOUT)
+
+        self.assertEqual(self.correlator.outstanding(), 0)
+
+    def test_late_reply_unmatched(self):
+        future = self.correlator.expect(RequestFirmwareVersionPerIdPayload(1), 0, timeout_ms=20)
+        self.assertIsInstance(future.exception(TIMEOUT), TimeoutError)
+
+        self.control_queue.put(frame(ReplyFirmwareVersionPerIdPayload(1, 0, 0, 0, 1)))
+
+        self.assertEqual(self.correlator.get(timeout_ms=1000).payload.fw_version['major'], 1)
+
+    def test_cancelled_request_not_answered(self):
+        cancelled = self.correlator.expect(RequestFirmwareVersionPerIdPayload(1), 0, timeout_ms=None)
+        waiting = self.correlator.expect(RequestFirmwareVersionPerIdPayload(1), 1)
+        self.assertTrue(cancelled.cancel())
+
+        self.control_queue.put(frame(ReplyFirmwareVersionPerIdPayload(1, 0, 0, 0, 1)))
+
+        self.assertEqual(waiting.result(TIMEOUT).payload.fw_version['major'], 1)
+        self.assertTrue(cancelled.cancelled())
+        self.assertEqual(self.correlator.outstanding(), 0)
+
+    def test_undecodable_reply_unmatched(self):
+        future = self.correlator.expect(RequestFirmwareVersionPerIdPayload(1), 0)
+        truncated = bytearray(frame(ReplyFirmwareVersionPerIdPayload(1, 0, 0, 0, 1)))
+        truncated[0] = 3  # Payload length, too short for the reply
+        self.control_queue.put(bytes(truncated))
+        self.control_queue.put(frame(ReplyFirmwareVersionPerIdPayload(1, 0, 0, 0, 1)))
+
+        self.assertEqual(future.result(TIMEOUT).payload.fw_version['major'], 1)
+        self.assertIsNotNone(self.correlator.get(timeout_ms=1000))
+
+    def test_get_without_requests(self):
+        self.control_queue.put(frame(SamplePayload(5), PacketType.NO_ACK))
+
+        self.assertEqual(self.correlator.get().payload_type, SamplePayload.PAYLOAD_TYPE)
+        self.assertIsNone(self.correlator.get(timeout_ms=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
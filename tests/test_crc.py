@@ -0,0 +1,66 @@
+import array
+import unittest
+
+from amfiprot.crc import CRC8_POLYNOMIAL, CRC8_TABLE, Crc8, crc8, crc8_range, crc8_batch
+
+# (data, CRC) of the 0x12F polynomial without reflection, initial value or final XOR (also known as CRC-8/OPENSAFETY)
+VECTORS = [
+    (b'', 0x00),
+    (b'\x00', 0x00),
+    (b'\x01', 0x2F),
+    (b'\x80', 0xE3),
+    (b'\xff', 0x42),
+    (b'123456789', 0x3E),  # Check value of the catalogue of CRC algorithms
+    (bytes.fromhex('010000000003'), 0x25),  # Header of a firmware version request to TX ID 3
+    (bytes.fromhex('03'), 0x71),  # Its payload
+]
+
+
+def bitwise_crc8(data) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC8_POLYNOMIAL) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class TestCrc8(unittest.TestCase):
+    def test_vectors(self):
+        for data, crc in VECTORS:
+            with self.subTest(data=data):
+                self.assertEqual(crc8(data), crc)
+                self.assertEqual(crc8(bytearray(data)), crc)
+                self.assertEqual(crc8(array.array('B', data)), crc)
+                self.assertEqual(Crc8(data).crc, crc)
+
+    def test_table(self):
+        self.assertEqual(list(CRC8_TABLE), [bitwise_crc8([byte]) for byte in range(256)])
+
+    def test_range_and_batch(self):
+        data = bytes(range(64))
+
+        for start, stop in [(0, 64), (2, 8), (9, 9), (10, 63)]:
+            with self.subTest(start=start, stop=stop):
+                self.assertEqual(crc8_range(data, start, stop), bitwise_crc8(data[start:stop]))
+
+        buffers = [data, bytearray(b'123456789'), array.array('B', [0xFF] * 5)]
+        self.assertEqual(crc8_batch(buffers), [bitwise_crc8(buffer) for buffer in buffers])
+        self.assertEqual(crc8_batch(buffers, 1, 4), [bitwise_crc8(buffer[1:4]) for buffer in buffers])
+
+    def test_incremental(self):
+        crc = Crc8(b'1234')
+        copy = crc.copy()
+        crc.update(b'5678').update_byte(ord('9'))
+
+        self.assertEqual(crc.crc, 0x3E)
+        self.assertEqual(crc.digest(), b'\x3e')
+        self.assertEqual(crc.hexdigest(), '3E')
+        self.assertEqual(crc8(b'56789', copy.crc), 0x3E)
+
+        crc.reset()
+        self.assertEqual(crc.crc, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
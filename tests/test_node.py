@@ -0,0 +1,204 @@
+import io
+import queue
+import select
+import threading
+import time
+import unittest
+
+from amfiprot import Packet, Node, StructPayload, Field
+from amfiprot.connection import Connection, apply_node_update
+from amfiprot.packet import PacketType
+from amfiprot.receive_queue import ReceiveQueue, Notifier
+
+TX_ID = 3
+
+
+class SamplePayload(StructPayload):
+    PAYLOAD_TYPE = 0x42
+    PAYLOAD_ID = 0x01
+    FIELDS = (Field('value', 'B'),)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class QueueConnection(Connection):
+    """ Creates receive queues wrapping a queue.Queue, with notifiers if ``notifiers``, and has no I/O. """
+    def __init__(self, notifiers: bool = True):
+        self.notifier = Notifier() if notifiers else None
+        self.nodes = []
+
+    def find_nodes(self):
+        return []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def refresh(self) -> bool:
+        return True
+
+    def enqueue_packet(self, packet: Packet):
+        pass
+
+    def create_receive_queue(self, capacity=None, capacity_bytes=None, policy=None):
+        notifier = Notifier(self.notifier) if self.notifier is not None else None
+        return ReceiveQueue(queue.Queue(), notifier=notifier)
+
+    def max_payload_size(self) -> int:
+        return 64
+
+
+def data_frame(value: int) -> bytes:
+    return Packet.from_payload(SamplePayload(value), source_id=TX_ID).to_bytes()
+
+
+def control_frame(value: int) -> bytes:
+    return Packet.from_payload(SamplePayload(value), source_id=TX_ID, packet_type=PacketType.REPLY).to_bytes()
+
+
+def value_of(packet: Packet) -> int:
+    return packet.payload_bytes[1]  # After the payload ID
+
+
+def create_node(notifiers: bool = True) -> Node:
+    node = Node(TX_ID, 0, QueueConnection(notifiers))
+    # Chain the control lane's notifier to the data lane's, as the readers do
+    apply_node_update({'routes': {TX_ID: 0}, 'control_routes': {TX_ID: 1}}, [node.receive_queue, node.control_queue])
+    return node
+
+
+def readable(node: Node) -> bool:
+    return len(select.select([node], [], [], 0)[0]) > 0
+
+
+class TestGetPacket(unittest.TestCase):
+    def test_not_blocking(self):
+        node = create_node()
+
+        self.assertIsNone(node.get_packet())
+
+        node.receive_queue.offer(data_frame(1))
+        self.assertEqual(value_of(node.get_packet()), 1)
+
+    def test_timeout(self):
+        for notifiers in (True, False):
+            with self.subTest(notifiers=notifiers):
+                node = create_node(notifiers)
+
+                start = time.monotonic()
+                self.assertIsNone(node.get_packet(blocking=True, timeout_ms=30))
+                elapsed = time.monotonic() - start
+
+                self.assertGreaterEqual(elapsed, 0.03)
+                self.assertLess(elapsed, 0.5)
+
+    def test_woken_by_either_lane(self):
+        for notifiers in (True, False):
+            for lane in ('receive_queue', 'control_queue'):
+                with self.subTest(notifiers=notifiers, lane=lane):
+                    node = create_node(notifiers)
+                    producer = threading.Timer(0.02, getattr(node, lane).offer, (control_frame(7),))
+                    producer.start()
+
+                    packet = node.get_packet(blocking=True, timeout_ms=2000)
+                    producer.join()
+
+                    self.assertEqual(value_of(packet), 7)
+
+    def test_control_lane_first(self):
+        node = create_node()
+        node.receive_queue.offer(data_frame(1))
+        node.control_queue.offer(control_frame(2))
+
+        self.assertEqual(value_of(node.get_packet(blocking=True)), 2)
+        self.assertEqual(value_of(node.get_packet(blocking=True)), 1)
+        self.assertIsNone(node.get_packet())
+
+
+class TestGetPackets(unittest.TestCase):
+    def setUp(self):
+        self.node = create_node()
+
+        for value in range(5):
+            self.node.receive_queue.offer(data_frame(value))
+        for value in range(10, 12):
+            self.node.control_queue.offer(control_frame(value))
+
+    def test_max_packets(self):
+        self.assertEqual([value_of(packet) for packet in self.node.get_packets(4)], [10, 11, 0, 1])
+        self.assertEqual([value_of(packet) for packet in self.node.get_packets(4)], [2, 3, 4])
+        self.assertEqual(self.node.get_packets(4), [])
+
+    def test_drain_rearms_when_packets_left(self):
+        self.assertTrue(readable(self.node))
+
+        self.assertEqual(len(self.node.drain(4)), 4)
+        self.assertTrue(readable(self.node))
+
+        self.assertEqual(len(self.node.drain(4)), 3)
+        self.assertFalse(readable(self.node))
+
+    def test_drain_exactly_all(self):
+        self.assertEqual(len(self.node.drain(7)), 7)
+
+        self.assertTrue(readable(self.node))  # Maybe more than max_packets, so signalled again
+        self.assertEqual(self.node.drain(7), [])
+        self.assertFalse(readable(self.node))
+
+
+class TestFileno(unittest.TestCase):
+    def test_select_woken_by_other_thread(self):
+        for lane in ('receive_queue', 'control_queue'):
+            with self.subTest(lane=lane):
+                node = create_node()
+                producer = threading.Timer(0.02, getattr(node, lane).offer, (control_frame(7),))
+                producer.start()
+
+                readable_nodes, _, _ = select.select([node], [], [], 2)
+                producer.join()
+
+                self.assertEqual(readable_nodes, [node])
+                self.assertEqual([value_of(packet) for packet in node.drain()], [7])
+                self.assertFalse(readable(node))
+
+    def test_drain_rearms_for_later_packets(self):
+        node = create_node()
+        node.receive_queue.offer(data_frame(1))
+        node.drain()
+
+        node.receive_queue.offer(data_frame(2))
+
+        self.assertTrue(readable(node))
+        self.assertEqual([value_of(packet) for packet in node.drain()], [2])
+
+    def test_connection(self):
+        node = create_node()
+        connection = node.connection
+        connection.nodes.append(node)
+        producer = threading.Timer(0.02, node.receive_queue.offer, (data_frame(3),))
+        producer.start()
+
+        readable_connections, _, _ = select.select([connection], [], [], 2)
+        producer.join()
+
+        self.assertEqual(readable_connections, [connection])
+        self.assertEqual([value_of(packet) for packet in connection.drain()], [3])
+        self.assertEqual(len(select.select([connection], [], [], 0)[0]), 0)
+
+    def test_without_notifiers(self):
+        node = create_node(notifiers=False)
+
+        with self.assertRaises(io.UnsupportedOperation):
+            node.fileno()
+        with self.assertRaises(io.UnsupportedOperation):
+            node.connection.fileno()
+
+        node.receive_queue.offer(data_frame(1))
+        self.assertEqual([value_of(packet) for packet in node.drain()], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+from amfiprot import Packet, StructPayload, Field
+from amfiprot.common_payload import RequestFirmwareVersionPayload
+from amfiprot.packet import PacketType, CrcValidation, FrameError, HEADER_LENGTH, check_frame, is_control_frame
+
+
+class SamplePayload(StructPayload):
+    PAYLOAD_TYPE = 0x42
+    PAYLOAD_ID = 0x01
+    FIELDS = (Field('value', 'f'),)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class TestIsControlFrame(unittest.TestCase):
+    def frame(self, payload, packet_type: PacketType) -> bytes:
+        return Packet.from_payload(payload, source_id=3, packet_type=packet_type).to_bytes()
+
+    def test_classification(self):
+        cases = [
+            (PacketType.NO_ACK, SamplePayload(1.0), False),
+            (PacketType.REQUEST_ACK, SamplePayload(1.0), False),
+            (PacketType.ACK, SamplePayload(1.0), True),
+            (PacketType.REPLY, SamplePayload(1.0), True),
+            (PacketType.NO_ACK, RequestFirmwareVersionPayload(), True),
+            (PacketType.REQUEST_ACK, RequestFirmwareVersionPayload(), True),
+            (PacketType.ACK, RequestFirmwareVersionPayload(), True),
+            (PacketType.REPLY, RequestFirmwareVersionPayload(), True),
+        ]
+
+        for packet_type, payload, control in cases:
+            with self.subTest(packet_type=packet_type, payload_type=payload.type):
+                self.assertEqual(is_control_frame(self.frame(payload, packet_type)), control)
+
+    def test_offset(self):
+        frame = self.frame(SamplePayload(1.0), PacketType.ACK)
+
+        self.assertTrue(is_control_frame(b'\x01\x10' + frame, 2))
+
+    def test_same_encoding_as_packet(self):
+        for packet_type in PacketType:
+            with self.subTest(packet_type=packet_type):
+                packet = Packet(self.frame(SamplePayload(1.0), packet_type))
+
+                self.assertEqual(packet.packet_type, packet_type)
+                self.assertEqual(is_control_frame(packet.data), packet_type >= PacketType.ACK)
+
+
+class TestCheckFrame(unittest.TestCase):
+    def setUp(self):
+        self.frame = bytearray(Packet.from_payload(SamplePayload(1.0), source_id=3).to_bytes())
+        self.payload_crc_index = len(self.frame) - 1
+
+    def corrupted(self, index: int) -> bytearray:
+        frame = bytearray(self.frame)
+        frame[index] ^= 0x01
+        return frame
+
+    def test_good(self):
+        for validation in CrcValidation:
+            with self.subTest(validation=validation):
+                self.assertEqual(check_frame(self.frame, 0, validation), FrameError.NONE)
+
+    def test_header_crc(self):
+        for index in range(HEADER_LENGTH + 1):  # The header fields and their CRC
+            with self.subTest(index=index):
+                frame = self.corrupted(index)
+
+                self.assertEqual(check_frame(frame, 0, CrcValidation.FULL), FrameError.HEADER_CRC)
+                self.assertEqual(check_frame(frame, 0, CrcValidation.HEADER), FrameError.HEADER_CRC)
+                self.assertEqual(check_frame(frame, 0, CrcValidation.OFF), FrameError.NONE)
+
+    def test_payload_crc(self):
+        for index in range(HEADER_LENGTH + 1, len(self.frame)):  # The payload and its CRC
+            with self.subTest(index=index):
+                frame = self.corrupted(index)
+
+                self.assertEqual(check_frame(frame, 0, CrcValidation.FULL), FrameError.PAYLOAD_CRC)
+                self.assertEqual(check_frame(frame, 0, CrcValidation.HEADER), FrameError.NONE)
+
+    def test_malformed(self):
+        self.assertEqual(check_frame(self.frame[:HEADER_LENGTH], 0, CrcValidation.HEADER), FrameError.MALFORMED)
+        self.assertEqual(check_frame(self.frame[:-1], 0, CrcValidation.FULL), FrameError.MALFORMED)
+        self.assertEqual(check_frame(self.frame[:-1], 0, CrcValidation.HEADER), FrameError.NONE)
+
+    def test_offset(self):
+        report = bytearray(b'\x01\x10') + self.frame
+        self.assertEqual(check_frame(report, 2), FrameError.NONE)
+
+        report[2 + self.payload_crc_index] ^= 0x01
+        self.assertEqual(check_frame(report, 2), FrameError.PAYLOAD_CRC)
+        self.assertEqual(check_frame(report, 0), FrameError.HEADER_CRC)
+
+    def test_packet_crc_is_good(self):
+        self.assertTrue(Packet(self.frame).crc_is_good())
+        self.assertFalse(Packet(self.corrupted(1)).crc_is_good())
+        self.assertFalse(Packet(self.corrupted(self.payload_crc_index)).crc_is_good())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+import multiprocessing as mp
+import queue
+import threading
+import time
+import unittest
+from unittest import mock
+
+from amfiprot import receive_queue
+from amfiprot.receive_queue import ReceiveQueue, QueuePolicy, Notifier, deliver
+
+
+def taken(channel: ReceiveQueue) -> list:
+    return [channel.get_nowait() for _ in range(channel.qsize())]
+
+
+class TestOffer(unittest.TestCase):
+    def test_no_limit(self):
+        channel = ReceiveQueue(queue.Queue())
+
+        for number in range(100):
+            self.assertEqual(channel.offer(bytes([number])), 0)
+
+        self.assertEqual(channel.qsize(), 100)
+        self.assertEqual(channel.dropped, 0)
+
+    def test_drop_oldest(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=3, policy=QueuePolicy.DROP_OLDEST)
+
+        dropped = sum(channel.offer(bytes([number])) for number in range(5))
+
+        self.assertEqual(dropped, 2)
+        self.assertEqual(channel.dropped, 2)
+        self.assertEqual(taken(channel), [b'\x02', b'\x03', b'\x04'])
+
+    def test_drop_newest(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=3, policy=QueuePolicy.DROP_NEWEST)
+
+        dropped = sum(channel.offer(bytes([number])) for number in range(5))
+
+        self.assertEqual(dropped, 2)
+        self.assertEqual(taken(channel), [b'\x00', b'\x01', b'\x02'])
+
+    def test_conflate(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=3, policy=QueuePolicy.CONFLATE)
+
+        dropped = sum(channel.offer(bytes([number])) for number in range(5))
+
+        self.assertEqual(dropped, 4)
+        self.assertEqual(taken(channel), [b'\x04'])
+
+    def test_not_evictable_drops_new_frame(self):
+        for policy in (QueuePolicy.DROP_OLDEST, QueuePolicy.CONFLATE):
+            with self.subTest(policy=policy):
+                channel = ReceiveQueue(queue.Queue(), capacity=2, policy=policy, evictable=False)
+
+                dropped = sum(channel.offer(bytes([number])) for number in range(4))
+
+                self.assertEqual(dropped, 2)
+                self.assertEqual(taken(channel), [b'\x00', b'\x01'])
+
+    def test_nothing_to_evict_drops_new_frame(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=1, policy=QueuePolicy.DROP_OLDEST)
+        channel.offer(b'\x00')
+        channel.queue.get_nowait()  # Gone from the queue, but not yet counted as taken
+
+        self.assertEqual(channel.offer(b'\x01'), 1)
+        self.assertEqual(channel.dropped, 1)
+
+    def test_wrapped_queue_full(self):
+        channel = ReceiveQueue(queue.Queue(maxsize=1), policy=QueuePolicy.DROP_NEWEST)
+
+        self.assertEqual(channel.offer(b'\x00'), 0)
+        self.assertEqual(channel.offer(b'\x01'), 1)
+        self.assertEqual(channel.qsize(), 1)
+
+    def test_policy_changed_while_used(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=2, policy=QueuePolicy.DROP_NEWEST)
+        channel.offer(b'\x00')
+        channel.offer(b'\x01')
+
+        channel.policy = QueuePolicy.DROP_OLDEST
+        self.assertEqual(channel.offer(b'\x02'), 1)
+        self.assertEqual(taken(channel), [b'\x01', b'\x02'])
+
+
+class TestBlock(unittest.TestCase):
+    def test_drops_after_timeout(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=1, policy=QueuePolicy.BLOCK)
+        channel.offer(b'\x00')
+
+        with mock.patch.object(receive_queue, 'BLOCK_TIMEOUT', 0.01):
+            start = time.monotonic()
+            self.assertEqual(channel.offer(b'\x01'), 1)
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.01)
+        self.assertEqual(taken(channel), [b'\x00'])
+
+    def test_waits_for_consumer(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=1, policy=QueuePolicy.BLOCK)
+        channel.offer(b'\x00')
+
+        consumer = threading.Timer(0.02, channel.get_nowait)
+        consumer.start()
+
+        self.assertEqual(channel.offer(b'\x01'), 0)
+        consumer.join()
+        self.assertEqual(taken(channel), [b'\x01'])
+        self.assertEqual(channel.dropped, 0)
+
+
+class TestCapacityBytes(unittest.TestCase):
+    def test_drop_oldest_until_frame_fits(self):
+        channel = ReceiveQueue(queue.Queue(), capacity_bytes=10, policy=QueuePolicy.DROP_OLDEST)
+        channel.offer(b'a' * 4)
+        channel.offer(b'b' * 4)
+
+        self.assertEqual(channel.offer(b'c' * 6), 1)
+        self.assertEqual(channel.qsize_bytes(), 10)
+        self.assertEqual(taken(channel), [b'b' * 4, b'c' * 6])
+
+    def test_drop_newest(self):
+        channel = ReceiveQueue(queue.Queue(), capacity_bytes=10, policy=QueuePolicy.DROP_NEWEST)
+        channel.offer(b'a' * 8)
+
+        self.assertEqual(channel.offer(b'b' * 3), 1)
+        self.assertEqual(channel.offer(b'c' * 2), 0)
+        self.assertEqual(channel.qsize_bytes(), 10)
+
+    def test_frame_larger_than_capacity(self):
+        channel = ReceiveQueue(queue.Queue(), capacity_bytes=4, policy=QueuePolicy.DROP_OLDEST)
+        channel.offer(b'a' * 2)
+
+        self.assertEqual(channel.offer(b'b' * 5), 2)  # The queued frame is evicted, and the new one still dropped
+        self.assertEqual(channel.qsize(), 0)
+
+    def test_timestamps_not_counted(self):
+        channel = ReceiveQueue(queue.Queue(), capacity_bytes=4)
+        channel.offer((time.time(), b'a' * 4))
+
+        self.assertEqual(channel.qsize_bytes(), 4)
+
+    def test_frames_and_bytes(self):
+        channel = ReceiveQueue(queue.Queue(), capacity=2, capacity_bytes=100, policy=QueuePolicy.DROP_NEWEST)
+
+        self.assertEqual(sum(channel.offer(b'a') for _ in range(3)), 1)
+
+    def test_taking_frees_room(self):
+        channel = ReceiveQueue(queue.Queue(), capacity_bytes=4, policy=QueuePolicy.DROP_NEWEST)
+        channel.offer(b'a' * 4)
+        channel.get_nowait()
+
+        self.assertEqual(channel.offer(b'b' * 4), 0)
+        self.assertEqual(channel.qsize_bytes(), 4)
+
+
+class TestWatermarks(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.channel = ReceiveQueue(queue.Queue())
+        self.channel.set_watermarks(3, 1, on_high=lambda channel: self.events.append('high'),
+                                    on_low=lambda channel: self.events.append('low'))
+
+    def test_high_then_low(self):
+        for number in range(4):
+            self.channel.offer(bytes([number]))
+            self.channel.empty()  # Levels are checked by the consumer
+
+        self.assertEqual(self.events, ['high'])
+
+        self.channel.get_nowait()
+        self.channel.get_nowait()
+        self.assertEqual(self.events, ['high'])
+
+        self.channel.get_nowait()
+        self.assertEqual(self.events, ['high', 'low'])
+
+    def test_high_once_until_low(self):
+        for number in range(3):
+            self.channel.offer(bytes([number]))
+
+        self.channel.get_nowait()  # 2 left
+        self.channel.offer(b'\x03')
+        self.channel.empty()
+
+        self.assertEqual(self.events, ['high'])
+
+    def test_checked_by_get_many(self):
+        for number in range(3):
+            self.channel.offer(bytes([number]))
+
+        self.channel.empty()
+        self.assertEqual(len(self.channel.get_many(3)), 3)
+        self.assertEqual(self.events, ['high', 'low'])
+
+
+class TestNotifier(unittest.TestCase):
+    def test_signalled_once_until_cleared(self):
+        notifier = Notifier()
+        channel = ReceiveQueue(queue.Queue(), notifier=notifier)
+        self.addCleanup(notifier.close)
+
+        channel.offer(b'\x00')
+        channel.offer(b'\x01')
+        self.assertEqual(len(notifier._receiver.recv(16)), 1)
+
+        notifier.clear()
+        channel.offer(b'\x02')
+        self.assertEqual(len(notifier._receiver.recv(16)), 1)
+
+    def test_dropped_frame_not_signalled(self):
+        notifier = Notifier()
+        channel = ReceiveQueue(queue.Queue(), capacity=1, policy=QueuePolicy.DROP_NEWEST, notifier=notifier)
+        self.addCleanup(notifier.close)
+
+        channel.offer(b'\x00')
+        notifier.clear()
+        channel.offer(b'\x01')
+
+        with self.assertRaises(BlockingIOError):
+            notifier._receiver.recv(16)
+
+
+class TestBlockingGet(unittest.TestCase):
+    def setUp(self):
+        self.notifier = Notifier()
+        self.addCleanup(self.notifier.close)
+        self.channel = ReceiveQueue(queue.Queue(), notifier=self.notifier)
+
+    def test_woken_by_offer(self):
+        self.notifier.notify()  # Signalled before, e.g. for a frame that was already taken
+        producer = threading.Timer(0.02, self.channel.offer, (b'\x00',))
+        producer.start()
+
+        self.assertEqual(self.channel.get(timeout=1), b'\x00')
+        producer.join()
+        self.assertEqual(self.channel.qsize(), 0)
+
+    def test_timeout(self):
+        with self.assertRaises(queue.Empty):
+            self.channel.get(timeout=0.01)
+
+
+class TestInFlight(unittest.TestCase):
+    """ Frames put in a multiprocessing.Queue reach its pipe through a feeder thread, after they are counted. """
+    def setUp(self):
+        self.wrapped = mp.Queue()
+        self.addCleanup(self.wrapped.close)
+        self.channel = ReceiveQueue(self.wrapped)
+
+    def test_counted_frame_taken(self):
+        for number in range(20):
+            self.channel.offer(bytes([number]))
+            self.assertFalse(self.channel.empty())
+            self.assertEqual(self.channel.get_nowait(), bytes([number]))
+
+        self.assertTrue(self.channel.empty())
+
+    def test_get_many_takes_counted_frame(self):
+        self.channel.offer(b'\x00')
+
+        self.assertEqual(self.channel.get_many(4), [b'\x00'])
+
+    def test_nothing_counted(self):
+        start = time.monotonic()
+
+        with self.assertRaises(queue.Empty):
+            self.channel.get_nowait()
+
+        self.assertLess(time.monotonic() - start, receive_queue.ARRIVAL_TIMEOUT)
+
+
+class TestDeliver(unittest.TestCase):
+    def test_plain_queue_drops_when_full(self):
+        channel = queue.Queue(maxsize=1)
+
+        self.assertEqual(deliver(channel, b'\x00'), 0)
+        self.assertEqual(deliver(channel, b'\x01'), 1)
+        self.assertEqual(channel.get_nowait(), b'\x00')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import array
+import unittest
+from importlib import metadata
+from unittest import mock
+
+from amfiprot import PayloadRegistry, StructPayload, Field, payload_registry
+from amfiprot.common_payload import ReplyFirmwareVersionPayload
+from amfiprot.payload import PayloadType, UndefinedPayload
+from amfiprot.response_payload import SuccessPayload
+
+GROUP = 'amfiprot.test_payloads'
+
+
+class SamplePayload(StructPayload):
+    PAYLOAD_TYPE = 0x42
+    PAYLOAD_ID = 0x01
+    FIELDS = (Field('value', 'B'),)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class TypePayload(UndefinedPayload):
+    def __init__(self, data: array.array):
+        super().__init__(data, 0x42)
+
+
+def register_plugin(registry: PayloadRegistry):
+    registry.register(SamplePayload)
+
+
+def failing_plugin(registry: PayloadRegistry):
+    raise RuntimeError("Plugin failed")
+
+
+def entry_points(*names: str):
+    """ The result of ``importlib.metadata.entry_points()`` with entry points of this module in GROUP. """
+    points = [metadata.EntryPoint(name, f'{__name__}:{name}', GROUP) for name in names]
+    if hasattr(metadata, 'EntryPoints'):
+        return metadata.EntryPoints(points)
+
+    return {GROUP: points}  # Python < 3.10
+
+
+class TestPayloadRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = PayloadRegistry(entry_point_group=None)
+
+    def test_register(self):
+        self.registry.register(SamplePayload)
+
+        self.assertIs(self.registry.lookup(0x42, 0x01), SamplePayload)
+        self.assertIsNone(self.registry.lookup(0x42, 0x02))
+        self.assertIsNone(self.registry.lookup(0x43, 0x01))
+        self.assertTrue(self.registry.is_registered(0x42))
+
+        payload = self.registry.create(0x42, b'\x01\x07')
+        self.assertIsInstance(payload, SamplePayload)
+        self.assertEqual(payload.value, 7)
+
+    def test_register_decorator(self):
+        decorated = self.registry.register(payload_type=0x50, payload_id=0x02)(SamplePayload)
+
+        self.assertIs(decorated, SamplePayload)
+        self.assertIs(self.registry.lookup(0x50, 0x02), SamplePayload)
+        self.assertIsNone(self.registry.lookup(0x42, 0x01))
+
+    def test_register_without_id(self):
+        with self.assertRaises(ValueError):
+            self.registry.register(TypePayload, payload_type=0x42)
+
+    def test_register_type(self):
+        self.registry.register_type(0x42, TypePayload)
+        self.registry.register(SamplePayload)
+
+        self.assertIs(self.registry.lookup(0x42, 0x01), SamplePayload)
+        self.assertIs(self.registry.lookup(0x42, 0x02), TypePayload)
+        self.assertIsInstance(self.registry.create(0x42, b'\x01\x07'), SamplePayload)
+
+        payload = self.registry.create(0x42, b'\x02\x07')
+        self.assertIs(type(payload), TypePayload)
+        self.assertEqual(payload.data, array.array('B', b'\x02\x07'))
+
+    def test_unregister(self):
+        self.registry.register_type(0x42, TypePayload)
+        self.registry.register(SamplePayload)
+
+        self.registry.unregister(0x42, 0x01)
+        self.assertIs(type(self.registry.create(0x42, b'\x01\x07')), TypePayload)
+
+        self.registry.unregister(0x42)
+        self.assertFalse(self.registry.is_registered(0x42))
+        self.assertIs(type(self.registry.create(0x42, b'\x01\x07')), UndefinedPayload)
+
+    def test_unregistered(self):
+        payload = self.registry.create(0x42, memoryview(b'\x01\x07'))
+
+        self.assertIs(type(payload), UndefinedPayload)
+        self.assertEqual(payload.type, 0x42)
+        self.assertEqual(payload.data, array.array('B', b'\x01\x07'))
+
+    def test_default_registry(self):
+        self.assertIs(payload_registry.lookup(PayloadType.COMMON, ReplyFirmwareVersionPayload.PAYLOAD_ID),
+                      ReplyFirmwareVersionPayload)
+        self.assertIs(payload_registry.lookup(PayloadType.SUCCESS), SuccessPayload)
+        self.assertIsInstance(payload_registry.create(PayloadType.SUCCESS, b'\x00'), SuccessPayload)
+
+
+class TestEntryPoints(unittest.TestCase):
+    def test_loaded_for_unregistered_type(self):
+        registry = PayloadRegistry(GROUP)
+        registry.register(ReplyFirmwareVersionPayload)
+
+        with mock.patch.object(metadata, 'entry_points', return_value=entry_points('register_plugin')) as patched:
+            registry.create(PayloadType.COMMON, b'\x03')
+            patched.assert_not_called()  # Registered type
+
+            payload = registry.create(0x42, b'\x01\x07')
+            registry.create(0x43, b'\x01\x07')
+
+        self.assertIsInstance(payload, SamplePayload)
+        patched.assert_called_once()
+
+    def test_failing_plugin_warns(self):
+        registry = PayloadRegistry(GROUP)
+        points = entry_points('failing_plugin', 'missing_plugin', 'register_plugin')
+
+        with mock.patch.object(metadata, 'entry_points', return_value=points):
+            with self.assertWarns(UserWarning) as warnings:
+                payload = registry.create(0x42, b'\x01\x07')
+
+        self.assertIsInstance(payload, SamplePayload)
+        messages = [str(warning.message) for warning in warnings.warnings]
+        self.assertEqual(len(messages), 2)
+        self.assertIn('failing_plugin', messages[0])
+        self.assertIn('Plugin failed', messages[0])
+        self.assertIn('missing_plugin', messages[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import multiprocessing as mp
+import queue
+import time
+import unittest
+
+from amfiprot.ring import SharedMemoryRing, MAX_FRAME_LENGTH
+
+FRAMES = 2000  # Frames sent between processes, many times the capacity of the ring
+
+
+def frame(number: int) -> bytes:
+    return number.to_bytes(4, 'little') * (1 + number % 8)
+
+
+def produce(ring: SharedMemoryRing, count: int):
+    for number in range(count):
+        ring.put(frame(number), timeout=10)
+
+    ring.close()
+
+
+class TestSharedMemoryRing(unittest.TestCase):
+    def create_ring(self, capacity: int) -> SharedMemoryRing:
+        ring = SharedMemoryRing(capacity)
+        self.addCleanup(ring.close)
+        return ring
+
+    def test_frames(self):
+        ring = self.create_ring(4)
+        ring.put_nowait(b'\x01\x02')
+        ring.put_nowait((12.5, b'\x03'))
+        ring.put_nowait(bytes(MAX_FRAME_LENGTH))
+
+        self.assertEqual(ring.qsize(), 3)
+        self.assertEqual(ring.get_nowait(), b'\x01\x02')
+        self.assertEqual(ring.get_nowait(), (12.5, b'\x03'))
+        self.assertEqual(ring.get_nowait(), bytes(MAX_FRAME_LENGTH))
+        self.assertTrue(ring.empty())
+
+        with self.assertRaises(queue.Empty):
+            ring.get_nowait()
+        with self.assertRaises(ValueError):
+            ring.put_nowait(bytes(MAX_FRAME_LENGTH + 1))
+
+    def test_wraparound(self):
+        ring = self.create_ring(4)
+        number = 0
+
+        for _ in range(10):
+            for offset in range(3):
+                ring.put_nowait(frame(number + offset))
+
+            self.assertEqual(ring.get_nowait(), frame(number))
+            self.assertEqual(ring.get_many(5), [frame(number + 1), frame(number + 2)])
+            number += 3
+
+        self.assertTrue(ring.empty())
+        self.assertEqual(ring.get_many(5), [])
+
+    def test_full(self):
+        ring = self.create_ring(3)
+        for number in range(3):
+            ring.put_nowait(frame(number))
+
+        self.assertTrue(ring.full())
+        with self.assertRaises(queue.Full):
+            ring.put_nowait(frame(3))
+        with self.assertRaises(queue.Full):
+            ring.put(frame(3), block=False)
+
+        start = time.monotonic()
+        with self.assertRaises(queue.Full):
+            ring.put(frame(3), timeout=0.02)
+        self.assertGreaterEqual(time.monotonic() - start, 0.02)
+
+        # The frames already in the ring are kept, and the slot of a taken frame is reused
+        self.assertEqual(ring.get_nowait(), frame(0))
+        self.assertFalse(ring.full())
+        ring.put_nowait(frame(3))
+        self.assertEqual(ring.get_many(5), [frame(1), frame(2), frame(3)])
+
+    def test_get_timeout(self):
+        ring = self.create_ring(4)
+
+        start = time.monotonic()
+        with self.assertRaises(queue.Empty):
+            ring.get(timeout=0.02)
+        self.assertGreaterEqual(time.monotonic() - start, 0.02)
+
+    def test_producer_process(self):
+        ring = self.create_ring(16)
+        producer = mp.Process(target=produce, args=(ring, FRAMES))
+        producer.start()
+
+        try:
+            received = [ring.get(timeout=10) for _ in range(FRAMES)]
+        finally:
+            producer.join(10)
+
+        self.assertEqual(producer.exitcode, 0)
+        self.assertEqual(received, [frame(number) for number in range(FRAMES)])
+        self.assertTrue(ring.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
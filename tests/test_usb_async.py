@@ -0,0 +1,159 @@
+import ctypes
+import unittest
+
+import usb.core
+from usb.backend.libusb1 import (LIBUSB_TRANSFER_COMPLETED, LIBUSB_TRANSFER_CANCELLED, LIBUSB_TRANSFER_NO_DEVICE,
+                                 LIBUSB_TRANSFER_TIMED_OUT, _libusb_transfer)
+
+from amfiprot.usb_async import AsyncReader
+
+
+class FakeLibusb:
+    """ The libusb functions used by AsyncReader. Transfers are completed in submission order, with the outcomes given
+    to :meth:`complete`, when events are handled. """
+    def __init__(self):
+        self.queued = []  # Submitted transfers, oldest first
+        self.outcomes = []  # (status, data) for the next transfers to complete
+        self.cancelled = []
+        self.allocated = []
+        self.freed = []
+        self.submissions = 0
+        self.submit_result = 0
+
+    def complete(self, status: int, data: bytes = b''):
+        self.outcomes.append((status, data))
+
+    def libusb_alloc_transfer(self, iso_packets):
+        transfer = _libusb_transfer()
+        self.allocated.append(transfer)
+        return ctypes.pointer(transfer)
+
+    def libusb_free_transfer(self, transfer_p):
+        self.freed.append(ctypes.addressof(transfer_p.contents))
+
+    def libusb_submit_transfer(self, transfer_p):
+        if self.submit_result < 0:
+            return self.submit_result
+
+        self.submissions += 1
+        self.queued.append(transfer_p)
+        return 0
+
+    def libusb_cancel_transfer(self, transfer_p):
+        for index, queued_p in enumerate(self.queued):
+            if ctypes.addressof(queued_p.contents) == ctypes.addressof(transfer_p.contents):
+                self.cancelled.append(self.queued.pop(index))
+                return 0
+
+        return -5  # LIBUSB_ERROR_NOT_FOUND
+
+    def libusb_handle_events_timeout(self, context, timeval_p):
+        while self.cancelled:
+            self._finish(self.cancelled.pop(0), LIBUSB_TRANSFER_CANCELLED, b'')
+
+        while self.outcomes and self.queued:
+            status, data = self.outcomes.pop(0)
+            self._finish(self.queued.pop(0), status, data)
+
+        return 0
+
+    @staticmethod
+    def _finish(transfer_p, status: int, data: bytes):
+        transfer = transfer_p.contents
+        transfer.status = status
+        ctypes.memmove(transfer.buffer, data, len(data))
+        transfer.actual_length = len(data)
+        transfer.callback(transfer_p)
+
+
+class TestAsyncReader(unittest.TestCase):
+    def setUp(self):
+        self.lib = FakeLibusb()
+        self.reader = AsyncReader(self.lib, None, None, transfers=3, length=8)
+
+    def test_transfers_submitted(self):
+        self.assertEqual(self.reader.pending, 3)
+        self.assertEqual(len(self.lib.queued), 3)
+
+    def test_read_returns_reports_in_order(self):
+        self.lib.complete(LIBUSB_TRANSFER_COMPLETED, b'\x01\x02')
+        self.lib.complete(LIBUSB_TRANSFER_COMPLETED, b'\x03')
+
+        self.assertEqual(list(self.reader.read(timeout=100)), [1, 2])
+        self.assertEqual(list(self.reader.read(timeout=100)), [3])
+
+    def test_completed_transfers_resubmitted(self):
+        for number in range(10):
+            self.lib.complete(LIBUSB_TRANSFER_COMPLETED, bytes([number]))
+
+        reports = [self.reader.read(timeout=100)[0] for _ in range(10)]
+
+        self.assertEqual(reports, list(range(10)))
+        self.assertEqual(self.lib.submissions, 13)
+        self.assertEqual(self.reader.pending, 3)
+
+    def test_timed_out_transfer_resubmitted(self):
+        self.lib.complete(LIBUSB_TRANSFER_TIMED_OUT)
+
+        with self.assertRaises(usb.core.USBTimeoutError):
+            self.reader.read(timeout=1)
+
+        self.assertEqual(self.reader.pending, 3)
+
+    def test_transfer_error_raises_usb_error(self):
+        self.lib.complete(LIBUSB_TRANSFER_NO_DEVICE)
+
+        with self.assertRaises(usb.core.USBError) as context:
+            self.reader.read(timeout=100)
+
+        self.assertNotIsInstance(context.exception, usb.core.USBTimeoutError)
+        self.assertEqual(self.reader.error, LIBUSB_TRANSFER_NO_DEVICE)
+        self.assertEqual(self.reader.pending, 2)  # The failed transfer is not resubmitted
+
+    def test_reports_before_error_still_read(self):
+        self.lib.complete(LIBUSB_TRANSFER_COMPLETED, b'\x07')
+        self.lib.complete(LIBUSB_TRANSFER_NO_DEVICE)
+
+        self.assertEqual(list(self.reader.read(timeout=100)), [7])
+
+        with self.assertRaises(usb.core.USBError):
+            self.reader.read(timeout=100)
+
+    def test_failed_resubmission_raises_usb_error(self):
+        self.lib.submit_result = -4  # LIBUSB_ERROR_NO_DEVICE
+        self.lib.complete(LIBUSB_TRANSFER_COMPLETED, b'\x01')
+
+        self.assertEqual(list(self.reader.read(timeout=100)), [1])
+        self.assertIsNotNone(self.reader.error)
+
+        with self.assertRaises(usb.core.USBError):
+            self.reader.read(timeout=100)
+
+    def test_close_frees_transfers(self):
+        self.lib.complete(LIBUSB_TRANSFER_COMPLETED, b'\x01')
+        self.reader.read(timeout=100)
+
+        self.reader.close()
+
+        self.assertEqual(self.reader.pending, 0)
+        self.assertEqual(len(self.lib.queued), 0)
+        self.assertEqual(sorted(self.lib.freed), sorted(ctypes.addressof(transfer) for transfer in self.lib.allocated))
+
+    def test_close_does_not_resubmit(self):
+        submissions = self.lib.submissions
+        self.reader.close()
+
+        self.assertEqual(self.lib.submissions, submissions)
+
+    def test_failed_submission_frees_transfers(self):
+        lib = FakeLibusb()
+        lib.submit_result = -4
+
+        with self.assertRaises(usb.core.USBError):
+            AsyncReader(lib, None, None, transfers=2)
+
+        self.assertEqual(len(lib.freed), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
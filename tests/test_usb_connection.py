@@ -0,0 +1,211 @@
+import array
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import usb.core
+
+from amfiprot import ConnectionStatistics, CrcValidation, Packet, USBConnection, TransportMode
+from amfiprot.common_payload import RequestFirmwareVersionPayload
+from amfiprot.connection import STOP_SENTINEL, release_receive_channels
+from amfiprot.packet import HEADER_LENGTH, packet_from_frame
+from amfiprot.usb_connection import REPORT_HEADER_LENGTH, STOP_TIMEOUT, UsbDeviceHandle, usb_read_loop, usb_write_loop
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks'))
+from simulation import TX_ID, SimulatedDevice, make_report  # noqa: E402
+
+READ_INTERVAL = 0.0002  # Seconds between reports of the simulated device
+WRITE_TIME = 0.001  # Seconds the simulated device takes to write a report
+STOP_DURATION = 1  # Seconds a stop should take at most: the packets left to send, and a read timeout
+
+
+class ScriptedDevice:
+    """ Stands in for a usb.core.Device, returning the given reports, and then setting ``stop_event``. """
+    def __init__(self, reports, stop_event: threading.Event):
+        self.reports = list(reports)
+        self.stop_event = stop_event
+
+    def read(self, endpoint, length, timeout=None):
+        if len(self.reports) == 0:
+            self.stop_event.set()
+            raise usb.core.USBTimeoutError("No more reports", None, None)
+
+        return self.reports.pop(0)
+
+
+def corrupted(report: array.array, index: int) -> array.array:
+    """ ``report`` with a bit flipped in byte ``index`` of the packet. """
+    report = array.array('B', report)
+    report[REPORT_HEADER_LENGTH + index] ^= 0x01
+    return report
+
+
+def read_reports(reports, crc_validation: CrcValidation, rx_queue=None) -> ConnectionStatistics:
+    """ Run the read loop until it has read ``reports``, returning its statistics. """
+    statistics = ConnectionStatistics()
+    stop_event = threading.Event()
+    device = UsbDeviceHandle(None, ScriptedDevice(reports, stop_event))
+    rx_queue = queue.Queue() if rx_queue is None else rx_queue
+
+    usb_read_loop(device, [TX_ID], [rx_queue], None, queue.Queue(), crc_validation, statistics, stop_event)
+    return statistics
+
+
+class TestReadStatistics(unittest.TestCase):
+    def setUp(self):
+        self.good = make_report()
+        self.header_crc = corrupted(self.good, HEADER_LENGTH)
+        self.payload_crc = corrupted(self.good, HEADER_LENGTH + 1)
+        self.malformed = self.good[:REPORT_HEADER_LENGTH + HEADER_LENGTH]
+
+    def test_full(self):
+        rx_queue = queue.Queue()
+        statistics = read_reports([self.good, self.header_crc, self.payload_crc, self.malformed, self.good],
+                                  CrcValidation.FULL, rx_queue)
+
+        self.assertEqual(statistics.to_dict(), {'accepted': 2, 'dropped_malformed': 1, 'dropped_header_crc': 1,
+                                                'dropped_payload_crc': 1, 'dropped_queue_full': 0,
+                                                'dropped_transmit': 0})
+        self.assertEqual(statistics.dropped, 3)
+        self.assertEqual(rx_queue.qsize(), 2)
+        self.assertTrue(packet_from_frame(rx_queue.get()).crc_is_good())
+
+    def test_header(self):
+        statistics = read_reports([self.good, self.header_crc, self.payload_crc, self.malformed],
+                                  CrcValidation.HEADER)
+
+        self.assertEqual(statistics.accepted, 2)
+        self.assertEqual(statistics.dropped_header_crc, 1)
+        self.assertEqual(statistics.dropped_payload_crc, 0)
+        self.assertEqual(statistics.dropped_malformed, 1)
+
+    def test_off(self):
+        statistics = read_reports([self.good, self.header_crc, self.payload_crc], CrcValidation.OFF)
+
+        self.assertEqual(statistics.accepted, 3)
+        self.assertEqual(statistics.dropped, 0)
+
+    def test_queue_full(self):
+        statistics = read_reports([self.good] * 3, CrcValidation.FULL, queue.Queue(1))
+
+        self.assertEqual(statistics.accepted, 3)
+        self.assertEqual(statistics.dropped_queue_full, 2)
+
+        statistics.reset()
+        self.assertEqual(statistics.accepted, 0)
+        self.assertEqual(statistics.dropped_queue_full, 0)
+
+
+def read_task(device, rx_queue, global_receive_queue, node_update_queue, stop_event):
+    """ The reader process, as started by USBConnection, with a simulated device. """
+    usb_read_loop(device, [TX_ID], [rx_queue], global_receive_queue, node_update_queue, stop_event=stop_event)
+    release_receive_channels([global_receive_queue, rx_queue])
+
+
+def request() -> Packet:
+    return Packet.from_payload(RequestFirmwareVersionPayload(), destination_id=TX_ID)
+
+
+class TestStop(unittest.TestCase):
+    def test_writer_drains_before_sentinel(self):
+        written, drained = mp.Value('i', 0), threading.Event()
+        device = UsbDeviceHandle(None, SimulatedDevice(make_report(), READ_INTERVAL, WRITE_TIME, written))
+        tx_queue = queue.Queue()
+
+        for packet in [request()] * 20 + [STOP_SENTINEL] + [request()] * 5:
+            tx_queue.put(packet)
+
+        writer = threading.Thread(target=usb_write_loop, args=(device, tx_queue, threading.Event()),
+                                  kwargs={'drained': drained})
+        writer.start()
+
+        self.assertTrue(drained.wait(STOP_TIMEOUT))
+        self.assertEqual(written.value, 20)
+        writer.join(STOP_TIMEOUT)
+        self.assertFalse(writer.is_alive())  # Without the stop event
+        self.assertEqual(tx_queue.qsize(), 5)
+
+    def test_stop_with_unread_global_queue(self):
+        """ The workers in processes, stopped as USBConnection.stop() does, after the reader filled the pipe of a
+        global receive queue that nobody reads. """
+        stop_event, drained, written = mp.Event(), mp.Event(), mp.Value('i', 0)
+        rx_queue, global_receive_queue, tx_queue = mp.Queue(), mp.Queue(), mp.Queue()
+        device = UsbDeviceHandle(None, SimulatedDevice(make_report(), READ_INTERVAL, WRITE_TIME, written))
+
+        reader = mp.Process(target=read_task, args=(device, rx_queue, global_receive_queue, mp.Queue(), stop_event))
+        writer = mp.Process(target=usb_write_loop, args=(device, tx_queue, stop_event), kwargs={'drained': drained})
+        reader.start()
+        writer.start()
+
+        try:
+            for _ in range(2000):  # More than the pipe of the global receive queue holds
+                rx_queue.get(timeout=STOP_TIMEOUT)
+
+            for _ in range(50):
+                tx_queue.put(request())
+
+            start = time.monotonic()
+            tx_queue.put(STOP_SENTINEL)
+            self.assertTrue(drained.wait(STOP_TIMEOUT))
+            stop_event.set()
+
+            for worker in (writer, reader):
+                worker.join(STOP_TIMEOUT)
+            elapsed = time.monotonic() - start
+
+            self.assertEqual((writer.exitcode, reader.exitcode), (0, 0))
+            self.assertLess(elapsed, STOP_DURATION)
+            self.assertEqual(written.value, 50)
+        finally:
+            for worker in (writer, reader):
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+
+
+class UnpluggedDevice:
+    """ Stands in for a usb.core.Device that is unplugged at its first read. """
+    idVendor, idProduct, manufacturer, product, serial_number, bus, port_numbers = 0xC17, 0xD12, 'M', 'P', '1', 1, (1,)
+
+    def read(self, endpoint, length, timeout=None):
+        raise usb.core.USBError("No such device")
+
+
+class IdleDevice(UnpluggedDevice):
+    """ Stands in for a usb.core.Device that sends nothing. """
+    def read(self, endpoint, length, timeout=None):
+        time.sleep(timeout / 1000)
+        raise usb.core.USBTimeoutError("Timed out", None, None)
+
+
+class TestThreadReconnect(unittest.TestCase):
+    def test_usb_device_follows_reconnect(self):
+        unplugged, reconnected = UnpluggedDevice(), IdleDevice()
+
+        with mock.patch('amfiprot.usb_connection.get_matching_device', return_value=unplugged), \
+                mock.patch('amfiprot.usb_connection.find_device', return_value=reconnected), \
+                mock.patch('amfiprot.usb_connection.HotplugMonitor'), \
+                mock.patch('usb.util.dispose_resources'):
+            connection = USBConnection(0xC17, 0xD12, mode=TransportMode.THREAD)
+            self.assertIs(connection.usb_device, unplugged)
+
+            connection.start()
+            try:
+                deadline = time.monotonic() + STOP_TIMEOUT
+                while connection.usb_device is not reconnected and time.monotonic() < deadline:
+                    time.sleep(0.01)
+
+                self.assertIs(connection.usb_device, reconnected)
+            finally:
+                connection.stop()
+
+        self.assertIs(connection.usb_device, reconnected)  # Used again by the next start()
+
+
+if __name__ == '__main__':
+    unittest.main()